@@ -0,0 +1,73 @@
+"""
+SQLite connection profiles.
+
+'default' is what Django does out of the box: a new connection per
+request, give up after 5s waiting on a lock, and no pragmas, so the file
+keeps whatever journal mode it already has (rollback journal for a new one).
+
+'production' is tuned for a web server with many readers and a few
+concurrent writers:
+  - WAL, so readers never block the writer and the writer never blocks readers
+  - synchronous=NORMAL, safe with WAL (a power cut can lose the last commits
+    but never corrupts the file) and much cheaper than FULL
+  - a longer busy timeout and IMMEDIATE transactions, so a writer waits for
+    the lock at BEGIN instead of failing with "database is locked" halfway
+    through an atomic block
+  - mmap and a bigger page cache for reads
+  - persistent connections, so the pragmas and the open file are paid for once
+
+Replicas (see sqlite_replica and my_app/routers.py) use the same profile but
+are opened query_only, so a write that gets routed to one fails loudly.
+"""
+
+PROFILES = {
+    'default': {
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': False,
+        'OPTIONS': {
+            'timeout': 5,
+        },
+    },
+    'production': {
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA mmap_size=134217728;'  # 128 MB
+                'PRAGMA cache_size=-20000;'    # ~20 MB
+                'PRAGMA temp_store=MEMORY;'
+            ),
+        },
+    },
+}
+
+
+def sqlite_database(name, profile='production'):
+    """A DATABASES entry for the SQLite file name using one of PROFILES."""
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown database profile {profile!r}, pick one of {', '.join(PROFILES)}")
+    config = PROFILES[profile]
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        **config,
+        'OPTIONS': dict(config['OPTIONS']),
+    }
+
+
+def sqlite_replica(name, profile='production', primary='default'):
+    """
+    A read-only DATABASES entry for a copy of the primary's SQLite file
+    (refresh it with `manage.py sync_replicas`). Under test it mirrors primary.
+    """
+    database = sqlite_database(name, profile)
+    options = database['OPTIONS']
+    #BEGIN IMMEDIATE takes a write lock, which query_only refuses
+    options.pop('transaction_mode', None)
+    options['init_command'] = options.get('init_command', '') + 'PRAGMA query_only=1;'
+    database['TEST'] = {'MIRROR': primary}
+    return database
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from djangoProject.database import sqlite_database, sqlite_replica
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -44,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'my_app.middleware.SQLInstrumentationMiddleware',  # no-op unless SQL_INSTRUMENTATION['ENABLED']
+    'my_app.middleware.ReplicaRoutingMiddleware',  # no-op unless DATABASE_REPLICAS
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -90,13 +95,22 @@ REST_FRAMEWORK = {
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Plain Django sqlite3 behaviour unless DJANGO_DB_PROFILE=production, which turns on WAL,
+# a longer busy timeout, pragmas and persistent connections, see djangoProject/database.py.
+db_profile = os.environ.get('DJANGO_DB_PROFILE', 'default')
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': sqlite_database(BASE_DIR / 'db.sqlite3', db_profile),
 }
 
+# Read replicas, see my_app/routers.py. DJANGO_DB_REPLICAS=2 adds replica1 and replica2,
+# local copies of db.sqlite3 refreshed with `manage.py sync_replicas`.
+DATABASE_REPLICAS = [f'replica{n}' for n in range(1, int(os.environ.get('DJANGO_DB_REPLICAS', 0)) + 1)]
+for alias in DATABASE_REPLICAS:
+    DATABASES[alias] = sqlite_replica(BASE_DIR / f'db-{alias}.sqlite3', db_profile)
+DATABASE_ROUTERS = ['my_app.routers.PrimaryReplicaRouter']
+# after a request writes, that browser reads from the primary for this many seconds
+REPLICA_PIN_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -143,7 +157,21 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGOUT_REDIRECT_URL = "home-page"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Generated EPUB/text downloads are kept here and reused until the story changes (see my_app/exports.py)
+EXPORT_ROOT = BASE_DIR / 'exports'
+# Seconds anonymous home/story/comment pages stay in the cache; 0 turns the page cache off (see my_app/page_cache.py)
+PAGE_CACHE_TIMEOUT = 300
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap4"
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 LOGIN_REDIRECT_URL = 'home-page'
-LOGIN_URL = 'login'
\ No newline at end of file
+LOGIN_URL = 'login'
+# Run my_app background tasks (notification fan-out etc.) in the request thread instead of a worker thread
+BACKGROUND_TASKS_INLINE = False
+
+# Per-request query count / SQL time / N+1 report (Server-Timing header + 'my_app.sql' log).
+# See my_app/middleware.py for all options.
+SQL_INSTRUMENTATION = {
+    'ENABLED': False,
+    'QUERY_BUDGET': None,
+    'RAISE_ON_BUDGET': False,
+}
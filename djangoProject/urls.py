@@ -24,6 +24,7 @@ from django.contrib.auth.views import LoginView, LogoutView
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', views.home, name = "home-page" ),
+    path('following/', views.following, name="following-feed"),
     path('register/', views.signup, name="reg-page"),
     path('login/', LoginView.as_view(template_name="login.html"), name="login"),
     path('logout/', LogoutView.as_view(next_page=settings.LOGOUT_REDIRECT_URL), name="logout"),
@@ -44,6 +45,7 @@ urlpatterns = [
     path('story/<int:pk>/report/', views.report, name="report"),
     path('story/<int:story_pk>/comment/<int:pk>/report/', views.report, name="report-comments"),
     path('story/<int:pk>/detail/', views.story_detail, name="story-detail"),
+    path('story/<int:pk>/export.<str:fmt>', views.export_story, name='export-story'),
     path('profile/', views.profile_view, name='profile'),
     path('profile/edit', views.edit_profile, name="edit-profile" ),
     path('profile/<str:username>/', views.profile_view, name='user-profile'),
@@ -51,6 +53,11 @@ urlpatterns = [
     path('search/', views.story_search, name = 'story-search'),
     path('api/notifications/', views.notification_list_api.as_view(), name='notification-list'),
     path('api/notifications/mark-read/<int:pk>/', views.notification_mark_read_api.as_view(), name='notification-read'),
+    path('api/notifications/mark-read/', views.notification_mark_all_read_api.as_view(), name='notification-mark-all-read'),
+    path('api/notifications/unread-count/', views.notification_unread_count_api.as_view(), name='notification-unread-count'),
+    path('api/notifications/stream/', views.notification_stream, name='notification-stream'),
+    path('api/autocomplete/<str:kind>/', views.autocomplete_api.as_view(), name='autocomplete'),
+    path('api/stats/chapter-cache/', views.chapter_cache_stats_api.as_view(), name='chapter-cache-stats'),
     path('test-toggle/', views.test_view, name='test-toggle'),
 
               ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from my_app.models import Story, Chapter, Genre, Comment, Warning, Fandom, Profile, Reason, Report, Tag
+from my_app.moderation import resolve_reports
 
 admin.site.register(Profile)
 admin.site.register(Genre)
@@ -33,10 +34,9 @@ class ReportAdmin(admin.ModelAdmin):
 
     @admin.action(description="Mark selected reports as Resolved")
     def mark_as_resolved(self, request, queryset):
-        for report in queryset:
-            if report.status != 'Resolved':
-                report.status = 'Resolved'
-                report.save()
+        result = resolve_reports(queryset)
+        self.message_user(request, f"Deleted {result['posts']} reported posts and deactivated "
+                                   f"{result['deactivated']} accounts.")
 
     @admin.action(description="Mark selected reports as Rejected")
     def mark_as_rejected(self, request, queryset):
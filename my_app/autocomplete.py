@@ -0,0 +1,129 @@
+"""
+Tag and fandom autocomplete, answered from memory. Each process keeps a
+PrefixIndex per model: every name, sorted case-insensitively, next to the
+number of stories using it. The names starting with a prefix are then one
+contiguous slice found by binary search, and the suggestions are the most
+used names in that slice. One and two letter prefixes have long slices, so
+their suggestions are picked once, when the index is built.
+
+When tags or fandoms change, the signals schedule a rebuild in the
+background and lookups keep answering from the old index until it's done.
+Other processes don't get those signals, so every index is also rebuilt
+once it's MAX_AGE seconds old.
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.db.models import Count
+
+from my_app.tasks import run_in_background
+
+#suggestions per lookup, by default and at most
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+
+#prefixes up to this long get their suggestions precomputed
+PRECOMPUTED_PREFIX_LENGTH = 2
+
+#seconds before an index is rebuilt even if this process saw no changes
+MAX_AGE = 300
+
+#sorts after any character that can follow a prefix
+_HIGHEST = '\U0010ffff'
+
+
+class PrefixIndex:
+    """Sorted names with usage counts. rows is an iterable of (name, uses)."""
+
+    def __init__(self, rows):
+        rows = sorted(rows, key=lambda row: (row[0].casefold(), row[0]))
+        self.keys = [name.casefold() for name, _ in rows]
+        self.names = [name for name, _ in rows]
+        self.uses = [uses for _, uses in rows]
+        self.built_at = time.monotonic()
+
+        buckets = defaultdict(list)
+        for position, key in enumerate(self.keys):
+            for length in range(1, min(len(key), PRECOMPUTED_PREFIX_LENGTH) + 1):
+                buckets[key[:length]].append(position)
+        self._top = {prefix: self._best(positions, MAX_LIMIT) for prefix, positions in buckets.items()}
+
+    def __len__(self):
+        return len(self.names)
+
+    def _best(self, positions, limit):
+        # most used first, alphabetical among equals
+        return heapq.nlargest(limit, positions, key=lambda position: (self.uses[position], -position))
+
+    def age(self):
+        return time.monotonic() - self.built_at
+
+    def suggest(self, prefix, limit=DEFAULT_LIMIT):
+        """[{'name', 'uses'}] for the most used names starting with prefix, ignoring case."""
+        prefix = prefix.casefold()
+        limit = max(0, min(limit, MAX_LIMIT))
+        if not prefix or not limit:
+            return []
+        if prefix in self._top:
+            positions = self._top[prefix][:limit]
+        elif len(prefix) <= PRECOMPUTED_PREFIX_LENGTH:
+            positions = []
+        else:
+            start = bisect_left(self.keys, prefix)
+            end = bisect_left(self.keys, prefix + _HIGHEST, start)
+            positions = self._best(range(start, end), limit)
+        return [{'name': self.names[position], 'uses': self.uses[position]} for position in positions]
+
+
+def build_index(model):
+    """A fresh PrefixIndex of model's (Tag or Fandom) names, ranked by how many stories use them."""
+    return PrefixIndex(model.objects.annotate(uses=Count('story')).values_list('name', 'uses').iterator())
+
+
+_indexes = {}
+_pending = set()
+_lock = threading.Lock()
+
+
+def refresh(model):
+    """Rebuilds this process's index for model and returns it."""
+    with _lock:
+        # changes made while we read the names schedule another rebuild
+        _pending.discard(model)
+    index = build_index(model)
+    with _lock:
+        _indexes[model] = index
+    return index
+
+
+def schedule_refresh(model):
+    """Rebuilds model's index in the background after the transaction commits, if this process has one."""
+    with _lock:
+        if model not in _indexes or model in _pending:
+            return
+        _pending.add(model)
+    run_in_background(refresh, model)
+
+
+def get_index(model):
+    """This process's index for model. Only the very first call waits for the database."""
+    index = _indexes.get(model)
+    if index is None:
+        return refresh(model)
+    if index.age() > MAX_AGE:
+        schedule_refresh(model)
+    return index
+
+
+def suggest(model, prefix, limit=DEFAULT_LIMIT):
+    return get_index(model).suggest(prefix, limit)
+
+
+def clear():
+    """Forgets every index, e.g. between tests."""
+    with _lock:
+        _indexes.clear()
+        _pending.clear()
@@ -0,0 +1,91 @@
+import hashlib
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from my_app.models import Profile
+
+#square sizes (px) generated for every profile picture
+AVATAR_SIZES = (48, 128, 512)
+
+#(file extension, Pillow format, save options), webp first, jpeg as the fallback
+AVATAR_FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+)
+
+DERIVED_DIR = 'profiles/derived'
+
+
+def variant_name(source_name, size, ext):
+    """Deterministic storage name of one derivative, e.g. profiles/derived/cat-1a2b3c4d-128.webp"""
+    stem = posixpath.splitext(posixpath.basename(source_name))[0]
+    digest = hashlib.sha1(source_name.encode()).hexdigest()[:8]
+    return f"{DERIVED_DIR}/{stem}-{digest}-{size}.{ext}"
+
+
+def pick_size(display_px):
+    """Smallest generated size that still covers display_px (the largest one if none does)."""
+    for size in AVATAR_SIZES:
+        if size >= display_px:
+            return size
+    return AVATAR_SIZES[-1]
+
+
+def avatar_variants(profile, display_px):
+    """
+    Returns {'webp': url, 'jpg': url} for showing profile's picture at display_px,
+    or None if the derivatives haven't been generated yet (use the original then).
+    """
+    source = profile.profile_picture.name if profile.profile_picture else ''
+    if not source or profile.avatar_source != source:
+        return None
+    size = pick_size(display_px)
+    return {ext: default_storage.url(variant_name(source, size, ext)) for ext, _, _ in AVATAR_FORMATS}
+
+
+def _square(image, size):
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'L'):
+        #flatten transparency onto white, JPEG has no alpha
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image.convert('RGBA'), mask=image.convert('RGBA').split()[-1])
+        image = background
+    return ImageOps.fit(image.convert('RGB'), (size, size), Image.Resampling.LANCZOS)
+
+
+def generate_avatar_variants(profile_id, force=False):
+    """
+    Writes every size/format derivative of the profile's current picture and
+    marks the profile as having them. Safe to run again, names are deterministic.
+    Returns the number of files written.
+    """
+    profile = Profile.objects.filter(pk=profile_id).first()
+    if profile is None or not profile.profile_picture:
+        return 0
+    source = profile.profile_picture.name
+    if profile.avatar_source == source and not force:
+        return 0
+
+    with default_storage.open(source, 'rb') as f:
+        original = Image.open(f)
+        original.load()
+
+    written = 0
+    for size in AVATAR_SIZES:
+        square = _square(original, size)
+        for ext, image_format, options in AVATAR_FORMATS:
+            buffer = BytesIO()
+            square.save(buffer, image_format, **options)
+            name = variant_name(source, size, ext)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            default_storage.save(name, ContentFile(buffer.getvalue()))
+            written += 1
+
+    # only if the picture didn't change again while we were working
+    Profile.objects.filter(pk=profile_id, profile_picture=source).update(avatar_source=source)
+    return written
@@ -0,0 +1,128 @@
+import json
+import math
+import platform
+import statistics
+import time
+from contextlib import ExitStack
+
+import django
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from my_app.middleware import QueryRecorder
+from my_app.models import Story
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile, good enough for a few dozen samples."""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def default_scenarios():
+    """
+    [(name, url, login_as)] for the pages worth watching, pointed at the
+    busiest rows in the current database so the numbers mean something.
+    """
+    story = Story.objects.filter(public=True).order_by('-comment_count', '-like_count').first()
+    author = User.objects.annotate(n=Count('posts')).order_by('-n').first()
+    reader = User.objects.annotate(n=Count('notifications')).order_by('-n').first()
+    if story is None or reader is None:
+        return []
+    term = story.tags.values_list('name', flat=True).first() or story.title.split()[0]
+    return [
+        ('home', reverse('home-page'), None),
+        ('home_logged_in', reverse('home-page'), reader),
+        ('story_detail', reverse('story-detail', args=[story.pk]), reader),
+        ('comment_view', reverse('comment-page', args=[story.pk]), reader),
+        ('story_search', f"{reverse('story-search')}?query={term}", None),
+        ('profile_view', reverse('user-profile', args=[author.username]), reader),
+        ('notifications_api', reverse('notification-list'), reader),
+    ]
+
+
+def measure(client, url, iterations, warmup):
+    recorder = QueryRecorder()
+    for _ in range(warmup):
+        client.get(url)
+
+    timings, queries = [], []
+    status = None
+    for _ in range(iterations):
+        recorder.queries = []
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            started = time.perf_counter()
+            response = client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(recorder.count)
+        status = response.status_code
+
+    return {
+        'url': url,
+        'status': status,
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'mean_ms': round(statistics.fmean(timings), 2),
+        'queries': max(queries),
+    }
+
+
+def run_benchmarks(iterations=30, warmup=3, scenarios=None, host='localhost'):
+    """
+    Requests every scenario in-process with the test client and returns a
+    JSON-able report of p50/p95 latency and query count per page. The
+    anonymous page cache is off, so every request measures the view itself.
+    """
+    scenarios = default_scenarios() if scenarios is None else scenarios
+    results = {}
+    with override_settings(PAGE_CACHE_TIMEOUT=0):
+        for name, url, user in scenarios:
+            client = Client(HTTP_HOST=host)
+            if user is not None:
+                client.force_login(user)
+            results[name] = measure(client, url, iterations, warmup)
+    return {
+        'created_at': timezone.now().isoformat(),
+        'iterations': iterations,
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connections['default'].vendor,
+            'stories': Story.objects.count(),
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, threshold=0.2):
+    """
+    Compares report with an earlier baseline. Returns [(page, metric, old, new)]
+    for every p95 that got more than threshold slower and every query count
+    that went up at all.
+    """
+    regressions = []
+    for name, new in report['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if old is None:
+            continue
+        if new['p95_ms'] > old['p95_ms'] * (1 + threshold):
+            regressions.append((name, 'p95_ms', old['p95_ms'], new['p95_ms']))
+        if new['queries'] > old['queries']:
+            regressions.append((name, 'queries', old['queries'], new['queries']))
+    return regressions
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
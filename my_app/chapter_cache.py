@@ -0,0 +1,68 @@
+import threading
+
+from django.core.cache import cache
+from django.template.defaultfilters import linebreaks_filter
+
+#rendered chapters are big, but they only change when the author edits them
+CHAPTER_HTML_TIMEOUT = 60 * 60 * 24
+
+
+class CacheStats:
+    """Hit/miss counters for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.invalidations = 0
+
+    def record(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else None,
+            }
+
+
+stats = CacheStats()
+
+
+def chapter_html_key(chapter, page=None):
+    key = f"chapter-html:{chapter.pk}:{chapter.content_hash}"
+    return key if page is None else f"{key}:{page}"
+
+
+def render_chapter_html(chapter, page=None):
+    """
+    chapter.content, or only its reading page `page`, run through |linebreaks,
+    cached per chapter, content version and page. The text is only loaded
+    on a miss, so chapter may come with its content deferred.
+    """
+    key = chapter_html_key(chapter, page)
+    html = cache.get(key)
+    if html is not None:
+        stats.record('hits')
+        return html
+    stats.record('misses')
+    text = chapter.content if page is None else chapter.page_text(page)
+    html = linebreaks_filter(text, autoescape=True)
+    cache.set(key, html, CHAPTER_HTML_TIMEOUT)
+    return html
+
+
+def invalidate_chapter_html(chapter):
+    """Drops the cached html, whole and paged, for the version of chapter that's currently saved."""
+    pages = range(1, chapter.page_count + 1)
+    cache.delete_many([chapter_html_key(chapter)] + [chapter_html_key(chapter, page) for page in pages])
+    stats.record('invalidations')
@@ -0,0 +1,107 @@
+"""
+Reading chapters. A story's chapter list (for the chapter picker and the
+previous/next links) is read once, in reading order and without content,
+and navigation is worked out from that list instead of more queries.
+
+Long chapters are read in pages. Where each page starts is worked out when
+the chapter is saved (Chapter.page_offsets), so serving a page only reads
+that slice of the content.
+"""
+import re
+
+from django.http import Http404
+
+#what the picker and the navigation need; content is loaded for the chapter being read only
+CHAPTER_LIST_FIELDS = ('id', 'title', 'public', 'position')
+
+#reading pages hold at most this many characters, unless there's nowhere to break them
+READING_PAGE_CHARS = 20000
+
+#?page= value for the whole chapter on one page
+FULL_TEXT = 'all'
+
+_WHITESPACE = re.compile(r'\s')
+
+
+def page_offsets(text, page_chars=READING_PAGE_CHARS):
+    """
+    Where each reading page after the first starts in text. A page ends at
+    its last paragraph break (blank line) in its second half, else at its
+    last line break there, else at its last space; a page with none of
+    those runs on to the next whitespace.
+    """
+    offsets = []
+    start = 0
+    while len(text) - start > page_chars:
+        limit = start + page_chars
+        for separator in ('\n\n', '\n', ' '):
+            cut = text.rfind(separator, start + page_chars // 2, limit)
+            if cut != -1:
+                cut += len(separator)
+                break
+        else:
+            match = _WHITESPACE.search(text, limit)
+            if match is None:
+                break
+            cut = match.end()
+        if cut >= len(text):
+            break
+        offsets.append(cut)
+        start = cut
+    return offsets
+
+
+def reading_page(value, chapter):
+    """
+    The page of chapter that ?page=value asks for (1 when missing), or None
+    for the whole chapter: ?page=all, or a chapter that fits on one page.
+    """
+    if value == FULL_TEXT or chapter.page_count == 1:
+        return None
+    try:
+        page = int(value or 1)
+    except ValueError:
+        raise Http404("No such page.")
+    if not 1 <= page <= chapter.page_count:
+        raise Http404("No such page.")
+    return page
+
+
+class ChapterIndex:
+    """
+    The chapters of story a viewer may read, as lightweight rows with
+    CHAPTER_LIST_FIELDS. Private chapters are only listed for the author.
+    """
+
+    def __init__(self, story, include_private=False):
+        chapters = story.chapters.order_by('position', 'pk')
+        if not include_private:
+            chapters = chapters.filter(public=True)
+        self.chapters = list(chapters.values_list(*CHAPTER_LIST_FIELDS, named=True))
+        self._index = {chapter.id: i for i, chapter in enumerate(self.chapters)}
+
+    def __iter__(self):
+        return iter(self.chapters)
+
+    def __len__(self):
+        return len(self.chapters)
+
+    def __contains__(self, chapter_id):
+        return chapter_id in self._index
+
+    def first(self):
+        return self.chapters[0] if self.chapters else None
+
+    def get(self, chapter_id):
+        """The row for chapter_id (a string from the query string is fine), Http404 if it isn't listed."""
+        try:
+            return self.chapters[self._index[int(chapter_id)]]
+        except (KeyError, TypeError, ValueError):
+            raise Http404("No such chapter.")
+
+    def neighbours(self, chapter_id):
+        """(previous row, next row) around chapter_id, either None at the ends."""
+        i = self._index[chapter_id]
+        previous = self.chapters[i - 1] if i > 0 else None
+        following = self.chapters[i + 1] if i + 1 < len(self.chapters) else None
+        return previous, following
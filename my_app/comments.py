@@ -0,0 +1,50 @@
+from django.core.paginator import Paginator
+from django.db.models import BooleanField, Exists, F, OuterRef, Value, Window
+from django.db.models.functions import RowNumber
+
+from my_app.models import Comment, Post
+
+
+def _with_viewer_flags(comments, viewer):
+    comments = comments.select_related('author')
+    profile = getattr(viewer, 'profile', None) if viewer is not None and viewer.is_authenticated else None
+    if profile is None:
+        return comments.annotate(is_liked=Value(False, output_field=BooleanField()))
+    likes = Post.liked_by.through.objects.filter(post_id=OuterRef('pk'), profile_id=profile.pk)
+    return comments.annotate(is_liked=Exists(likes))
+
+
+def load_comment_tree(post, viewer=None, page=1, per_page=20, replies_per_thread=None):
+    """
+    Returns a Paginator page of post's top-level comments, oldest first.
+    Each comment has reply_list (its first replies_per_thread replies, or all
+    of them if that's None) and hidden_reply_count. Authors, like counts and
+    the viewer's is_liked flag are loaded too, so the whole page costs three
+    queries however many comments and replies it has.
+    """
+    top_level = _with_viewer_flags(
+        Comment.objects.filter(post=post, parent=None), viewer
+    ).order_by('created_at', 'pk')
+    comments_page = Paginator(top_level, per_page).get_page(page)
+    comments_page.object_list = list(comments_page.object_list)
+
+    by_id = {}
+    for comment in comments_page.object_list:
+        comment.reply_list = []
+        by_id[comment.pk] = comment
+
+    if by_id:
+        replies = _with_viewer_flags(Comment.objects.filter(parent_id__in=by_id), viewer)
+        if replies_per_thread is not None:
+            replies = replies.annotate(position=Window(
+                RowNumber(),
+                partition_by=[F('parent_id')],
+                order_by=[F('created_at').asc(), F('pk').asc()],
+            )).filter(position__lte=replies_per_thread)
+        for reply in replies.order_by('created_at', 'pk'):
+            by_id[reply.parent_id].reply_list.append(reply)
+
+    for comment in comments_page.object_list:
+        comment.hidden_reply_count = max(comment.reply_count - len(comment.reply_list), 0)
+
+    return comments_page
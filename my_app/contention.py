@@ -0,0 +1,102 @@
+"""
+Multi-process write-contention benchmark for the SQLite profiles in
+djangoProject/database.py. Every worker is its own process with its own
+connection, doing a mix of likes, comments and feed reads as fast as it
+can, the way several gunicorn workers would. Runs against a copy of the
+database so the real data is never touched.
+
+Nothing here imports models at module level: workers are started with
+'spawn' and have to set Django up themselves first.
+"""
+import math
+import multiprocessing
+import random
+import sqlite3
+import statistics
+import time
+
+#share of operations that are likes / comments, the rest are feed reads
+LIKE_SHARE = 0.5
+COMMENT_SHARE = 0.2
+
+
+def copy_database(source, target):
+    """Consistent copy of a SQLite file, even one in WAL mode with an un-checkpointed -wal."""
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+def _worker(db_name, profile, seconds, seed, story_ids, authors, results):
+    import django
+    django.setup()
+
+    from django.db import OperationalError, close_old_connections, connections
+
+    from djangoProject.database import sqlite_database
+    from my_app.models import Comment, Post, Profile, Story
+
+    connection = connections['default']
+    connection.close()
+    connection.settings_dict.update(sqlite_database(db_name, profile))
+
+    rng = random.Random(seed)
+    ops = locked = 0
+    latencies = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        story_id = rng.choice(story_ids)
+        profile_id, user_id = rng.choice(authors)
+        roll = rng.random()
+        started = time.perf_counter()
+        try:
+            if roll < LIKE_SHARE:
+                Post(pk=story_id).toggle_like(Profile(pk=profile_id))
+            elif roll < LIKE_SHARE + COMMENT_SHARE:
+                Comment.objects.create(post_id=story_id, author_id=user_id, content='benchmark comment')
+            else:
+                list(Story.objects.filter(public=True).select_related('author').order_by('-created_at')[:20])
+            ops += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+        except OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+        #what Django does when a request finishes: closes the connection unless CONN_MAX_AGE keeps it
+        close_old_connections()
+    connection.close()
+    results.put({'ops': ops, 'locked': locked, 'latencies': latencies})
+
+
+def run_write_contention(db_name, profile, processes, seconds, story_ids, authors, seed=0):
+    """
+    Runs processes workers for seconds against db_name with the given
+    connection profile. authors is [(profile id, user id)].
+    Returns throughput, "database is locked" errors and latency percentiles.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    workers = [
+        context.Process(target=_worker, args=(db_name, profile, seconds, seed + n, story_ids, authors, results))
+        for n in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    finished = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    latencies = sorted(ms for result in finished for ms in result['latencies'])
+    ops = sum(result['ops'] for result in finished)
+    return {
+        'profile': profile,
+        'processes': processes,
+        'ops': ops,
+        'ops_per_sec': round(ops / seconds, 1),
+        'locked_errors': sum(result['locked'] for result in finished),
+        'p50_ms': round(statistics.median(latencies), 2) if latencies else None,
+        'p95_ms': round(latencies[math.ceil(len(latencies) * 0.95) - 1], 2) if latencies else None,
+    }
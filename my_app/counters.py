@@ -0,0 +1,45 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from my_app.models import Post, Profile, Story, Comment
+
+
+def _count(queryset, fk_name):
+    counts = queryset.filter(**{fk_name: OuterRef('pk')}).order_by().values(fk_name).annotate(n=Count('pk')).values('n')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def _fix(queryset, field, actual, batch_size=500):
+    #only touch rows that drifted, returns how many were fixed
+    drifted = list(queryset.annotate(actual=actual).exclude(**{field: F('actual')}).values_list('pk', flat=True))
+    for start in range(0, len(drifted), batch_size):
+        queryset.model.objects.filter(pk__in=drifted[start:start + batch_size]).update(**{field: actual})
+    return len(drifted)
+
+
+def recount_followers(profile_ids):
+    """Sets follower_count of the given profiles from the follows table."""
+    Profile.objects.filter(pk__in=profile_ids).update(
+        follower_count=_count(Profile.followers.through.objects, 'from_profile_id')
+    )
+
+
+def recount_comments(story_ids, comment_ids):
+    """Sets comment_count of the given stories and reply_count of the given comments, e.g. after bulk deletes."""
+    Story.objects.filter(pk__in=story_ids).update(comment_count=_count(Comment.objects, 'post_id'))
+    Comment.objects.filter(pk__in=comment_ids).update(reply_count=_count(Comment.objects, 'parent_id'))
+
+
+def reconcile_counters():
+    """
+    Recomputes like/bookmark/comment/reply/follower counts from the relations and
+    fixes any that drifted. Returns {counter name: rows fixed}.
+    """
+    return {
+        'like_count': _fix(Post.objects.all(), 'like_count', _count(Post.liked_by.through.objects, 'post_id')),
+        'bookmark_count': _fix(Story.objects.all(), 'bookmark_count', _count(Story.bookmarked_by.through.objects, 'story_id')),
+        'comment_count': _fix(Story.objects.all(), 'comment_count', _count(Comment.objects, 'post_id')),
+        'reply_count': _fix(Comment.objects.all(), 'reply_count', _count(Comment.objects, 'parent_id')),
+        'follower_count': _fix(Profile.objects.all(), 'follower_count',
+                               _count(Profile.followers.through.objects, 'from_profile_id')),
+    }
@@ -0,0 +1,227 @@
+"""
+Whole-story downloads, as EPUB or plain text. Exports are generated as a
+stream, one chapter at a time straight from the database cursor, so even
+a very long story never sits in memory. Whatever is streamed is also
+written to EXPORT_ROOT; the next download of the same version of the
+story is served from that file.
+
+A version is a digest of what ends up in the file: the story's title,
+synopsis and author and the id, position, title and content_hash of every
+public chapter. Editing, adding, publishing, hiding or reordering a
+chapter therefore changes it, and the old file is removed once the new
+one is complete.
+"""
+import hashlib
+import io
+import os
+import uuid
+import zipfile
+from datetime import datetime, timezone
+from html import escape
+from pathlib import Path
+
+from django.conf import settings
+from django.utils.text import slugify
+
+from my_app.models import Chapter
+
+FORMATS = {
+    'epub': 'application/epub+zip',
+    'txt': 'text/plain; charset=utf-8',
+}
+
+#chapters fetched from the cursor at a time
+CHAPTER_CHUNK_SIZE = 4
+
+#bytes per read when serving a cached file
+FILE_BLOCK_SIZE = 64 * 1024
+
+
+def _chapters(story):
+    return Chapter.objects.filter(story=story, public=True).order_by('position', 'pk')
+
+
+def export_version(story):
+    """Digest of everything an export of story contains, without reading any chapter content."""
+    chapters = _chapters(story).values_list('pk', 'position', 'title', 'content_hash')
+    digest = hashlib.sha1(repr((story.title, story.synopsis, story.author.username, list(chapters))).encode())
+    return digest.hexdigest()[:16]
+
+
+def export_root():
+    return Path(getattr(settings, 'EXPORT_ROOT', Path(settings.BASE_DIR) / 'exports'))
+
+
+def export_path(story, fmt, version=None):
+    return export_root() / f"{story.pk}-{version or export_version(story)}.{fmt}"
+
+
+def export_filename(story, fmt):
+    """What the download is called, e.g. the-long-way-home.epub."""
+    return f"{slugify(story.title) or f'story-{story.pk}'}.{fmt}"
+
+
+def text_chunks(story):
+    """The story as UTF-8 plain text, a chapter at a time."""
+    yield f"{story.title}\nby {story.author.username}\n\n{story.synopsis}\n".encode()
+    for chapter in _chapters(story).iterator(chunk_size=CHAPTER_CHUNK_SIZE):
+        yield f"\n\n{chapter.title}\n{'=' * len(chapter.title)}\n\n{chapter.content.strip()}\n".encode()
+
+
+class _ZipSpool:
+    """
+    Where zipfile writes an EPUB to. zipfile seeks back to fill in each
+    entry's header once the entry is written, which works as long as the
+    entry is still here; drain() hands out everything up to the end of the
+    last finished entry.
+    """
+
+    def __init__(self):
+        self._buffer = io.BytesIO()
+        self._drained = 0
+
+    def write(self, data):
+        return self._buffer.write(data)
+
+    def tell(self):
+        return self._drained + self._buffer.tell()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence != io.SEEK_SET or offset < self._drained:
+            raise io.UnsupportedOperation("can't seek into data that was already streamed")
+        return self._buffer.seek(offset - self._drained)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = self._buffer.getvalue()
+        self._drained += len(data)
+        self._buffer = io.BytesIO()
+        return data
+
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+
+def _xhtml(title, body):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">\n'
+        f'<head><title>{escape(title)}</title></head>\n<body>\n{body}\n</body>\n</html>\n'
+    )
+
+
+def _paragraphs(text):
+    # same paragraphs as the story page's |linebreaks, as XHTML
+    paragraphs = [part.strip() for part in text.replace('\r\n', '\n').split('\n\n') if part.strip()]
+    return '\n'.join('<p>' + '<br/>'.join(escape(line) for line in part.split('\n')) + '</p>' for part in paragraphs)
+
+
+def _package(story, version, chapters):
+    manifest = '\n'.join(
+        f'    <item id="{name}" href="{name}.xhtml" media-type="application/xhtml+xml"/>' for name, _ in chapters
+    )
+    spine = '\n'.join(f'    <itemref idref="{name}"/>' for name, _ in chapters)
+    modified = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="book-id">urn:story:{story.pk}:{version}</dc:identifier>
+    <dc:title>{escape(story.title)}</dc:title>
+    <dc:creator>{escape(story.author.username)}</dc:creator>
+    <dc:description>{escape(story.synopsis)}</dc:description>
+    <dc:language>en</dc:language>
+    <meta property="dcterms:modified">{modified}</meta>
+  </metadata>
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+    <item id="title" href="title.xhtml" media-type="application/xhtml+xml"/>
+{manifest}
+  </manifest>
+  <spine>
+    <itemref idref="title"/>
+{spine}
+  </spine>
+</package>
+"""
+
+
+def _nav(story, chapters):
+    items = '\n'.join(f'<li><a href="{name}.xhtml">{escape(title)}</a></li>' for name, title in chapters)
+    return _xhtml(story.title, f'<nav epub:type="toc"><h1>Contents</h1>\n<ol>\n{items}\n</ol></nav>')
+
+
+def epub_chunks(story, version=None):
+    """The story as an EPUB 3 file, a chapter at a time."""
+    version = version or export_version(story)
+    spool = _ZipSpool()
+    chapters = []
+    with zipfile.ZipFile(spool, 'w', zipfile.ZIP_DEFLATED) as epub:
+        # the mimetype has to come first, uncompressed
+        epub.writestr('mimetype', 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+        epub.writestr('META-INF/container.xml', CONTAINER_XML)
+        epub.writestr('OEBPS/title.xhtml', _xhtml(story.title, (
+            f'<h1>{escape(story.title)}</h1>\n<p>by {escape(story.author.username)}</p>\n'
+            f'{_paragraphs(story.synopsis)}'
+        )))
+        yield spool.drain()
+
+        for chapter in _chapters(story).iterator(chunk_size=CHAPTER_CHUNK_SIZE):
+            name = f'chapter-{len(chapters) + 1}'
+            chapters.append((name, chapter.title))
+            epub.writestr(f'OEBPS/{name}.xhtml', _xhtml(chapter.title, (
+                f'<h2>{escape(chapter.title)}</h2>\n{_paragraphs(chapter.content)}'
+            )))
+            yield spool.drain()
+
+        epub.writestr('OEBPS/nav.xhtml', _nav(story, chapters))
+        epub.writestr('OEBPS/content.opf', _package(story, version, chapters))
+    yield spool.drain()
+
+
+def _cache_while_streaming(chunks, path):
+    # written next to the final file and renamed once complete, so readers never see half an export
+    partial = path.with_name(f'{path.name}.{uuid.uuid4().hex}.part')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    complete = False
+    try:
+        with open(partial, 'wb') as file:
+            for chunk in chunks:
+                file.write(chunk)
+                yield chunk
+        os.replace(partial, path)
+        complete = True
+        # older versions of this story in this format
+        story_id = path.name.split('-')[0]
+        for old in path.parent.glob(f'{story_id}-*{path.suffix}'):
+            if old != path:
+                old.unlink(missing_ok=True)
+    finally:
+        if not complete:
+            partial.unlink(missing_ok=True)
+
+
+def stream_export(story, fmt, version):
+    """Generates the story in fmt, a chapter at a time, saving it as the cached file for version on the way."""
+    chunks = epub_chunks(story, version) if fmt == 'epub' else text_chunks(story)
+    return _cache_while_streaming(chunks, export_path(story, fmt, version))
+
+
+def read_file(path):
+    with open(path, 'rb') as file:
+        while block := file.read(FILE_BLOCK_SIZE):
+            yield block
+
+
+def export_chunks(story, fmt):
+    """The story in fmt as an iterator of bytes: from the cached file, or generated (and cached) as it's read."""
+    version = export_version(story)
+    path = export_path(story, fmt, version)
+    return read_file(path) if path.exists() else stream_export(story, fmt, version)
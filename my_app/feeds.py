@@ -0,0 +1,33 @@
+from django.db.models import Exists, OuterRef, Value, BooleanField
+
+from my_app.models import Story, Post
+
+
+def feed_queryset(viewer=None, stories=None):
+    """
+    Returns stories with everything a story card needs loaded up front:
+    author, genres, fandoms, tags, warnings (like_count and bookmark_count
+    are columns on the story), and is_liked / is_bookmarked for the viewer.
+    The query count stays the same no matter how many stories are on the page.
+    """
+    if stories is None:
+        stories = Story.objects.all()
+
+    likes = Post.liked_by.through
+    bookmarks = Story.bookmarked_by.through
+
+    stories = stories.select_related('author').prefetch_related(
+        'genres', 'fandoms', 'tags', 'warnings'
+    )
+
+    profile = getattr(viewer, 'profile', None) if viewer is not None and viewer.is_authenticated else None
+    if profile is None:
+        return stories.annotate(
+            is_liked=Value(False, output_field=BooleanField()),
+            is_bookmarked=Value(False, output_field=BooleanField()),
+        )
+
+    return stories.annotate(
+        is_liked=Exists(likes.objects.filter(post_id=OuterRef('pk'), profile_id=profile.pk)),
+        is_bookmarked=Exists(bookmarks.objects.filter(story_id=OuterRef('pk'), profile_id=profile.pk)),
+    )
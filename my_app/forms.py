@@ -1,7 +1,11 @@
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Fieldset, Submit, Layout, Field
 from django import forms
-from my_app.models import Story, Chapter, Comment, Genre, Warning, Fandom, Profile, Reason, Report, Tag
+from my_app.models import Story, Chapter, Comment, Genre, Warning, Profile, Reason, Report
+from my_app.chapter_cache import invalidate_chapter_html
+from my_app.taxonomy import sync_names
+from my_app.avatars import generate_avatar_variants
+from my_app.tasks import run_in_background
 
 
 class ProfileForm(forms.ModelForm):
@@ -37,6 +41,13 @@ class ProfileForm(forms.ModelForm):
             Submit('submit', 'Save Profile', css_class='btn-primary')
         )
 
+    def save(self, commit=True):
+        profile = super().save(commit=commit)
+        if commit and 'profile_picture' in self.changed_data and profile.profile_picture:
+            # resizing is slow, do it after the response
+            run_in_background(generate_avatar_variants, profile.pk)
+        return profile
+
 class StoryForm(forms.ModelForm):
     tags = forms.CharField(
         required=False,
@@ -123,18 +134,8 @@ class StoryForm(forms.ModelForm):
             instance.save()
             self.save_m2m()  # Save genres and warnings M2M
 
-            instance.fandoms.clear()
-            fandom_names = self.cleaned_data.get('fandoms', [])
-            tag_names = self.cleaned_data.get('tags', [])
-
-
-            for name in fandom_names:
-                fandom, created = Fandom.objects.get_or_create(name=name)
-                instance.fandoms.add(fandom)
-
-            for name in tag_names:
-                tag, created = Tag.objects.get_or_create(name=name)
-                instance.tags.add(tag)
+            sync_names(instance, 'fandoms', self.cleaned_data.get('fandoms', []))
+            sync_names(instance, 'tags', self.cleaned_data.get('tags', []))
 
 
         return instance
@@ -147,6 +148,12 @@ class ChapterForm(forms.ModelForm):
             'content': forms.Textarea(attrs={'rows': 20}),
         }
 
+    def save(self, commit=True):
+        if commit and self.instance.pk:
+            # content_hash still belongs to the saved version here, drop its cached html
+            invalidate_chapter_html(self.instance)
+        return super().save(commit=commit)
+
 
 class CommentForm(forms.ModelForm):
     content = forms.CharField(
@@ -191,6 +198,11 @@ class StorySearchForm(forms.Form):
         widget=forms.CheckboxSelectMultiple,
         label="Exclude Genres"
     )
+    sort = forms.ChoiceField(
+        choices=[('', 'Best match'), ('trending', 'Trending'), ('newest', 'Newest')],
+        required=False,
+        label="Sort by"
+    )
 
 class ReportForm(forms.ModelForm):
 
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from my_app.benchmarks import compare, load_report, run_benchmarks, save_report
+
+
+class Command(BaseCommand):
+    help = "Times the main pages against the current database and reports p50/p95 latency and query counts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--host', default='localhost', help="Host header, must be in ALLOWED_HOSTS.")
+        parser.add_argument('--output', help="Write the report here as JSON (e.g. to keep as a baseline).")
+        parser.add_argument('--baseline', help="Compare with this earlier JSON report and fail on regressions.")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="Allowed p95 slowdown against the baseline, 0.2 = 20%%.")
+
+    def handle(self, *args, **options):
+        report = run_benchmarks(options['iterations'], options['warmup'], host=options['host'])
+        if not report['results']:
+            raise CommandError("Nothing to benchmark, run seed_data first.")
+
+        self.stdout.write(f"{'page':<20}{'status':>7}{'p50 ms':>10}{'p95 ms':>10}{'queries':>9}")
+        for name, result in report['results'].items():
+            self.stdout.write(f"{name:<20}{result['status']:>7}{result['p50_ms']:>10}{result['p95_ms']:>10}{result['queries']:>9}")
+
+        if options['output']:
+            save_report(report, options['output'])
+            self.stdout.write(f"Report written to {options['output']}")
+
+        if options['baseline']:
+            regressions = compare(report, load_report(options['baseline']), options['threshold'])
+            for name, metric, old, new in regressions:
+                self.stderr.write(f"{name}: {metric} {old} -> {new}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} regressions against {options['baseline']}")
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
@@ -0,0 +1,40 @@
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from djangoProject.database import PROFILES
+from my_app.contention import copy_database, run_write_contention
+from my_app.models import Profile, Story
+
+
+class Command(BaseCommand):
+    help = ("Measures like/comment/read throughput with several processes writing at once, "
+            "for each SQLite connection profile. Works on a copy of the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, nargs='+', default=[1, 4, 8])
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--profiles', nargs='+', default=list(PROFILES), choices=list(PROFILES))
+
+    def handle(self, *args, **options):
+        story_ids = list(Story.objects.values_list('pk', flat=True)[:1000])
+        authors = list(Profile.objects.values_list('pk', 'user_id')[:1000])
+        if not story_ids or not authors:
+            raise CommandError("Needs some stories and users, run seed_data first.")
+
+        source = connections['default'].settings_dict['NAME']
+        connections.close_all()
+        self.stdout.write(f"{'profile':<12}{'procs':>6}{'ops/s':>10}{'locked':>8}{'p50 ms':>9}{'p95 ms':>9}")
+        with tempfile.TemporaryDirectory() as directory:
+            for profile in options['profiles']:
+                for processes in options['processes']:
+                    #fresh copy every run so earlier runs' writes don't skew the next one
+                    db_name = os.path.join(directory, f'{profile}-{processes}.sqlite3')
+                    copy_database(source, db_name)
+                    result = run_write_contention(db_name, profile, processes, options['seconds'], story_ids, authors)
+                    self.stdout.write(
+                        f"{profile:<12}{processes:>6}{result['ops_per_sec']:>10}{result['locked_errors']:>8}"
+                        f"{result['p50_ms']!s:>9}{result['p95_ms']!s:>9}"
+                    )
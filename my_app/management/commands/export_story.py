@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from my_app.exports import FORMATS, export_chunks, export_filename
+from my_app.models import Story
+
+
+class Command(BaseCommand):
+    help = ("Writes a story's public chapters to an EPUB or plain-text file, a chapter at a time. "
+            "Reuses (and fills) the same cache as the download links.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('story_id', type=int)
+        parser.add_argument('--format', choices=sorted(FORMATS), default='epub')
+        parser.add_argument('--output', help="file to write, defaults to the story's title in the current directory")
+
+    def handle(self, *args, **options):
+        story = Story.objects.select_related('author').filter(pk=options['story_id']).first()
+        if story is None:
+            raise CommandError(f"No story with id {options['story_id']}.")
+        output = options['output'] or export_filename(story, options['format'])
+        size = 0
+        with open(output, 'wb') as file:
+            for chunk in export_chunks(story, options['format']):
+                file.write(chunk)
+                size += len(chunk)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {output} ({size} bytes)."))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from my_app.avatars import generate_avatar_variants
+from my_app.models import Profile
+
+
+class Command(BaseCommand):
+    help = "Generates the resized avatar variants for profile pictures that don't have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Regenerate every profile's variants.")
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.exclude(profile_picture='').exclude(profile_picture__isnull=True)
+        if not options['force']:
+            profiles = profiles.exclude(avatar_source=F('profile_picture'))
+
+        done = 0
+        for profile_id in profiles.values_list('pk', flat=True).iterator():
+            try:
+                generate_avatar_variants(profile_id, force=options['force'])
+                done += 1
+            except (OSError, ValueError) as e:
+                self.stderr.write(f"Profile {profile_id}: {e}")
+        self.stdout.write(self.style.SUCCESS(f"Generated avatars for {done} profiles."))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from my_app import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text story search index from scratch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not search.is_enabled():
+            raise CommandError("The search index table doesn't exist (needs SQLite with FTS5 and `migrate`).")
+        total = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} stories."))
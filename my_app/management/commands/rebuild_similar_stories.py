@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from my_app.recommendations import BATCH_SIZE, rebuild_similar_stories
+
+
+class Command(BaseCommand):
+    help = "Recomputes the \"similar stories\" shown on every story page."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        total = rebuild_similar_stories(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Stored {total} similar-story links."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from my_app.timelines import rebuild_timelines
+
+
+class Command(BaseCommand):
+    help = "Rebuilds everyone's Following timeline from who they follow."
+
+    def handle(self, *args, **options):
+        total = rebuild_timelines()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {total} timeline entries."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from my_app.trending import recompute_trending
+
+
+class Command(BaseCommand):
+    help = ("Recomputes every story's trending score from recent likes, bookmarks and comments "
+            "and forgets the ones too old to count. Run it periodically, e.g. nightly from cron.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        total = recompute_trending(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Recomputed {total} trending scores."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from my_app.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = "Recomputes the stored like/bookmark/comment/reply counts and fixes any that drifted."
+
+    def handle(self, *args, **options):
+        fixed = reconcile_counters()
+        for name, rows in fixed.items():
+            self.stdout.write(f"{name}: {rows} fixed")
+        self.stdout.write(self.style.SUCCESS("Counters are in sync."))
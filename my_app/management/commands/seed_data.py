@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from my_app.seed import DEFAULTS, SEED_PASSWORD, Seeder
+
+
+class Command(BaseCommand):
+    help = "Fills the database with a synthetic archive (users, stories, chapters, comments, ...) for benchmarking."
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULTS.items():
+            parser.add_argument(f"--{name.replace('_', '-')}", type=int, dest=name,
+                                help=f"Default {default}.")
+
+    def handle(self, *args, **options):
+        seeder = Seeder(stdout=self.stdout, **{name: options[name] for name in DEFAULTS})
+        created = seeder.run()
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {created['users']} users and {created['stories']} stories. "
+            f"Every seeded user's password is {SEED_PASSWORD!r}."
+        ))
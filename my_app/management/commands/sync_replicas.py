@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from my_app.contention import copy_database
+
+
+class Command(BaseCommand):
+    help = ("Copies the primary SQLite database over every replica in DATABASE_REPLICAS, "
+            "for trying the read-replica setup locally.")
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No replicas configured, set DJANGO_DB_REPLICAS.")
+        primary = connections['default'].settings_dict
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError("Only SQLite file copies can be synced, real replicas replicate themselves.")
+        for alias in settings.DATABASE_REPLICAS:
+            copy_database(primary['NAME'], connections[alias].settings_dict['NAME'])
+            self.stdout.write(f"{alias}: copied from {primary['NAME']}")
+        self.stdout.write(self.style.SUCCESS("Replicas are in sync."))
@@ -0,0 +1,157 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from my_app import routers
+
+logger = logging.getLogger('my_app.sql')
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SLOW_QUERIES': 5,         # how many of the slowest statements to report
+    'NPLUSONE_THRESHOLD': 5,   # same statement shape this many times in one request = N+1
+    'QUERY_BUDGET': None,      # max queries per request, None for no limit
+    'QUERY_BUDGETS': {},       # per url name, e.g. {'home-page': 10}
+    'RAISE_ON_BUDGET': False,  # raise QueryBudgetExceeded instead of just logging (for tests)
+}
+
+
+def instrumentation_settings():
+    return {**DEFAULTS, **getattr(settings, 'SQL_INSTRUMENTATION', {})}
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+_in_list = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_spaces = re.compile(r'\s+')
+
+
+def query_shape(sql):
+    """The statement with IN (%s, %s, ...) lists collapsed, so N+1 variants group together."""
+    return _spaces.sub(' ', _in_list.sub('(...)', sql)).strip()
+
+
+class QueryRecorder:
+    """execute_wrapper that notes each statement's SQL and duration."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, (time.perf_counter() - started) * 1000))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_ms(self):
+        return sum(ms for _, ms in self.queries)
+
+    def slowest(self, n):
+        return sorted(self.queries, key=lambda query: query[1], reverse=True)[:n]
+
+    def repeated_shapes(self, threshold):
+        """[(shape, times)] for statement shapes run at least threshold times."""
+        shapes = Counter(query_shape(sql) for sql, _ in self.queries)
+        return [(shape, times) for shape, times in shapes.most_common() if times >= threshold]
+
+
+class SQLInstrumentationMiddleware:
+    """
+    Opt-in per-request SQL stats: query count, total SQL time, the slowest
+    statements and repeated statement shapes (likely N+1s). Reported as a
+    Server-Timing header and one JSON log line on the my_app.sql logger.
+    Turn on with SQL_INSTRUMENTATION = {'ENABLED': True, ...} in settings.
+    """
+
+    def __init__(self, get_response):
+        if not instrumentation_settings()['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = instrumentation_settings()
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+        budget = options['QUERY_BUDGETS'].get(url_name, options['QUERY_BUDGET'])
+        repeated = recorder.repeated_shapes(options['NPLUSONE_THRESHOLD'])
+
+        timings = [f'db;dur={recorder.total_ms:.2f};desc="{recorder.count} queries"']
+        if repeated:
+            timings.append(f'db-repeated;desc="{len(repeated)} repeated shapes, worst x{repeated[0][1]}"')
+        response['Server-Timing'] = ', '.join(
+            [value for value in [response.get('Server-Timing')] if value] + timings
+        )
+
+        over_budget = budget is not None and recorder.count > budget
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': url_name,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'sql_ms': round(recorder.total_ms, 2),
+            'slowest': [{'sql': sql[:300], 'ms': round(ms, 2)} for sql, ms in recorder.slowest(options['SLOW_QUERIES'])],
+            'repeated': [{'sql': shape[:300], 'times': times} for shape, times in repeated],
+            'budget': budget,
+        }
+        log = logger.warning if over_budget or repeated else logger.info
+        log(json.dumps(record), extra={'sql_stats': record})
+
+        if over_budget and options['RAISE_ON_BUDGET']:
+            raise QueryBudgetExceeded(
+                f"{request.method} {request.path} ran {recorder.count} queries, budget is {budget}"
+            )
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Lets PrimaryReplicaRouter send this request's reads to a replica until
+    it writes. POSTs and other unsafe methods read from the primary from
+    the start, since they usually check what they're about to change. A
+    request that wrote (or was unsafe) sets a short-lived cookie so the
+    redirect that usually follows (and anything else within
+    REPLICA_PIN_SECONDS) reads from the primary too, in case the replica
+    hasn't caught up yet. Does nothing unless DATABASE_REPLICAS is set.
+    """
+    cookie_name = 'pin_primary'
+    safe_methods = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def __init__(self, get_response):
+        if not routers.replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = routers.start_request(pinned=self.cookie_name in request.COOKIES)
+        unsafe = request.method not in self.safe_methods
+        if unsafe:
+            routers.pin_to_primary()
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = routers.end_request(token)
+        if wrote or unsafe:
+            response.set_cookie(self.cookie_name, '1', max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 5),
+                                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,47 @@
+from django.db import migrations, OperationalError
+
+
+def create_index(apps, schema_editor):
+    #FTS5 only exists on SQLite (and only if it was compiled in), search falls back to LIKE otherwise
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS story_search_index USING fts5("
+            "title, synopsis, author, tags, fandoms, tokenize='unicode61 remove_diacritics 2')"
+        )
+    except OperationalError:
+        return
+
+    Story = apps.get_model('my_app', 'Story')
+    rows = []
+    for story in Story.objects.select_related('author').prefetch_related('tags', 'fandoms'):
+        rows.append((
+            story.pk,
+            story.title,
+            story.synopsis,
+            story.author.username,
+            ' '.join(tag.name for tag in story.tags.all()),
+            ' '.join(fandom.name for fandom in story.fandoms.all()),
+        ))
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO story_search_index (rowid, title, synopsis, author, tags, fandoms) VALUES (%s, %s, %s, %s, %s, %s)",
+            rows,
+        )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS story_search_index")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_app', '0002_rename_tags_tag'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
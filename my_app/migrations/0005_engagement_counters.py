@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:43
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count(queryset, fk_name):
+    counts = queryset.filter(**{fk_name: OuterRef('pk')}).order_by().values(fk_name).annotate(n=Count('pk')).values('n')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Post = apps.get_model('my_app', 'Post')
+    Story = apps.get_model('my_app', 'Story')
+    Comment = apps.get_model('my_app', 'Comment')
+    Post.objects.update(like_count=_count(Post.liked_by.through.objects, 'post_id'))
+    Story.objects.update(
+        bookmark_count=_count(Story.bookmarked_by.through.objects, 'story_id'),
+        comment_count=_count(Comment.objects, 'post_id'),
+    )
+    Comment.objects.update(reply_count=_count(Comment.objects, 'parent_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_app', '0004_cursor_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='bookmark_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
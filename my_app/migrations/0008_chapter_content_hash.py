@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:51
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def fill_content_hash(apps, schema_editor):
+    Chapter = apps.get_model('my_app', 'Chapter')
+    for chapter in Chapter.objects.only('pk', 'content').iterator():
+        Chapter.objects.filter(pk=chapter.pk).update(content_hash=hashlib.sha1(chapter.content.encode()).hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_app', '0007_notification_unread_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chapter',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+        migrations.RunPython(fill_content_hash, migrations.RunPython.noop),
+    ]
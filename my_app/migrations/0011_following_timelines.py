@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:25
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from itertools import groupby
+
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+#timelines.BACKFILL_STORIES when this migration was written
+BACKFILL_STORIES = 50
+
+
+def fill_follower_count(apps, schema_editor):
+    Profile = apps.get_model('my_app', 'Profile')
+    counts = (Profile.followers.through.objects.filter(from_profile_id=OuterRef('pk')).order_by()
+              .values('from_profile_id').annotate(n=Count('pk')).values('n'))
+    Profile.objects.update(follower_count=Coalesce(Subquery(counts, output_field=IntegerField()), 0))
+
+
+def fill_timelines(apps, schema_editor):
+    # what rebuild_timelines does: every follower gets the latest stories of everyone they follow
+    Profile = apps.get_model('my_app', 'Profile')
+    Story = apps.get_model('my_app', 'Story')
+    TimelineEntry = apps.get_model('my_app', 'TimelineEntry')
+    follows = (Profile.followers.through.objects.order_by('to_profile_id')
+               .values_list('to_profile_id', 'from_profile_id'))
+    for owner_id, rows in groupby(follows.iterator(), key=lambda row: row[0]):
+        stories = (Story.objects.filter(public=True, author__profile__in=[author_id for _, author_id in rows])
+                   .order_by('-created_at').values_list('pk', 'created_at')[:BACKFILL_STORIES])
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(owner_id=owner_id, story_id=story_id, created_at=created_at)
+             for story_id, created_at in stories],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_app', '0010_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='follower_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to='my_app.profile')),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='my_app.story')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', '-created_at', '-id'], name='timeline_cursor_idx')],
+                'constraints': [models.UniqueConstraint(fields=('owner', 'story'), name='unique_timeline_story')],
+            },
+        ),
+        migrations.RunPython(fill_follower_count, migrations.RunPython.noop),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
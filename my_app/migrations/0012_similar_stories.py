@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_app', '0011_following_timelines'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarStory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='my_app.story')),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_stories', to='my_app.story')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['story', '-score'], name='similar_story_rank_idx')],
+                'constraints': [models.UniqueConstraint(fields=('story', 'similar'), name='unique_similar_story')],
+            },
+        ),
+    ]
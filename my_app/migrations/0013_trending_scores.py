@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:34
+
+import django.db.models.deletion
+import django.utils.timezone
+import math
+from datetime import datetime, timedelta, timezone
+
+from django.db import migrations, models
+
+
+def fill_trending_scores(apps, schema_editor):
+    # everything so far counted as if it happened when the story was posted (see my_app/trending.py)
+    Story = apps.get_model('my_app', 'Story')
+    epoch = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    half_life = timedelta(hours=36)
+    stories = list(Story.objects.only('pk', 'created_at', 'like_count', 'bookmark_count', 'comment_count'))
+    for story in stories:
+        weight = 3.0 + story.like_count + 2.0 * story.bookmark_count + 1.5 * story.comment_count
+        story.trending_score = math.log2(weight) + (story.created_at - epoch) / half_life
+    Story.objects.bulk_update(stories, ['trending_score'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_app', '0012_similar_stories'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EngagementEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('like', 'Like'), ('bookmark', 'Bookmark'), ('comment', 'Comment')], max_length=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='trending_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=models.Index(fields=['-trending_score', '-post_ptr'], name='story_trending_idx'),
+        ),
+        migrations.AddField(
+            model_name='engagementevent',
+            name='profile',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='my_app.profile'),
+        ),
+        migrations.AddField(
+            model_name='engagementevent',
+            name='story',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='my_app.story'),
+        ),
+        migrations.AddIndex(
+            model_name='engagementevent',
+            index=models.Index(fields=['story', 'profile', 'kind'], name='engagement_lookup_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='engagementevent',
+            index=models.Index(fields=['created_at'], name='engagement_created_idx'),
+        ),
+        migrations.RunPython(fill_trending_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:50
+
+from django.db import migrations, models
+
+
+def number_chapters(apps, schema_editor):
+    # keep the order readers saw so far: the story page walked chapters by id
+    Chapter = apps.get_model('my_app', 'Chapter')
+    chapters = list(Chapter.objects.only('pk', 'story_id').order_by('story_id', 'pk'))
+    previous_story, position = None, 0
+    for chapter in chapters:
+        position = position + 1 if chapter.story_id == previous_story else 1
+        previous_story = chapter.story_id
+        chapter.position = position
+    Chapter.objects.bulk_update(chapters, ['position'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_app', '0013_trending_scores'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='chapter',
+            options={'ordering': ['position', 'id']},
+        ),
+        migrations.AddField(
+            model_name='chapter',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='chapter',
+            index=models.Index(fields=['story', 'position', 'id'], name='chapter_position_idx'),
+        ),
+        migrations.RunPython(number_chapters, migrations.RunPython.noop),
+    ]
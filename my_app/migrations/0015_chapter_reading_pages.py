@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:54
+
+from django.db import migrations, models
+
+from my_app.chapters import page_offsets
+
+
+def split_chapters(apps, schema_editor):
+    Chapter = apps.get_model('my_app', 'Chapter')
+    batch = []
+    for chapter in Chapter.objects.only('pk', 'content').iterator(chunk_size=200):
+        chapter.page_offsets = page_offsets(chapter.content)
+        batch.append(chapter)
+        if len(batch) >= 200:
+            Chapter.objects.bulk_update(batch, ['page_offsets'])
+            batch = []
+    Chapter.objects.bulk_update(batch, ['page_offsets'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_app', '0014_chapter_positions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chapter',
+            name='page_offsets',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.RunPython(split_chapters, migrations.RunPython.noop),
+    ]
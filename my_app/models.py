@@ -1,18 +1,39 @@
 # models.py
-from django.db import models
+import hashlib
+
+from django.db import models, transaction
+from django.db.models import F, Max
+from django.db.models.functions import Substr
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import User
 
+from my_app.chapters import page_offsets
+
 
 class Notification(models.Model):
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
     message = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     read = models.BooleanField(default=False)
+    # set for notifications that must only be sent once per recipient, e.g. "chapter-published:<id>"
+    dedupe_key = models.CharField(max_length=100, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # cursor pagination of a user's notifications, newest first
+            models.Index(fields=['recipient', '-created_at', '-id'], name='notif_recipient_cursor_idx'),
+            # unread counts, unread list and bulk mark-read; read rows (most of them) stay out of it
+            models.Index(fields=['recipient', '-created_at', '-id'], condition=models.Q(read=False),
+                         name='notif_unread_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['recipient', 'dedupe_key'], name='unique_notification_dedupe_key'),
+        ]
 
     def mark_as_read(self):
         self.read = True
@@ -28,16 +49,24 @@ class Profile(models.Model):
     bio = models.TextField(blank=True)
     followers = models.ManyToManyField('self', symmetrical=False, related_name='following', blank=True)
     profile_picture = models.ImageField(upload_to='profiles/', null=True, blank=True)
+    # profile_picture name the resized avatars were generated from (see my_app/avatars.py)
+    avatar_source = models.CharField(max_length=255, blank=True, editable=False)
     strike = models.IntegerField(default=0)
+    # kept in sync by my_app/signals.py, decides whether new stories are fanned out (my_app/timelines.py)
+    follower_count = models.PositiveIntegerField(default=0)
+
+    #accounts are deactivated once they reach this many strikes
+    STRIKE_LIMIT = 3
+    DEACTIVATED_MESSAGE = f"Your account has been deactivated due to {STRIKE_LIMIT} strikes."
 
     def add_strike(self):
         self.strike += 1
         self.save()
 
-        if self.strike >= 3:
+        if self.strike >= self.STRIKE_LIMIT:
             self.user.is_active = False
             self.user.save()
-            Notification.objects.create(recipient=self.user, message="Your account has been deactivated due to 3 strikes.")
+            Notification.objects.create(recipient=self.user, message=self.DEACTIVATED_MESSAGE)
 
 
     def __str__(self):
@@ -50,10 +79,55 @@ def create_or_update_user_profile(sender, instance, created, **kwargs):
     instance.profile.save()
 
 
+def _lock_row(model, pk, counter):
+    """
+    Write-locks the row holding counter until the transaction ends, so
+    concurrent toggles check and update it one after the other. A no-op
+    UPDATE rather than select_for_update(), which SQLite ignores.
+    """
+    model.objects.filter(pk=pk).update(**{counter: F(counter)})
+
+
 class Post(models.Model):
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='posts')
     created_at = models.DateTimeField(auto_now_add=True)
     liked_by = models.ManyToManyField(Profile, related_name='liked_posts', blank=True)
+    like_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # cursor pagination of the story feed, newest first
+            models.Index(fields=['-created_at', '-id'], name='post_cursor_idx'),
+        ]
+
+    def toggle_like(self, profile):
+        #returns True if the post is liked now, False if the like was taken back
+        with transaction.atomic():
+            _lock_row(Post, self.pk, 'like_count')
+            if self.liked_by.filter(pk=profile.pk).exists():
+                self.liked_by.remove(profile)
+                Post.objects.filter(pk=self.pk).update(like_count=F('like_count') - 1)
+                return False
+            self.liked_by.add(profile)
+            Post.objects.filter(pk=self.pk).update(like_count=F('like_count') + 1)
+            return True
+
+    def delete(self, *args, **kwargs):
+        #deleting a comment also deletes its replies, so take all of them off the story's count
+        if isinstance(self, Comment):
+            comment = {'post_id': self.post_id, 'parent_id': self.parent_id}
+        elif isinstance(self, Story):
+            comment = None
+        else:
+            comment = Comment.objects.filter(pk=self.pk).values('post_id', 'parent_id').first()
+        with transaction.atomic():
+            deleted, per_model = super().delete(*args, **kwargs)
+            if comment:
+                removed = per_model.get(Comment._meta.label, 0)
+                Story.objects.filter(pk=comment['post_id']).update(comment_count=F('comment_count') - removed)
+                if comment['parent_id']:
+                    Comment.objects.filter(pk=comment['parent_id']).update(reply_count=F('reply_count') - 1)
+        return deleted, per_model
 
 
 class Story(Post):
@@ -65,32 +139,151 @@ class Story(Post):
     warnings = models.ManyToManyField('Warning', blank=True)
     fandoms = models.ManyToManyField('Fandom', blank=True)
     bookmarked_by = models.ManyToManyField(Profile, related_name='bookmarked_stories', blank=True)
+    bookmark_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    # time-decayed engagement, in log form so it never has to be decayed (see my_app/trending.py)
+    trending_score = models.FloatField(default=0)
+
+    class Meta:
+        db_table = "stories"
+        indexes = [
+            # home and search sorted by trending, cursor pagination on (trending_score, id); not partial,
+            # or the planner would walk it instead of story_public_idx for the newest-first feed too
+            models.Index(fields=['-trending_score', '-post_ptr'], name='story_trending_idx'),
+            # public/private lives here but created_at lives on my_app_post, so the feed walks
+            # post_cursor_idx and checks this one; it also keeps counting public stories cheap
+            models.Index(fields=['post_ptr'], condition=models.Q(public=True), name='story_public_idx'),
+        ]
 
     def get_absolute_url(self):
         return reverse('story-detail', kwargs={'id': self.id})
 
+    def toggle_bookmark(self, profile):
+        #returns True if the story is bookmarked now, False if the bookmark was removed
+        with transaction.atomic():
+            _lock_row(Story, self.pk, 'bookmark_count')
+            if self.bookmarked_by.filter(pk=profile.pk).exists():
+                self.bookmarked_by.remove(profile)
+                Story.objects.filter(pk=self.pk).update(bookmark_count=F('bookmark_count') - 1)
+                return False
+            self.bookmarked_by.add(profile)
+            Story.objects.filter(pk=self.pk).update(bookmark_count=F('bookmark_count') + 1)
+            return True
+
     def get_tags_display(self):
         return ', '.join(self.tags.names())
 
     def get_fandoms_display(self):
         return ', '.join(self.fandoms.names())
 
+    def __str__(self):
+        return f"{self.title}"
+
+class TimelineEntry(models.Model):
+    # a story on someone's Following feed, written when it's published (see my_app/timelines.py)
+    owner = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='timeline')
+    story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='+')
+    # when the story went public or last got a new chapter, the feed is newest first by this
+    created_at = models.DateTimeField(default=timezone.now)
+
     class Meta:
-        db_table = "stories"
+        indexes = [
+            # cursor pagination of a user's Following feed
+            models.Index(fields=['owner', '-created_at', '-id'], name='timeline_cursor_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'story'], name='unique_timeline_story'),
+        ]
+
+    def __str__(self):
+        return f"{self.story_id} on {self.owner_id}'s timeline"
+
+class EngagementEvent(models.Model):
+    # a like, bookmark or comment on a story, kept for a while to recompute trending scores
+    KIND_CHOICES = [
+        ('like', 'Like'),
+        ('bookmark', 'Bookmark'),
+        ('comment', 'Comment'),
+    ]
 
+    story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='+')
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # finding the like/bookmark to take back when it's undone
+            models.Index(fields=['story', 'profile', 'kind'], name='engagement_lookup_idx'),
+            # pruning old events
+            models.Index(fields=['created_at'], name='engagement_created_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.title}"
+        return f"{self.kind} on {self.story_id} at {self.created_at}"
+
+class SimilarStory(models.Model):
+    # precomputed "similar stories" for story, best first (see my_app/recommendations.py)
+    story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='similar_stories')
+    similar = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='+')
+    # cosine similarity of the two stories' tag/fandom/genre/warning vectors
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['story', '-score'], name='similar_story_rank_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['story', 'similar'], name='unique_similar_story'),
+        ]
+
+    def __str__(self):
+        return f"{self.story_id} ~ {self.similar_id} ({self.score:.2f})"
 
 class Chapter(models.Model):
     story = models.ForeignKey(Story, related_name='chapters', on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
     content = models.TextField()
+    # sha1 of content, used to version the cached rendered html
+    content_hash = models.CharField(max_length=40, blank=True, editable=False)
     public = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # reading order within the story, new chapters go last (see my_app/chapters.py)
+    position = models.PositiveIntegerField(default=0)
+    # where each reading page after the first starts in content, worked out on save
+    page_offsets = models.JSONField(default=list, blank=True, editable=False)
 
     class Meta:
-        ordering = ["created_at"]
+        ordering = ["position", "id"]
+        indexes = [
+            # the story page's chapter list, in reading order
+            models.Index(fields=['story', 'position', 'id'], name='chapter_position_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and not self.position:
+            last = Chapter.objects.filter(story_id=self.story_id).aggregate(last=Max('position'))['last']
+            self.position = (last or 0) + 1
+        self.content_hash = hashlib.sha1(self.content.encode()).hexdigest()
+        self.page_offsets = page_offsets(self.content)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'content' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'content_hash', 'page_offsets'}
+        super().save(*args, **kwargs)
+
+    @property
+    def page_count(self):
+        return len(self.page_offsets) + 1
+
+    def page_text(self, page):
+        """The text of reading page `page` (from 1). With content deferred, only that slice is read."""
+        starts = [0, *self.page_offsets]
+        start = starts[page - 1]
+        end = starts[page] if page < len(starts) else None
+        if 'content' not in self.get_deferred_fields():
+            return self.content[start:end]
+        text = Substr('content', start + 1, end - start if end is not None else None)
+        return Chapter.objects.filter(pk=self.pk).annotate(text=text).values_list('text', flat=True).get()
 
     def __str__(self):
         return f"{self.story.title} chapter {self.title}"
@@ -111,10 +304,26 @@ class Comment(Post):
     post = models.ForeignKey(Post, related_name='comments', on_delete=models.CASCADE)
     content = models.TextField()
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='replies')
+    reply_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # a story's top-level comments; replies are found through the parent foreign key
+            models.Index(fields=['post'], condition=models.Q(parent=None), name='comment_top_level_idx'),
+        ]
 
     def is_reply(self):
         return self.parent is not None
 
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if creating:
+                Story.objects.filter(pk=self.post_id).update(comment_count=F('comment_count') + 1)
+                if self.parent_id:
+                    Comment.objects.filter(pk=self.parent_id).update(reply_count=F('reply_count') + 1)
+
     def __str__(self):
         return f"{self.author}:\n'{self.content}'"
 
@@ -149,7 +358,16 @@ class Report(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Pending')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    STRIKE_MESSAGE = "You received a strike due to a resolved report and your post has been deleted."
+
+    class Meta:
+        indexes = [
+            # moderation queue: reports in a status, oldest first
+            models.Index(fields=['status', 'created_at'], name='report_status_created_idx'),
+        ]
+
     def save(self, *args, **kwargs):
+        #resolving one report at a time; my_app/moderation.py resolves many at once with the same outcome
         deleting_post = False
 
         if self.pk:
@@ -167,7 +385,4 @@ class Report(models.Model):
             if hasattr(post_author, 'profile'):
                 post_author.profile.add_strike()
 
-            Notification.objects.create(
-                recipient=post_author,
-                message="You received a strike due to a resolved report and your post has been deleted."
-            )
+            Notification.objects.create(recipient=post_author, message=self.STRIKE_MESSAGE)
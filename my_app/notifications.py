@@ -0,0 +1,56 @@
+from my_app.models import Chapter, Notification, Story
+from my_app.pubsub import broker
+from my_app.serializers import NotificationSerializer
+
+#how many bookmarkers we load and insert notifications for at a time
+FANOUT_CHUNK_SIZE = 1000
+
+
+def publish_notifications(notifications):
+    """Pushes notifications to their recipients' open streams."""
+    for notification in notifications:
+        broker.publish(notification.recipient_id, NotificationSerializer(notification).data)
+
+
+def chapter_published_key(chapter_id):
+    return f"chapter-published:{chapter_id}"
+
+
+def notify_bookmarkers_of_chapter(chapter_id, chunk_size=FANOUT_CHUNK_SIZE):
+    """
+    Tells everyone who bookmarked the chapter's story that it was published.
+    Bookmarkers are read in chunks of user ids and notified with one
+    bulk insert per chunk. Each notification carries a per-chapter key, so
+    publishing the same chapter again doesn't notify anyone twice.
+    Returns the number of users processed.
+    """
+    chapter = Chapter.objects.filter(pk=chapter_id, public=True).select_related('story__author').first()
+    if chapter is None or not chapter.story.public:
+        return 0
+
+    story = chapter.story
+    message = f"{story.author} just posted a new chapter to {story.title}!"
+    key = chapter_published_key(chapter.pk)
+    bookmarkers = (Story.bookmarked_by.through.objects.filter(story_id=story.pk)
+                   .order_by('profile__user_id').values_list('profile__user_id', flat=True))
+
+    processed = 0
+    last_user_id = 0
+    while True:
+        user_ids = list(bookmarkers.filter(profile__user_id__gt=last_user_id)[:chunk_size])
+        if not user_ids:
+            break
+        connected = broker.connected_users(user_ids)
+        #whoever already has this chapter's notification got it pushed back then
+        notified = set(Notification.objects.filter(recipient_id__in=connected, dedupe_key=key)
+                       .values_list('recipient_id', flat=True)) if connected else set()
+        Notification.objects.bulk_create(
+            [Notification(recipient_id=user_id, message=message, dedupe_key=key) for user_id in user_ids],
+            ignore_conflicts=True,
+        )
+        #bulk_create skips post_save, so push the new ones to whoever is connected ourselves
+        if connected - notified:
+            publish_notifications(Notification.objects.filter(recipient_id__in=connected - notified, dedupe_key=key))
+        processed += len(user_ids)
+        last_user_id = user_ids[-1]
+    return processed
@@ -0,0 +1,126 @@
+"""
+Whole-page cache for anonymous readers of the home page and the story and
+comment pages. Only GET/HEAD requests without a session (or messages)
+cookie are served from it; a page is stored per path and query string.
+
+Pages aren't deleted when something changes. Each page is stored under
+the version of what it shows, and signals bump the version instead: the
+home page has one, every story has its own (its story and comment pages),
+and a change to a story, chapter, comment, like or bookmark bumps the
+story's version and the home page's. Everything goes through the Django
+cache API, so the local-memory and file-based backends both work.
+
+The csrf tokens in a cached page belong to whoever it was rendered for,
+so they're stored as a placeholder and filled in per request.
+"""
+import hashlib
+import re
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import patch_vary_headers
+
+#seconds a cached page is kept, even if no version bump makes it unreachable first
+DEFAULT_TIMEOUT = 300
+
+HOME = 'home'
+
+_CSRF_INPUT = re.compile(rb'(<input type="hidden" name="csrfmiddlewaretoken" value=")[^"]*(")')
+_CSRF_PLACEHOLDER = b'__page_cache_csrf_token__'
+
+
+def timeout():
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def story_scope(story_id):
+    return f'story:{story_id}'
+
+
+def _version_key(scope):
+    return f'page-version:{scope}'
+
+
+def version(scope):
+    """The current version of the pages in scope."""
+    key = _version_key(scope)
+    current = cache.get(key)
+    if current is None:
+        # start from the clock, so a version that got evicted never comes back with old pages under it
+        cache.add(key, time.time_ns(), None)
+        current = cache.get(key)
+    return current
+
+
+def _bump(scopes):
+    for scope in scopes:
+        try:
+            cache.incr(_version_key(scope))
+        except ValueError:
+            pass  # no version yet, so nothing was cached under one either
+
+
+def expire(*scopes):
+    """
+    Makes the cached pages of scopes unreachable. Bumps now, so this
+    process stops serving them, and again once the transaction commits, so
+    a page rendered from the old data in between isn't kept either.
+    """
+    _bump(scopes)
+    transaction.on_commit(lambda: _bump(scopes))
+
+
+def expire_stories(story_ids):
+    """Expires the pages of the given stories and the home page, which lists them."""
+    expire(HOME, *(story_scope(story_id) for story_id in set(story_ids)))
+
+
+def is_cacheable(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    return settings.SESSION_COOKIE_NAME not in request.COOKIES and 'messages' not in request.COOKIES
+
+
+def _page_key(scope, request):
+    path = hashlib.sha1(request.get_full_path().encode()).hexdigest()
+    return f'page:{scope}:{version(scope)}:{path}'
+
+
+def _hit(request, page):
+    content = page['content'].replace(_CSRF_PLACEHOLDER, get_token(request).encode())
+    response = HttpResponse(content, content_type=page['content_type'])
+    response['X-Page-Cache'] = 'hit'
+    patch_vary_headers(response, ['Cookie'])
+    return response
+
+
+def cache_anonymous_page(scope):
+    """
+    View decorator. scope is HOME, or a function of the view's kwargs
+    returning the scope, e.g. lambda kwargs: story_scope(kwargs['pk']).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if not timeout() or not is_cacheable(request):
+                return view(request, *args, **kwargs)
+
+            key = _page_key(scope(kwargs) if callable(scope) else scope, request)
+            page = cache.get(key)
+            if page is not None:
+                return _hit(request, page)
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming and not response.cookies:
+                content = _CSRF_INPUT.sub(rb'\g<1>' + _CSRF_PLACEHOLDER + rb'\g<2>', response.content)
+                cache.set(key, {'content': content, 'content_type': response['Content-Type']}, timeout())
+                response['X-Page-Cache'] = 'miss'
+                patch_vary_headers(response, ['Cookie'])
+            return response
+        return wrapped
+    return decorator
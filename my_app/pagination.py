@@ -0,0 +1,172 @@
+import base64
+import math
+from datetime import datetime, timezone
+
+from django.db.models import DateTimeField, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(obj, direction, field='created_at'):
+    """Opaque token pointing just past obj's (field, id) in the given direction."""
+    value = getattr(obj, field)
+    value = value.isoformat() if isinstance(value, datetime) else repr(float(value))
+    raw = f"{direction}|{field}|{value}|{obj.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _parse_value(value, model_field):
+    #encode_cursor writes datetimes as (aware) isoformat and everything else as a float, raises ValueError for anything else
+    if isinstance(model_field, DateTimeField):
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            raise ValueError("naive datetime in cursor")
+        return parsed.astimezone(timezone.utc)
+    parsed = float(value)
+    if not math.isfinite(parsed):
+        raise ValueError("non-finite number in cursor")
+    return parsed
+
+
+def decode_cursor(token, model, field='created_at'):
+    """
+    Returns (direction, value, pk), or None if the token is missing, broken,
+    was made for a list sorted by a different field or holds a value that
+    doesn't fit model's field.
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        direction, cursor_field, value, pk = raw.split('|')
+        if direction not in (NEXT, PREVIOUS) or cursor_field != field:
+            return None
+        return direction, _parse_value(value, model._meta.get_field(field)), int(pk)
+    except (ValueError, OverflowError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    """
+    One page of a newest-first (or highest-score-first) list, walked with
+    (created_at, id) or (score, id) cursors instead of OFFSET. Iterate it like a list; the templates use
+    has_next/has_previous and next_cursor/previous_cursor for the pager.
+    """
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.object_list = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+def keyset_page(queryset, cursor, page_size, field='created_at'):
+    """
+    Returns the KeysetPage of queryset, highest field first (newest first
+    for the default created_at), that cursor points to. Ties are broken by
+    id. A missing or invalid cursor gives the first page.
+    """
+    position = decode_cursor(cursor, queryset.model, field)
+    descending = (f'-{field}', '-pk')
+
+    if position is None:
+        rows = list(queryset.order_by(*descending)[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        return KeysetPage(
+            rows,
+            next_cursor=encode_cursor(rows[-1], NEXT, field) if has_more else None,
+        )
+
+    direction, value, pk = position
+    if direction == NEXT:
+        rows = list(queryset.filter(
+            Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk})
+        ).order_by(*descending)[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        return KeysetPage(
+            rows,
+            next_cursor=encode_cursor(rows[-1], NEXT, field) if has_more else None,
+            previous_cursor=encode_cursor(rows[0], PREVIOUS, field) if rows else None,
+        )
+
+    #walking backwards: take the closest higher rows, then flip them back to highest first
+    rows = list(queryset.filter(
+        Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk})
+    ).order_by(field, 'pk')[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size][::-1]
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1], NEXT, field) if rows else None,
+        previous_cursor=encode_cursor(rows[0], PREVIOUS, field) if has_more else None,
+    )
+
+
+class KeysetCursorPagination(BasePagination):
+    """DRF pagination for newest-first lists using keyset_page()."""
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 20
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor and decode_cursor(cursor, queryset.model) is None:
+            raise NotFound("Invalid cursor")
+        self.page = keyset_page(queryset, cursor, self.get_page_size(request))
+        return list(self.page)
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self._link(self.page.next_cursor),
+            'previous': self._link(self.page.previous_cursor),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+
+class Subscription:
+    """One connected client's inbox. Lives on the event loop that created it."""
+
+    def __init__(self, user_id, queue_size):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def _put(self, payload):
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            #a client that stopped reading shouldn't grow memory forever
+            self.dropped += 1
+
+    async def get(self, timeout=None):
+        """Next payload, or None if nothing arrived within timeout seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class NotificationBroker:
+    """
+    In-process pub/sub for pushing new notifications to connected users.
+    publish() can be called from any thread (views, background tasks);
+    delivery is handed to each subscriber's event loop, so idle clients
+    cost nothing and nobody polls the database.
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, user_id):
+        """Must be called from inside a running event loop."""
+        subscription = Subscription(user_id, self.queue_size)
+        with self._lock:
+            self._subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id)
+            if subscriptions is None:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[subscription.user_id]
+
+    def connected_users(self, user_ids):
+        """The subset of user_ids that have at least one open stream."""
+        with self._lock:
+            return {user_id for user_id in user_ids if user_id in self._subscribers}
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscribers.values())
+
+    def publish(self, user_id, payload):
+        """Queues payload for every open stream of user_id. Returns how many streams got it."""
+        with self._lock:
+            subscriptions = list(self._subscribers.get(user_id, ()))
+        delivered = 0
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._put, payload)
+                delivered += 1
+            except RuntimeError:
+                #its event loop is gone, the client can't be listening any more
+                self.unsubscribe(subscription)
+        return delivered
+
+
+broker = NotificationBroker()
@@ -0,0 +1,269 @@
+"""
+"Similar stories", precomputed. Every public story is a sparse vector over
+its tags, fandoms, genres and warnings (tf-idf weighted, so a rare shared
+tag counts for more than a shared genre), and a story's similar stories are
+its TOP_K nearest neighbours by cosine similarity. They're stored in
+SimilarStory so the story page reads them with one query.
+
+rebuild_similar_stories() recomputes everything in batches of rows.
+When a story's taxonomy or visibility changes, refresh_similar_stories()
+recomputes only the stories whose vectors changed (the story, and every
+story carrying a tag, fandom, genre or warning whose idf moved) and the
+stories whose top K one of those may enter or leave, from vectors of just
+the stories sharing taxonomy with them. The one input it doesn't follow is
+the number of public stories in the idf: publishing, hiding or deleting a
+story nudges every idf by about 1/N, which rebuild_similar_stories (run
+it nightly) folds in.
+"""
+import threading
+
+import numpy as np
+from scipy import sparse
+
+from django.db import transaction
+from django.db.models import CharField, Count, Min, Value
+
+from my_app.models import SimilarStory, Story
+from my_app.tasks import run_in_background
+
+TOP_K = 6
+
+#rows of the similarity matrix computed at once
+BATCH_SIZE = 256
+
+#how much one shared feature of each kind counts, before idf
+FEATURE_WEIGHTS = {'fandoms': 3.0, 'tags': 1.0, 'genres': 1.0, 'warnings': 0.5}
+
+#ids per query when looking up stored neighbours
+LOOKUP_CHUNK_SIZE = 500
+
+
+class StoryVectors:
+    """
+    Row-normalised tf-idf vectors for all public stories, or only for the
+    public ones among story_ids. The idf always comes from the whole
+    archive, so a story's vector is the same either way.
+    """
+
+    def __init__(self, story_ids=None):
+        public = Story.objects.filter(public=True)
+        if story_ids is None:
+            self.story_ids = list(public.order_by('pk').values_list('pk', flat=True))
+            story_count = len(self.story_ids)
+        else:
+            self.story_ids = sorted(pk for chunk in _chunks(story_ids)
+                                    for pk in public.filter(pk__in=chunk).values_list('pk', flat=True))
+            story_count = public.count()
+        self.row_of = {story_id: row for row, story_id in enumerate(self.story_ids)}
+
+        rows, cols, weights = [], [], []
+        columns = {}
+        for field, weight in FEATURE_WEIGHTS.items():
+            relation = getattr(Story, field)
+            pairs = relation.through.objects.filter(story__public=True).values_list(
+                'story_id', relation.field.m2m_reverse_name()
+            )
+            chunks = [pairs] if story_ids is None else (pairs.filter(story_id__in=chunk) for chunk in _chunks(self.story_ids))
+            for chunk in chunks:
+                for story_id, target_id in chunk.iterator():
+                    rows.append(self.row_of[story_id])
+                    cols.append(columns.setdefault((field, target_id), len(columns)))
+                    weights.append(weight)
+
+        shape = (len(self.story_ids), len(columns))
+        matrix = sparse.csr_matrix((weights, (rows, cols)), shape=shape, dtype=np.float64)
+        matrix.sum_duplicates()
+        if story_ids is None:
+            stories_with = np.bincount(matrix.indices, minlength=shape[1])
+        else:
+            stories_with = _stories_with(columns)
+        idf = np.log((1 + story_count) / (1 + stories_with)) + 1
+        matrix = sparse.csr_matrix(matrix.multiply(idf.reshape(1, -1)))
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        self.matrix = sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+
+    def similarities(self, rows):
+        """Sparse len(rows) x all-stories matrix of cosine similarities."""
+        return (self.matrix[rows] @ self.matrix.T).tocsr()
+
+    def neighbours(self, rows, k=TOP_K):
+        """{story id: [(similar story id, score)]}, best first, for the stories at rows."""
+        similarities = self.similarities(rows)
+        result = {}
+        for i, row in enumerate(rows):
+            start, end = similarities.indptr[i], similarities.indptr[i + 1]
+            columns = similarities.indices[start:end]
+            scores = similarities.data[start:end]
+            keep = (columns != row) & (scores > 0)
+            columns, scores = columns[keep], scores[keep]
+            if len(scores) > k:
+                best = np.argpartition(-scores, k)[:k]
+                columns, scores = columns[best], scores[best]
+            order = np.lexsort((columns, -scores))
+            result[self.story_ids[row]] = [(self.story_ids[columns[j]], float(scores[j])) for j in order]
+        return result
+
+
+def _store(neighbours):
+    with transaction.atomic():
+        SimilarStory.objects.filter(story_id__in=list(neighbours)).delete()
+        SimilarStory.objects.bulk_create([
+            SimilarStory(story_id=story_id, similar_id=similar_id, score=score)
+            for story_id, similar in neighbours.items() for similar_id, score in similar
+        ])
+
+
+def _chunks(items, size=LOOKUP_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _stories_with(columns):
+    #how many public stories have each (field, target id) column, in column order
+    counts = np.zeros(len(columns))
+    for field in FEATURE_WEIGHTS:
+        relation = getattr(Story, field)
+        target = relation.field.m2m_reverse_name()
+        target_ids = [target_id for kind, target_id in columns if kind == field]
+        for chunk in _chunks(target_ids):
+            stored = (relation.through.objects.filter(story__public=True, **{f'{target}__in': chunk})
+                      .values(target).annotate(n=Count('pk')).values_list(target, 'n'))
+            for target_id, n in stored:
+                counts[columns[(field, target_id)]] = n
+    return counts
+
+
+def story_features(story_ids):
+    """The (field, target id) pairs the stories carry, e.g. ('tags', 3), one query per chunk of stories."""
+    features = set()
+    for chunk in _chunks(story_ids):
+        parts = [
+            getattr(Story, field).through.objects.filter(story_id__in=chunk)
+            .annotate(kind=Value(field, output_field=CharField()))
+            .values_list('kind', getattr(Story, field).field.m2m_reverse_name())
+            for field in FEATURE_WEIGHTS
+        ]
+        features.update(parts[0].union(*parts[1:], all=True))
+    return features
+
+
+def _carrying(features):
+    #public stories with any of the (field, target id) features
+    found = set()
+    for field in FEATURE_WEIGHTS:
+        relation = getattr(Story, field)
+        target = relation.field.m2m_reverse_name()
+        for chunk in _chunks(target_id for kind, target_id in features if kind == field):
+            found.update(relation.through.objects.filter(story__public=True, **{f'{target}__in': chunk})
+                         .values_list('story_id', flat=True))
+    return found
+
+
+def _sharing_taxonomy(story_ids):
+    """story_ids plus every public story with a tag, fandom, genre or warning in common with one of them."""
+    found = set(story_ids)
+    for field in FEATURE_WEIGHTS:
+        relation = getattr(Story, field)
+        target = relation.field.m2m_reverse_name()
+        through = relation.through.objects
+        for chunk in _chunks(story_ids):
+            found.update(through.filter(
+                story__public=True, **{f'{target}__in': through.filter(story_id__in=chunk).values(target)}
+            ).values_list('story_id', flat=True))
+    return found
+
+
+def rebuild_similar_stories(batch_size=BATCH_SIZE):
+    """Recomputes every public story's similar stories. Returns how many were stored."""
+    vectors = StoryVectors()
+    SimilarStory.objects.exclude(story_id__in=Story.objects.filter(public=True)).delete()
+    total = 0
+    for start in range(0, len(vectors.story_ids), batch_size):
+        neighbours = vectors.neighbours(range(start, min(start + batch_size, len(vectors.story_ids))))
+        _store(neighbours)
+        total += sum(len(similar) for similar in neighbours.values())
+    return total
+
+
+def refresh_similar_stories(story_ids, features=(), batch_size=BATCH_SIZE):
+    """
+    Brings the stored neighbours up to date after story_ids changed and the
+    (field, target id) features were added to or removed from stories (or
+    carried by stories that were published, hidden or deleted). Every score
+    involving a story whose vector moved is recomputed, which is the changed
+    stories and every public story carrying a changed feature, since its
+    idf moved too. Recomputed: those stories, stories that list one of
+    them, and stories where one of them now scores above their current K-th
+    best. Only vectors for those stories and the stories sharing taxonomy
+    with them are built, never the whole archive.
+    """
+    story_ids = set(story_ids) | _carrying(features)
+    affected = set()
+    for chunk in _chunks(story_ids):
+        affected.update(SimilarStory.objects.filter(similar_id__in=chunk).values_list('story_id', flat=True))
+
+    # stories sharing nothing with a changed story score 0 against it, so they're never candidates
+    vectors = StoryVectors(_sharing_taxonomy(story_ids))
+    # private or deleted stories keep no recommendations
+    SimilarStory.objects.filter(story_id__in=[pk for pk in story_ids if pk not in vectors.row_of]).delete()
+
+    changed_rows = [vectors.row_of[pk] for pk in story_ids if pk in vectors.row_of]
+    affected.update(vectors.story_ids[row] for row in changed_rows)
+    if changed_rows:
+        # similarity is symmetric: the changed stories' rows say how close everyone else is to them
+        best = np.asarray(vectors.similarities(changed_rows).max(axis=0).todense()).ravel()
+        candidates = {vectors.story_ids[row]: best[row] for row in np.flatnonzero(best > 0)}
+        for chunk in _chunks(candidates):
+            stored = (SimilarStory.objects.filter(story_id__in=chunk).values('story_id')
+                      .annotate(n=Count('pk'), lowest=Min('score')))
+            thresholds = {row['story_id']: row['lowest'] for row in stored if row['n'] >= TOP_K}
+            affected.update(pk for pk in chunk if candidates[pk] > thresholds.get(pk, 0))
+
+    # the affected stories' neighbours are among the stories sharing taxonomy with them
+    vectors = StoryVectors(_sharing_taxonomy(affected))
+    rows = sorted(vectors.row_of[pk] for pk in affected if pk in vectors.row_of)
+    for start in range(0, len(rows), batch_size):
+        _store(vectors.neighbours(rows[start:start + batch_size]))
+    return len(rows)
+
+
+_pending = {'stories': set(), 'features': set()}
+_pending_lock = threading.Lock()
+
+
+def _refresh_pending():
+    with _pending_lock:
+        story_ids, features = set(_pending['stories']), set(_pending['features'])
+        _pending['stories'].clear()
+        _pending['features'].clear()
+    if story_ids or features:
+        refresh_similar_stories(story_ids, features)
+
+
+def schedule_refresh(story_ids, features=()):
+    """
+    Refreshes recommendations for story_ids and the stories carrying
+    features (see refresh_similar_stories) in the background once the
+    transaction commits. Saving a story fires several m2m signals; changes
+    that pile up before the worker gets to them are refreshed together.
+    """
+    story_ids, features = set(story_ids), set(features)
+
+    def queue():
+        with _pending_lock:
+            _pending['stories'].update(story_ids)
+            _pending['features'].update(features)
+        run_in_background(_refresh_pending)
+
+    transaction.on_commit(queue)
+
+
+def similar_stories(story, limit=TOP_K):
+    """The story's stored similar stories (with authors), best first, in one query."""
+    return [
+        row.similar for row in
+        SimilarStory.objects.filter(story=story, similar__public=True)
+        .select_related('similar__author').order_by('-score')[:limit]
+    ]
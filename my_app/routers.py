@@ -0,0 +1,75 @@
+"""
+Primary/replica routing. Writes always go to the primary ('default'); reads
+inside a web request go to one of settings.DATABASE_REPLICAS until the
+request writes something (or from the start, for POSTs and other unsafe
+methods), after which it stays on the primary so the user reads their
+own writes. ReplicaRoutingMiddleware marks where a request
+starts and ends; anything outside a request (management commands,
+background tasks) reads from the primary.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+PRIMARY = 'default'
+
+#per-request routing state, None outside ReplicaRoutingMiddleware
+_state = ContextVar('replica_routing', default=None)
+
+
+def replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+def start_request(pinned=False):
+    """Starts routing reads for a request. Returns the token for end_request."""
+    return _state.set({'pinned': pinned, 'replica': None, 'wrote': False})
+
+
+def end_request(token):
+    """Ends the request. Returns True if it wrote to the primary."""
+    state = _state.get()
+    _state.reset(token)
+    return bool(state and state['wrote'])
+
+
+def pin_to_primary():
+    """Sends the rest of this request's reads to the primary."""
+    state = _state.get()
+    if state is not None:
+        state['pinned'] = True
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state['pinned'] or connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+        aliases = replicas()
+        if not aliases:
+            return PRIMARY
+        #one replica for the whole request so the page is read from a single snapshot
+        if state['replica'] not in aliases:
+            state['replica'] = random.choice(aliases)
+        return state['replica']
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state['pinned'] = state['wrote'] = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        #replicas hold the same rows as the primary
+        databases = {PRIMARY, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        #replicas are copies of the primary, never migrated on their own
+        if db in replicas():
+            return False
+        return None
@@ -0,0 +1,126 @@
+from django.db import connection, OperationalError
+
+from my_app.models import Story
+
+#FTS5 virtual table, rowid is the story id
+INDEX_TABLE = 'story_search_index'
+
+#bm25 column weights: title, synopsis, author, tags, fandoms
+WEIGHTS = (10.0, 1.0, 5.0, 3.0, 3.0)
+
+#most results we rank and hand back to the view
+RESULT_LIMIT = 500
+
+#databases we've already seen the index table in, so we don't look it up on every save
+_enabled_databases = set()
+
+
+def is_enabled():
+    """True if the database has the full-text index (SQLite built with FTS5)."""
+    if connection.vendor != 'sqlite':
+        return False
+    name = str(connection.settings_dict['NAME'])
+    if name in _enabled_databases:
+        return True
+    if INDEX_TABLE in connection.introspection.table_names():
+        _enabled_databases.add(name)
+        return True
+    return False
+
+
+def build_match_query(text):
+    """
+    Turns what the user typed into an FTS5 MATCH expression.
+    Every word is quoted so FTS operators can't sneak in, and gets a * so
+    'drag' finds 'dragons'. All words must match (somewhere in the row).
+    """
+    terms = []
+    for word in text.split():
+        word = word.strip('#,').replace('"', '""')
+        if word:
+            terms.append(f'"{word}"*')
+    return ' '.join(terms)
+
+
+def _row(story):
+    return (
+        story.pk,
+        story.title,
+        story.synopsis,
+        story.author.username,
+        ' '.join(tag.name for tag in story.tags.all()),
+        ' '.join(fandom.name for fandom in story.fandoms.all()),
+    )
+
+
+def _insert(cursor, rows):
+    cursor.executemany(
+        f'INSERT INTO {INDEX_TABLE} (rowid, title, synopsis, author, tags, fandoms) VALUES (%s, %s, %s, %s, %s, %s)',
+        rows,
+    )
+
+
+def index_stories(story_ids):
+    """(Re)writes the index rows for the given stories."""
+    story_ids = list(story_ids)
+    if not story_ids or not is_enabled():
+        return
+    stories = Story.objects.filter(pk__in=story_ids).select_related('author').prefetch_related('tags', 'fandoms')
+    with connection.cursor() as cursor:
+        remove_stories(story_ids, cursor=cursor)
+        _insert(cursor, [_row(story) for story in stories])
+
+
+def remove_stories(story_ids, cursor=None):
+    story_ids = list(story_ids)
+    if not story_ids or not is_enabled():
+        return
+    placeholders = ', '.join(['%s'] * len(story_ids))
+    sql = f'DELETE FROM {INDEX_TABLE} WHERE rowid IN ({placeholders})'
+    if cursor is not None:
+        cursor.execute(sql, story_ids)
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(sql, story_ids)
+
+
+def rebuild_index(batch_size=500):
+    """Drops every row and indexes all stories again. Returns the number of stories indexed."""
+    total = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {INDEX_TABLE}')
+        stories = Story.objects.select_related('author').prefetch_related('tags', 'fandoms').order_by('pk')
+        batch = []
+        for story in stories.iterator(chunk_size=batch_size):
+            batch.append(_row(story))
+            if len(batch) >= batch_size:
+                _insert(cursor, batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            _insert(cursor, batch)
+            total += len(batch)
+    return total
+
+
+def search_story_ids(text, limit=RESULT_LIMIT):
+    """
+    Returns ids of stories matching text, best match first (BM25).
+    Returns None if the full-text index can't be used, so callers can fall back.
+    """
+    match = build_match_query(text)
+    if not match:
+        return []
+    if not is_enabled():
+        return None
+
+    rank = f"bm25({INDEX_TABLE}, {', '.join(str(w) for w in WEIGHTS)})"
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {INDEX_TABLE} WHERE {INDEX_TABLE} MATCH %s ORDER BY {rank} LIMIT %s',
+                [match, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+    except OperationalError:
+        return None
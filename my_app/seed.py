@@ -0,0 +1,250 @@
+import hashlib
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+
+from my_app import recommendations, search, timelines, trending
+from my_app.chapters import page_offsets
+from my_app.counters import reconcile_counters
+from my_app.models import (Chapter, Comment, EngagementEvent, Fandom, Genre, Notification, Post, Profile, Story, Tag,
+                           Warning)
+
+#everyone seeded gets this password, so you can log in as any of them
+SEED_PASSWORD = 'seedpass123'
+
+WORDS = (
+    "the a of and to in was he she it that his her with as for had on at by but not "
+    "from they were you which one all we there been their said when who would will more "
+    "lodge owl forest coffee cherry pie diner mountain river night dream door red room "
+    "shadow light garden letter window storm silver glass quiet ancient city road sea "
+    "remember whisper wander listen follow return broken hidden golden fading endless"
+).split()
+
+GENRES = ['Fantasy', 'Romance', 'Mystery', 'Horror', 'Sci-Fi', 'Drama', 'Comedy', 'Adventure']
+WARNINGS = ['Violence', 'Major Character Death', 'Gore', 'Abuse', 'Self-Harm']
+
+DEFAULTS = {
+    'users': 200,
+    'stories': 500,
+    'chapters_per_story': 5,
+    'chapter_chars': 12000,
+    'tags': 300,
+    'fandoms': 60,
+    'tags_per_story': 6,
+    'likes_per_story': 20,
+    'bookmarks_per_story': 8,
+    'follows_per_user': 10,
+    'comments_per_story': 8,
+    'replies_per_comment': 2,
+    'notifications_per_user': 30,
+    'batch_size': 500,
+    'seed': 42,
+}
+
+
+class Seeder:
+    """
+    Fills the database with a synthetic archive using bulk inserts only.
+    Signals don't run for bulk inserts, so the stored counters, trending
+    scores, Following timelines, similar stories and the search index are
+    rebuilt once at the end.
+    """
+
+    def __init__(self, stdout=None, **options):
+        self.options = {**DEFAULTS, **{k: v for k, v in options.items() if v is not None}}
+        self.random = random.Random(self.options['seed'])
+        self.batch_size = self.options['batch_size']
+        self.stdout = stdout
+        self.now = timezone.now()
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    def words(self, n):
+        return ' '.join(self.random.choice(WORDS) for _ in range(n))
+
+    def paragraphs(self, chars):
+        #lognormal-ish length so a few chapters are much longer than the rest
+        target = max(200, int(chars * self.random.lognormvariate(0, 0.5)))
+        out, length = [], 0
+        while length < target:
+            paragraph = self.words(self.random.randint(30, 120)).capitalize() + '.'
+            out.append(paragraph)
+            length += len(paragraph) + 2
+        return '\n\n'.join(out)
+
+    def past(self, max_days=365):
+        return self.now - timedelta(seconds=self.random.randint(0, max_days * 24 * 3600))
+
+    def spread_created_at(self, model, objects):
+        #auto_now_add stamps every row with "now", so give them a realistic history afterwards
+        for obj in objects:
+            obj.created_at = self.past()
+        model.objects.bulk_update(objects, ['created_at'], batch_size=self.batch_size)
+
+    def insert_children(self, model, rows):
+        """
+        Django won't bulk_create multi-table children (Story, Comment), so the
+        parent Post rows are bulk created first and the child rows inserted here.
+        """
+        fields = model._meta.local_concrete_fields
+        columns = ', '.join(connection.ops.quote_name(f.column) for f in fields)
+        placeholders = ', '.join(['%s'] * len(fields))
+        sql = f"INSERT INTO {connection.ops.quote_name(model._meta.db_table)} ({columns}) VALUES ({placeholders})"
+        values = [[f.get_db_prep_save(getattr(row, f.attname), connection) for f in fields] for row in rows]
+        with connection.cursor() as cursor:
+            for start in range(0, len(values), self.batch_size):
+                cursor.executemany(sql, values[start:start + self.batch_size])
+
+    def create_comments(self, targets, users):
+        """targets is [(story id, parent comment id or None)], one comment each."""
+        posts = Post.objects.bulk_create([Post(author=self.random.choice(users)) for _ in targets],
+                                         batch_size=self.batch_size)
+        self.spread_created_at(Post, posts)
+        comments = []
+        for post, (story_id, parent_id) in zip(posts, targets):
+            comment = Comment(post_ptr=post, author_id=post.author_id, created_at=post.created_at,
+                              post_id=story_id, parent_id=parent_id,
+                              content=self.words(self.random.randint(5, 60)).capitalize())
+            comment.pk = post.pk
+            comments.append(comment)
+        self.insert_children(Comment, comments)
+        return comments
+
+    def sample(self, population, k):
+        return self.random.sample(population, min(k, len(population)))
+
+    @transaction.atomic
+    def run(self):
+        o = self.options
+        stamp = self.now.strftime('%Y%m%d%H%M%S')
+
+        password = make_password(SEED_PASSWORD)
+        users = User.objects.bulk_create(
+            [User(username=f'seed_{stamp}_{i}', password=password) for i in range(o['users'])],
+            batch_size=self.batch_size,
+        )
+        profiles = Profile.objects.bulk_create(
+            [Profile(user=user, name=self.words(2).title(), bio=self.words(15)) for user in users],
+            batch_size=self.batch_size,
+        )
+        self.log(f"{len(users)} users")
+
+        genres = [Genre.objects.get_or_create(name=name)[0] for name in GENRES]
+        warnings = [Warning.objects.get_or_create(name=name)[0] for name in WARNINGS]
+        Tag.objects.bulk_create([Tag(name=f'{self.random.choice(WORDS)}-{i}') for i in range(o['tags'])],
+                                ignore_conflicts=True, batch_size=self.batch_size)
+        Fandom.objects.bulk_create([Fandom(name=f'{self.words(2).title()} {i}') for i in range(o['fandoms'])],
+                                   ignore_conflicts=True, batch_size=self.batch_size)
+        tag_ids = list(Tag.objects.values_list('pk', flat=True))
+        fandom_ids = list(Fandom.objects.values_list('pk', flat=True))
+
+        posts = Post.objects.bulk_create([Post(author=self.random.choice(users)) for _ in range(o['stories'])],
+                                         batch_size=self.batch_size)
+        self.spread_created_at(Post, posts)
+        stories = []
+        for post in posts:
+            story = Story(post_ptr=post, author_id=post.author_id, created_at=post.created_at,
+                          title=self.words(self.random.randint(1, 5)).title(),
+                          synopsis=self.words(self.random.randint(20, 80)),
+                          public=self.random.random() < 0.9)
+            story.pk = post.pk
+            stories.append(story)
+        self.insert_children(Story, stories)
+        self.log(f"{len(stories)} stories")
+
+        Story.genres.through.objects.bulk_create([
+            Story.genres.through(story_id=s.pk, genre_id=g.pk)
+            for s in stories for g in self.sample(genres, self.random.randint(1, 3))
+        ], batch_size=self.batch_size)
+        Story.warnings.through.objects.bulk_create([
+            Story.warnings.through(story_id=s.pk, warning_id=w.pk)
+            for s in stories for w in self.sample(warnings, self.random.randint(0, 2))
+        ], batch_size=self.batch_size)
+        Story.tags.through.objects.bulk_create([
+            Story.tags.through(story_id=s.pk, tag_id=t)
+            for s in stories for t in self.sample(tag_ids, self.random.randint(1, o['tags_per_story'] * 2))
+        ], batch_size=self.batch_size)
+        Story.fandoms.through.objects.bulk_create([
+            Story.fandoms.through(story_id=s.pk, fandom_id=f)
+            for s in stories for f in self.sample(fandom_ids, self.random.randint(0, 2))
+        ], batch_size=self.batch_size)
+
+        chapters = []
+        for story in stories:
+            for n in range(self.random.randint(1, o['chapters_per_story'] * 2 - 1)):
+                content = self.paragraphs(o['chapter_chars'])
+                chapters.append(Chapter(story_id=story.pk, title=f'Chapter {n + 1}', position=n + 1,
+                                        content=content, content_hash=hashlib.sha1(content.encode()).hexdigest(),
+                                        page_offsets=page_offsets(content), public=self.random.random() < 0.9))
+            if len(chapters) >= self.batch_size:
+                Chapter.objects.bulk_create(chapters, batch_size=self.batch_size)
+                chapters = []
+        Chapter.objects.bulk_create(chapters, batch_size=self.batch_size)
+        self.log(f"{Chapter.objects.filter(story_id__in=[s.pk for s in stories]).count()} chapters")
+
+        likes = Post.liked_by.through.objects.bulk_create([
+            Post.liked_by.through(post_id=s.pk, profile_id=p.pk)
+            for s in stories for p in self.sample(profiles, int(self.random.expovariate(1 / o['likes_per_story'])))
+        ], batch_size=self.batch_size)
+        bookmarks = Story.bookmarked_by.through.objects.bulk_create([
+            Story.bookmarked_by.through(story_id=s.pk, profile_id=p.pk)
+            for s in stories for p in self.sample(profiles, int(self.random.expovariate(1 / o['bookmarks_per_story'])))
+        ], batch_size=self.batch_size)
+        Profile.followers.through.objects.bulk_create([
+            Profile.followers.through(from_profile_id=followed.pk, to_profile_id=follower.pk)
+            for followed in profiles
+            for follower in self.sample(profiles, self.random.randint(0, o['follows_per_user'] * 2))
+            if follower.pk != followed.pk
+        ], batch_size=self.batch_size)
+
+        comments = self.create_comments([
+            (story.pk, None)
+            for story in stories for _ in range(self.random.randint(0, o['comments_per_story'] * 2))
+        ], users)
+        replies = self.create_comments([
+            (comment.post_id, comment.pk)
+            for comment in comments for _ in range(self.random.randint(0, o['replies_per_comment'] * 2))
+        ], users)
+        self.log(f"{len(comments) + len(replies)} comments")
+
+        #likes and bookmarks have no time of their own, say they happened recently (but after the story)
+        posted = {story.pk: story.created_at for story in stories}
+        EngagementEvent.objects.bulk_create(
+            [EngagementEvent(story_id=like.post_id, profile_id=like.profile_id, kind='like',
+                             created_at=max(self.past(14), posted[like.post_id])) for like in likes]
+            + [EngagementEvent(story_id=b.story_id, profile_id=b.profile_id, kind='bookmark',
+                               created_at=max(self.past(14), posted[b.story_id])) for b in bookmarks]
+            + [EngagementEvent(story_id=c.post_id, kind='comment', created_at=max(c.created_at, posted[c.post_id]))
+               for c in comments + replies],
+            batch_size=self.batch_size,
+        )
+
+        notifications = []
+        for user in users:
+            for _ in range(self.random.randint(0, o['notifications_per_user'] * 2)):
+                notifications.append(Notification(recipient=user, message=f"{self.random.choice(users)} {self.words(6)}",
+                                                  read=self.random.random() < 0.6))
+        Notification.objects.bulk_create(notifications, batch_size=self.batch_size)
+        for notification in notifications:
+            notification.created_at = self.past(60)
+        Notification.objects.bulk_update(notifications, ['created_at'], batch_size=self.batch_size)
+        self.log(f"{len(notifications)} notifications")
+
+        reconcile_counters()
+        timelines.rebuild_timelines()
+        recommendations.rebuild_similar_stories()
+        trending.recompute_trending(batch_size=self.batch_size)
+        if search.is_enabled():
+            search.rebuild_index(batch_size=self.batch_size)
+        return {
+            'users': len(users),
+            'stories': len(stories),
+            'comments': Comment.objects.filter(post_id__in=[s.pk for s in stories]).count(),
+            'notifications': len(notifications),
+        }
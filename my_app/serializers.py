@@ -8,3 +8,7 @@ class NotificationSerializer(serializers.ModelSerializer):
         fields = ['id', 'message', 'created_at', 'read']
         read_only_fields = ['id', 'message', 'created_at']
 
+
+class NotificationMarkReadSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=1000)
+    up_to = serializers.IntegerField(required=False)
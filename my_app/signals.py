@@ -0,0 +1,272 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save, m2m_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from my_app import autocomplete, page_cache, recommendations, search, timelines, trending
+from my_app.counters import recount_followers
+from my_app.models import Chapter, Comment, Post, Profile, SimilarStory, Story, Tag, Fandom, Notification
+from my_app.notifications import publish_notifications
+from my_app.tasks import run_in_background
+
+
+#keep the full-text search index in sync with stories
+
+@receiver(post_save, sender=Story)
+def index_story_on_save(sender, instance, **kwargs):
+    search.index_stories([instance.pk])
+
+
+@receiver(post_delete, sender=Story)
+def unindex_story_on_delete(sender, instance, **kwargs):
+    search.remove_stories([instance.pk])
+
+
+def _changed_story_ids(instance, action, reverse, pk_set, **kwargs):
+    #ids of the stories an m2m change on one of Story's taxonomy fields touched, None if nothing changed yet
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return None
+    if not reverse:
+        return None if action == 'pre_clear' else [instance.pk]
+    #reverse side, e.g. tag.story_set.add(...) - instance is the tag
+    if action == 'pre_clear':
+        instance._cleared_story_ids = list(instance.story_set.values_list('pk', flat=True))
+        return None
+    if action == 'post_clear':
+        return getattr(instance, '_cleared_story_ids', [])
+    return pk_set or []
+
+
+@receiver(m2m_changed, sender=Story.tags.through)
+@receiver(m2m_changed, sender=Story.fandoms.through)
+def reindex_story_taxonomy(sender, **kwargs):
+    story_ids = _changed_story_ids(**kwargs)
+    if story_ids:
+        search.index_stories(story_ids)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Fandom)
+def reindex_renamed_taxonomy(sender, instance, created, **kwargs):
+    if not created:
+        search.index_stories(instance.story_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=User)
+def reindex_renamed_author(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields and 'username' not in update_fields):
+        return
+    search.index_stories(Story.objects.filter(author=instance).values_list('pk', flat=True))
+
+
+#push new notifications to open streams once they're committed
+
+@receiver(post_save, sender=Notification)
+def publish_new_notification(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: publish_notifications([instance]))
+
+
+#following timelines: fan out stories that go public, take back ones that go private
+
+@receiver(pre_save, sender=Story)
+def remember_story_visibility(sender, instance, **kwargs):
+    instance._was_public = bool(instance.pk) and Story.objects.filter(pk=instance.pk, public=True).exists()
+
+
+@receiver(post_save, sender=Story)
+def update_timelines_on_visibility_change(sender, instance, **kwargs):
+    was_public = getattr(instance, '_was_public', False)
+    if instance.public and not was_public:
+        run_in_background(timelines.fan_out_story, instance.pk)
+    elif was_public and not instance.public:
+        timelines.remove_story(instance.pk)
+
+
+@receiver(m2m_changed, sender=Profile.followers.through)
+def update_timelines_on_follow(sender, instance, action, reverse, pk_set, **kwargs):
+    #profile.followers.add(f) has instance=profile, follower.following.add(p) has instance=follower
+    if action == 'pre_clear':
+        related = instance.following if reverse else instance.followers
+        instance._cleared_follow_ids = set(related.values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_cleared_follow_ids', set())
+    elif action not in ('post_add', 'post_remove'):
+        return
+    if not pk_set:
+        return
+
+    pairs = [(instance.pk, pk) for pk in pk_set] if reverse else [(pk, instance.pk) for pk in pk_set]
+    for follower_id, author_id in pairs:
+        if action == 'post_add':
+            timelines.backfill(follower_id, [author_id])
+        else:
+            timelines.unfollow(follower_id, [author_id])
+    recount_followers({author_id for _, author_id in pairs})
+
+
+#similar-story recommendations: recompute around stories whose taxonomy or visibility changed
+
+_TAXONOMY_FIELDS = {
+    Story.tags.through: 'tags',
+    Story.fandoms.through: 'fandoms',
+    Story.genres.through: 'genres',
+    Story.warnings.through: 'warnings',
+}
+
+
+def _changed_features(sender, instance, action, reverse, pk_set, **kwargs):
+    #(field, target id) pairs whose story count an m2m change on Story's taxonomy changed, i.e. whose idf moved
+    field = _TAXONOMY_FIELDS[sender]
+    if reverse:
+        #tag.story_set.add(...) - instance is the tag
+        return {(field, instance.pk)} if action in ('post_add', 'post_remove', 'post_clear') else set()
+    if action == 'pre_clear':
+        cleared = getattr(instance, '_cleared_features', {})
+        cleared[field] = {(field, pk) for pk in getattr(instance, field).values_list('pk', flat=True)}
+        instance._cleared_features = cleared
+        return set()
+    if action == 'post_clear':
+        return getattr(instance, '_cleared_features', {}).get(field, set())
+    if action in ('post_add', 'post_remove'):
+        return {(field, pk) for pk in pk_set or ()}
+    return set()
+
+
+@receiver(m2m_changed, sender=Story.tags.through)
+@receiver(m2m_changed, sender=Story.fandoms.through)
+@receiver(m2m_changed, sender=Story.genres.through)
+@receiver(m2m_changed, sender=Story.warnings.through)
+def refresh_recommendations_on_taxonomy_change(sender, **kwargs):
+    features = _changed_features(sender, **kwargs)
+    story_ids = _changed_story_ids(**kwargs)
+    if story_ids:
+        recommendations.schedule_refresh(story_ids, features)
+
+
+@receiver(post_save, sender=Story)
+def refresh_recommendations_on_visibility_change(sender, instance, **kwargs):
+    if instance.public != getattr(instance, '_was_public', False):
+        recommendations.schedule_refresh([instance.pk], recommendations.story_features([instance.pk]))
+
+
+@receiver(pre_delete, sender=Story)
+def refresh_recommendations_on_delete(sender, instance, **kwargs):
+    listed_by = list(SimilarStory.objects.filter(similar=instance).values_list('story_id', flat=True))
+    features = recommendations.story_features([instance.pk])
+    if listed_by or features:
+        recommendations.schedule_refresh(listed_by, features)
+
+
+#trending scores: every like, bookmark and comment bumps the story
+
+@receiver(pre_save, sender=Story)
+def set_initial_trending_score(sender, instance, **kwargs):
+    if instance._state.adding and not instance.trending_score:
+        instance.trending_score = trending.initial_score(instance.created_at or timezone.now())
+
+
+def _engagement_changed(kind, instance, action, reverse, pk_set, **kwargs):
+    #post.liked_by.add(profile) has instance=post, profile.liked_posts.add(post) has instance=profile
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return
+    pairs = [(pk, instance.pk) for pk in pk_set] if reverse else [(instance.pk, pk) for pk in pk_set]
+    for story_id, profile_id in pairs:
+        if action == 'post_add':
+            trending.record(story_id, kind, profile_id)
+        else:
+            trending.withdraw(story_id, kind, profile_id)
+
+
+@receiver(m2m_changed, sender=Post.liked_by.through)
+def update_trending_on_like(sender, **kwargs):
+    _engagement_changed('like', **kwargs)
+
+
+@receiver(m2m_changed, sender=Story.bookmarked_by.through)
+def update_trending_on_bookmark(sender, **kwargs):
+    _engagement_changed('bookmark', **kwargs)
+
+
+@receiver(post_save, sender=Comment)
+def update_trending_on_comment(sender, instance, created, **kwargs):
+    if created:
+        trending.record(instance.post_id, 'comment', when=instance.created_at)
+
+
+#autocomplete: rebuild the in-memory name indexes when tags or fandoms change
+
+@receiver(m2m_changed, sender=Story.tags.through)
+@receiver(m2m_changed, sender=Story.fandoms.through)
+def refresh_autocomplete_on_use(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        autocomplete.schedule_refresh(Tag if sender is Story.tags.through else Fandom)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Fandom)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Fandom)
+def refresh_autocomplete_on_rename(sender, **kwargs):
+    autocomplete.schedule_refresh(sender)
+
+
+#anonymous page cache: a change to a story, its chapters, comments, likes or bookmarks expires its pages and the home page
+
+@receiver(post_save, sender=Story)
+@receiver(post_delete, sender=Story)
+def expire_pages_on_story_change(sender, instance, **kwargs):
+    page_cache.expire_stories([instance.pk])
+
+
+@receiver(post_save, sender=Chapter)
+@receiver(post_delete, sender=Chapter)
+def expire_pages_on_chapter_change(sender, instance, **kwargs):
+    page_cache.expire_stories([instance.story_id])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def expire_pages_on_comment_change(sender, instance, **kwargs):
+    page_cache.expire_stories([instance.post_id])
+
+
+@receiver(m2m_changed, sender=Story.tags.through)
+@receiver(m2m_changed, sender=Story.fandoms.through)
+@receiver(m2m_changed, sender=Story.genres.through)
+@receiver(m2m_changed, sender=Story.warnings.through)
+def expire_pages_on_taxonomy_change(sender, **kwargs):
+    #StoryForm sets these after saving the story, so the story's own save expired the pages too early
+    story_ids = _changed_story_ids(**kwargs)
+    if story_ids:
+        page_cache.expire_stories(story_ids)
+
+
+def _engaged_post_ids(related_name, instance, action, reverse, pk_set, **kwargs):
+    #ids of the posts a change to liked_by/bookmarked_by touched; reverse means instance is the profile
+    if action == 'pre_clear':
+        instance._cleared_post_ids = list(getattr(instance, related_name).values_list('pk', flat=True)) if reverse else []
+        return []
+    if action == 'post_clear':
+        return getattr(instance, '_cleared_post_ids', []) if reverse else [instance.pk]
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return []
+    return list(pk_set) if reverse else [instance.pk]
+
+
+@receiver(m2m_changed, sender=Post.liked_by.through)
+def expire_pages_on_like(sender, **kwargs):
+    post_ids = _engaged_post_ids('liked_posts', **kwargs)
+    if post_ids:
+        #a liked comment shows on its story's pages
+        comments = dict(Comment.objects.filter(pk__in=post_ids).values_list('pk', 'post_id'))
+        page_cache.expire_stories(comments.get(post_id, post_id) for post_id in post_ids)
+
+
+@receiver(m2m_changed, sender=Story.bookmarked_by.through)
+def expire_pages_on_bookmark(sender, **kwargs):
+    story_ids = _engaged_post_ids('bookmarked_stories', **kwargs)
+    if story_ids:
+        page_cache.expire_stories(story_ids)
@@ -0,0 +1,35 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+#small in-process pool for work that shouldn't hold up the response
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='my_app-task')
+
+
+def _run(func, args, kwargs):
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception("Background task %s failed", getattr(func, '__name__', func))
+    finally:
+        close_old_connections()
+
+
+def run_in_background(func, *args, **kwargs):
+    """
+    Runs func(*args, **kwargs) on a worker thread once the current
+    transaction commits, so the request can return straight away.
+    Set BACKGROUND_TASKS_INLINE = True to run it in the calling thread instead
+    (handy in tests and management commands).
+    """
+    def submit():
+        if getattr(settings, 'BACKGROUND_TASKS_INLINE', False):
+            func(*args, **kwargs)
+        else:
+            _executor.submit(_run, func, args, kwargs)
+
+    transaction.on_commit(submit)
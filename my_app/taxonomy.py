@@ -0,0 +1,26 @@
+def resolve_names(model, names):
+    """
+    Returns model rows (Tag, Fandom, ...) for names, creating the missing ones.
+    One query to find what exists, one bulk insert for the rest and one more
+    to read back the new ids - however many names there are.
+    """
+    names = list(dict.fromkeys(name for name in names if name))
+    if not names:
+        return []
+    existing = {row.name: row for row in model.objects.filter(name__in=names)}
+    missing = [name for name in names if name not in existing]
+    if missing:
+        # ignore_conflicts: someone else may create the same name at the same time
+        model.objects.bulk_create([model(name=name) for name in missing], ignore_conflicts=True)
+        existing.update({row.name: row for row in model.objects.filter(name__in=missing)})
+    return [existing[name] for name in names]
+
+
+def sync_names(instance, field_name, names):
+    """
+    Makes instance.<field_name> (a name-keyed M2M like Story.tags) hold exactly names.
+    The M2M diff is applied with set(), i.e. one insert and one delete, and the
+    usual m2m_changed signals still fire.
+    """
+    manager = getattr(instance, field_name)
+    manager.set(resolve_names(manager.model, names))
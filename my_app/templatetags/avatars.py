@@ -0,0 +1,21 @@
+from django import template
+
+from my_app.avatars import avatar_variants
+
+register = template.Library()
+
+
+@register.inclusion_tag('avatar.html')
+def avatar(profile, size, css_class='', alt=''):
+    """
+    {% avatar profile 100 "rounded-circle" %} - the profile picture at size px,
+    served from the smallest generated variant that fits (webp with a jpeg
+    fallback), or the original upload until the variants exist.
+    """
+    return {
+        'profile': profile,
+        'size': size,
+        'css_class': css_class,
+        'alt': alt,
+        'variants': avatar_variants(profile, size),
+    }
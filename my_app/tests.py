@@ -1,10 +1,51 @@
-from django.test import TestCase
-from my_app.models import Profile, Story, Genre, Warning, Fandom, Comment, Report, Reason, Post
-from my_app.forms import ProfileForm, StoryForm, CommentForm, ReportForm, ChapterForm
-from rest_framework.test import APITestCase, APIClient
-from django.urls import reverse
+import asyncio
+import base64
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from importlib import import_module
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from PIL import Image
+from django.apps import apps
+from django.conf import settings
 from django.contrib.auth.models import User
-from my_app.models import Notification
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.utils import ConnectionHandler
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase, APIClient
+
+from djangoProject.database import sqlite_database, sqlite_replica
+from my_app import (autocomplete, chapter_cache, moderation, recommendations, routers, search, timelines,
+                    trending)
+from my_app.avatars import variant_name, AVATAR_SIZES
+from my_app.benchmarks import compare, percentile, run_benchmarks
+from my_app.chapters import CHAPTER_LIST_FIELDS, READING_PAGE_CHARS, page_offsets
+from my_app.comments import load_comment_tree
+from my_app.counters import reconcile_counters
+from my_app.feeds import feed_queryset
+from my_app.forms import ProfileForm, StoryForm, CommentForm, ReportForm, ChapterForm
+from my_app.middleware import QueryBudgetExceeded, QueryRecorder, ReplicaRoutingMiddleware, query_shape
+from my_app.models import (Profile, Story, Genre, Warning, Fandom, Comment, Report, Reason, Post, Notification, Tag,
+                           Chapter, TimelineEntry, SimilarStory, EngagementEvent)
+from my_app.notifications import notify_bookmarkers_of_chapter
+from my_app.pubsub import broker
+from my_app.taxonomy import sync_names
+from my_app.views import notification_events
 
 
 class ProfileModelTest(TestCase):
@@ -34,6 +75,48 @@ class ProfileModelTest(TestCase):
         self.assertTrue(profile.user.notifications.filter(message__icontains='deactivated').exists())
 
 
+class AvatarPipelineTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=self.media, BACKGROUND_TASKS_INLINE=True)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.user = User.objects.create_user(username='painter', password='pass')
+
+    def upload(self):
+        buffer = BytesIO()
+        Image.new('RGBA', (900, 600), (200, 10, 10, 128)).save(buffer, 'PNG')
+        self.client.login(username='painter', password='pass')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('edit-profile'), {
+                'name': '', 'bio': '',
+                'profile_picture': SimpleUploadedFile('me.png', buffer.getvalue(), content_type='image/png'),
+            })
+        return Profile.objects.get(user=self.user)
+
+    def test_variants_generated_on_save(self):
+        profile = self.upload()
+        source = profile.profile_picture.name
+        self.assertEqual(profile.avatar_source, source)
+        for size in AVATAR_SIZES:
+            for ext in ('webp', 'jpg'):
+                with default_storage.open(variant_name(source, size, ext)) as f:
+                    self.assertEqual(Image.open(f).size, (size, size))
+
+        response = self.client.get(reverse('profile'))
+        self.assertContains(response, variant_name(source, 128, 'webp'))
+
+    def test_backfill_command(self):
+        profile = self.upload()
+        Profile.objects.filter(pk=profile.pk).update(avatar_source='')
+        self.assertContains(self.client.get(reverse('profile')), profile.profile_picture.url)
+
+        call_command('generate_avatars', stdout=StringIO())
+        profile.refresh_from_db()
+        self.assertEqual(profile.avatar_source, profile.profile_picture.name)
+
+
 class StoryFormTest(TestCase):
     def setUp(self):
         self.genre = Genre.objects.create(name='Fantasy')
@@ -68,6 +151,30 @@ class StoryFormTest(TestCase):
         self.assertTrue(story.warnings.filter(name='Violence').exists())
 
 
+class TaxonomySyncTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='pass')
+        Tag.objects.create(name='tag0')
+
+    def save_story(self, tags, instance=None):
+        form = StoryForm(data={'title': 'Tagged', 'synopsis': '...', 'tags': tags, 'fandoms': ''}, instance=instance)
+        self.assertTrue(form.is_valid())
+        return form.save(author=self.author)
+
+    def test_query_count_does_not_grow_with_tags(self):
+        with CaptureQueriesContext(connection) as few:
+            self.save_story('#a #b')
+        with CaptureQueriesContext(connection) as many:
+            self.save_story(' '.join(f'#tag{i}' for i in range(30)))
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(Tag.objects.filter(name__startswith='tag').count(), 30)
+
+    def test_edit_drops_stale_tags(self):
+        story = self.save_story('#old #kept')
+        self.save_story('#kept #new #new', instance=story)
+        self.assertEqual(sorted(story.tags.values_list('name', flat=True)), ['kept', 'new'])
+
+
 class CommentFormTest(TestCase):
     def test_comment_form_valid(self):
         form_data = {'content': 'Nice story!'}
@@ -118,6 +225,87 @@ class ReportModelTest(TestCase):
         self.assertEqual(self.author.profile.strike, 1)
         self.assertTrue(self.author.notifications.filter(message__icontains='strike').exists())
 
+class BulkReportResolutionTests(TestCase):
+    def setUp(self):
+        self.reporter = User.objects.create_user(username='reporter', password='pass')
+        self.spammer = User.objects.create_user(username='spammer', password='pass')
+        self.troll = User.objects.create_user(username='troll', password='pass')
+        Profile.objects.filter(user=self.spammer).update(strike=1)
+        self.story = Story.objects.create(author=self.reporter, title='Legit', synopsis='...', public=True)
+        self.spam = [Story.objects.create(author=self.spammer, title=f'Spam {i}', synopsis='...', public=True)
+                     for i in range(3)]
+        self.rude = Comment.objects.create(author=self.troll, post=self.story, content='Rude')
+        Comment.objects.create(author=self.reporter, post=self.story, parent=self.rude, content='Hey')
+        Comment.objects.create(author=self.reporter, post=self.story, content='Nice')
+        self.reports = [Report.objects.create(post=post, reporter=self.reporter) for post in self.spam + [self.rude]]
+        self.ignored = Report.objects.create(post=self.story, reporter=self.spammer)
+
+    def snapshot(self):
+        self.story.refresh_from_db()
+        return {
+            'strikes': dict(Profile.objects.values_list('user__username', 'strike')),
+            'active': dict(User.objects.values_list('username', 'is_active')),
+            'notifications': list(Notification.objects.order_by('pk').values_list('recipient__username', 'message')),
+            'posts': set(Post.objects.values_list('pk', flat=True)),
+            'reports': dict(Report.objects.values_list('pk', 'status')),
+            'comment_count': self.story.comment_count,
+        }
+
+    def outcome(self, resolve):
+        with transaction.atomic():
+            resolve()
+            state = self.snapshot()
+            transaction.set_rollback(True)
+        return state
+
+    def resolve_one_by_one(self):
+        for report in Report.objects.filter(pk__in=[r.pk for r in self.reports]):
+            report.status = 'Resolved'
+            report.save()
+
+    def test_same_outcome_as_resolving_one_by_one(self):
+        expected = self.outcome(self.resolve_one_by_one)
+        self.assertEqual(expected['strikes'], {'reporter': 0, 'spammer': 4, 'troll': 1})
+        self.assertFalse(expected['active']['spammer'])
+        self.assertEqual(expected['comment_count'], 1)
+
+        reports = Report.objects.filter(pk__in=[r.pk for r in self.reports])
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk = self.outcome(lambda: moderation.resolve_reports(reports, batch_size=2))
+        self.assertEqual(bulk, expected)
+
+    def test_post_reported_twice_is_deleted_and_struck_once(self):
+        Report.objects.create(post=self.spam[0], reporter=self.troll)
+        result = moderation.resolve_reports(Report.objects.filter(post=self.spam[0]))
+        self.assertEqual(result, {'posts': 1, 'deactivated': 0})
+        self.assertEqual(Profile.objects.get(user=self.spammer).strike, 2)
+        self.assertFalse(Report.objects.filter(post_id=self.spam[0].pk).exists())
+        self.assertTrue(Report.objects.filter(pk=self.ignored.pk, status='Pending').exists())
+
+    def test_only_story_signal_handlers_run_per_post(self):
+        def count(reports):
+            with CaptureQueriesContext(connection) as ctx, transaction.atomic():
+                moderation.resolve_reports(reports)
+                transaction.set_rollback(True)
+            return len(ctx)
+
+        few = count(Report.objects.filter(post__author=self.spammer))
+        for i in range(10):
+            story = Story.objects.create(author=self.spammer, title=f'More spam {i}', synopsis='...', public=True)
+            Report.objects.create(post=story, reporter=self.reporter)
+        # everything is batched except the search index and recommendations handlers: one query per story
+        # for the search index and two for recommendations (who lists it, which taxonomy it carries)
+        self.assertEqual(count(Report.objects.filter(post__author=self.spammer)), few + 3 * 10)
+
+    def test_admin_action(self):
+        User.objects.create_superuser(username='admin', password='pass')
+        self.client.login(username='admin', password='pass')
+        self.client.post(reverse('admin:my_app_report_changelist'),
+                         {'action': 'mark_as_resolved', '_selected_action': [r.pk for r in self.reports]})
+        self.assertEqual(Profile.objects.get(user=self.spammer).strike, 4)
+        self.assertEqual(set(Report.objects.values_list('pk', flat=True)), {self.ignored.pk})
+
+
 class ReportFormTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -244,6 +432,1154 @@ class BookmarksToggleTests(TestCase):
         response = self.client.post(self.url)
         self.assertNotIn(self.user.profile, self.story.bookmarked_by.all())
 
+class HomeFeedQueryTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.reader = User.objects.create_user(username='reader', password='pass')
+        self.genre = Genre.objects.create(name='Fantasy')
+        self.tag = Tag.objects.create(name='dragons')
+
+    def make_story(self, title):
+        story = Story.objects.create(author=self.author, title=title, synopsis='...', public=True)
+        story.genres.add(self.genre)
+        story.tags.add(self.tag)
+        story.toggle_like(self.reader.profile)
+        return story
+
+    def count_home_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('home-page'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        self.client.login(username='reader', password='pass')
+        self.make_story('First')
+        one_card = self.count_home_queries()
+
+        for i in range(4):
+            self.make_story(f'Story {i}')
+        five_cards = self.count_home_queries()
+
+        self.assertEqual(one_card, five_cards)
+
+    def test_counts_and_viewer_flags(self):
+        story = self.make_story('Liked')
+        story.toggle_bookmark(self.author.profile)
+        self.client.login(username='reader', password='pass')
+
+        response = self.client.get(reverse('home-page'))
+        card = response.context['stories'][0]
+        self.assertEqual(card.like_count, 1)
+        self.assertEqual(card.bookmark_count, 1)
+        self.assertTrue(card.is_liked)
+        self.assertFalse(card.is_bookmarked)
+
+
+class HomeCursorPaginationTests(TestCase):
+    def setUp(self):
+        author = User.objects.create_user(username='author', password='pass')
+        self.stories = [Story.objects.create(author=author, title=f'Story {i}', synopsis='...', public=True)
+                        for i in range(12)]
+        self.stories.reverse()  # newest first
+
+    def test_next_and_previous_cursors(self):
+        first = self.client.get(reverse('home-page')).context['stories']
+        self.assertEqual(list(first), self.stories[:5])
+        self.assertFalse(first.has_previous)
+
+        second = self.client.get(reverse('home-page'), {'cursor': first.next_cursor}).context['stories']
+        self.assertEqual(list(second), self.stories[5:10])
+
+        # a new story doesn't shift the pages we're walking through
+        Story.objects.create(author=self.stories[0].author, title='Fresh', synopsis='...', public=True)
+        third = self.client.get(reverse('home-page'), {'cursor': second.next_cursor}).context['stories']
+        self.assertEqual(list(third), self.stories[10:])
+        self.assertFalse(third.has_next)
+
+        back = self.client.get(reverse('home-page'), {'cursor': second.previous_cursor}).context['stories']
+        self.assertEqual(list(back), self.stories[:5])
+
+    def test_tampered_cursors_give_the_first_page(self):
+        tampered = [
+            'n|created_at|1.5|3',
+            'n|created_at|2020-01-01T00:00:00|3',  # naive
+            'n|created_at|0001-01-01T00:00:00+01:00|3',
+            ('trending', 'n|trending_score|2020-01-01T00:00:00+00:00|3'),
+            ('trending', 'n|trending_score|nan|3'),
+        ]
+        for raw in tampered:
+            sort, raw = raw if isinstance(raw, tuple) else ('newest', raw)
+            cursor = base64.urlsafe_b64encode(raw.encode()).decode()
+            response = self.client.get(reverse('home-page'), {'sort': sort, 'cursor': cursor})
+            self.assertEqual(response.status_code, 200, raw)
+            self.assertFalse(response.context['stories'].has_previous, raw)
+
+
+class EngagementCounterTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.reader = User.objects.create_user(username='reader', password='pass')
+        self.story = Story.objects.create(author=self.author, title='Counted', synopsis='...', public=True)
+        self.client.login(username='reader', password='pass')
+
+    def test_like_and_bookmark_toggles_update_counts(self):
+        self.client.post(reverse('likes', kwargs={'pk': self.story.pk}))
+        self.client.post(reverse('bookmarks', kwargs={'pk': self.story.pk}))
+        self.story.refresh_from_db()
+        self.assertEqual((self.story.like_count, self.story.bookmark_count), (1, 1))
+
+        self.client.post(reverse('likes', kwargs={'pk': self.story.pk}))
+        self.client.post(reverse('bookmarks', kwargs={'pk': self.story.pk}))
+        self.story.refresh_from_db()
+        self.assertEqual((self.story.like_count, self.story.bookmark_count), (0, 0))
+
+    def test_toggles_lock_the_counter_before_checking(self):
+        # a second toggle can't pass the check while the first is between it and the counter update
+        for toggle, table in ((self.story.toggle_like, 'my_app_post'), (self.story.toggle_bookmark, 'stories')):
+            with CaptureQueriesContext(connection) as ctx:
+                toggle(self.reader.profile)
+            statements = [q['sql'] for q in ctx if not q['sql'].startswith(('SAVEPOINT', 'RELEASE', 'BEGIN'))]
+            self.assertTrue(statements[0].startswith(f'UPDATE "{table}"'), statements[0])
+        self.story.refresh_from_db()
+        self.assertEqual((self.story.like_count, self.story.bookmark_count), (1, 1))
+
+    def test_story_page_flags_without_loading_likes(self):
+        for i in range(20):
+            self.story.liked_by.add(User.objects.create_user(username=f'fan{i}', password='pass').profile)
+        self.client.post(reverse('bookmarks', kwargs={'pk': self.story.pk}))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('story-detail', kwargs={'pk': self.story.pk}))
+        story = response.context['story']
+        self.assertEqual((story.is_liked, story.is_bookmarked), (False, True))
+        self.assertContains(response, 'alt="Like"')
+        self.assertContains(response, 'alt="Bookmarked"')
+        # the like and bookmark lists are only ever checked with EXISTS for the viewer
+        self.assertFalse([q['sql'] for q in ctx if 'my_app_profile' in q['sql'] and 'liked_by' in q['sql']])
+
+    def test_comment_reply_and_delete_update_counts(self):
+        self.client.post(reverse('story-detail', kwargs={'pk': self.story.pk}), {'content': 'Top'})
+        comment = Comment.objects.get()
+        self.client.post(reverse('reply', kwargs={'story_pk': self.story.pk, 'comment_pk': comment.pk}),
+                         {'content': 'Reply'})
+        self.story.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual(self.story.comment_count, 2)
+        self.assertEqual(comment.reply_count, 1)
+
+        self.client.get(reverse('delete', kwargs={'pk': comment.pk}))
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.comment_count, 0)
+
+    def test_reconcile_fixes_drift(self):
+        self.story.liked_by.add(self.reader.profile)
+        Story.objects.filter(pk=self.story.pk).update(comment_count=7)
+
+        call_command('reconcile_counters', stdout=StringIO())
+        self.story.refresh_from_db()
+        self.assertEqual((self.story.like_count, self.story.comment_count), (1, 0))
+
+
+class TrendingTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.reader = User.objects.create_user(username='reader', password='pass')
+        self.story = Story.objects.create(author=self.author, title='Rising', synopsis='...', public=True)
+
+    def score(self, story):
+        story.refresh_from_db()
+        return story.trending_score
+
+    def test_new_story_starts_from_its_creation_time(self):
+        self.assertAlmostEqual(self.score(self.story), trending.initial_score(self.story.created_at))
+
+    def test_like_and_bookmark_raise_score_and_taking_them_back_restores_it(self):
+        before = self.score(self.story)
+        self.story.toggle_like(self.reader.profile)
+        liked = self.score(self.story)
+        self.story.toggle_bookmark(self.reader.profile)
+        self.assertGreater(liked, before)
+        self.assertGreater(self.score(self.story), liked)
+
+        self.story.toggle_bookmark(self.reader.profile)
+        self.story.toggle_like(self.reader.profile)
+        self.assertAlmostEqual(self.score(self.story), before, places=6)
+        self.assertFalse(EngagementEvent.objects.exists())
+
+    def test_comment_bumps_score(self):
+        before = self.score(self.story)
+        Comment.objects.create(author=self.reader, post=self.story, content='Great')
+        self.assertGreater(self.score(self.story), before)
+
+    def test_newer_stories_outrank_older_ones_until_engagement_catches_up(self):
+        old = Story.objects.create(author=self.author, title='Old', synopsis='...', public=True)
+        posted = timezone.now() - timedelta(days=2)
+        Story.objects.filter(pk=old.pk).update(created_at=posted, trending_score=trending.initial_score(posted))
+        self.assertEqual(list(Story.objects.order_by('-trending_score')), [self.story, old])
+
+        # two days is 1.33 half-lives: the story is worth 3 * 2 ** -1.33 ~ 1.2 now, so 2 bookmarks beat it
+        for name in ('fan1', 'fan2'):
+            old.toggle_bookmark(User.objects.create_user(username=name, password='pass').profile)
+        self.assertEqual(list(Story.objects.order_by('-trending_score')), [old, self.story])
+
+    def test_recompute_matches_incremental_updates(self):
+        self.story.toggle_like(self.reader.profile)
+        self.story.toggle_bookmark(self.author.profile)
+        Comment.objects.create(author=self.reader, post=self.story, content='Great')
+        EngagementEvent.objects.create(story=self.story, kind='like',
+                                       created_at=timezone.now() - trending.EVENT_WINDOW * 2)
+        incremental = self.score(self.story)
+
+        Story.objects.update(trending_score=0)
+        call_command('recompute_trending', stdout=StringIO())
+        self.assertAlmostEqual(self.score(self.story), incremental, places=6)
+        self.assertEqual(EngagementEvent.objects.count(), 3)
+
+    def test_home_sorted_by_trending_pages_with_cursors(self):
+        stories = [self.story] + [Story.objects.create(author=self.author, title=f'Story {i}', synopsis='...',
+                                                       public=True) for i in range(6)]
+        for story in stories[:3]:
+            story.toggle_bookmark(self.reader.profile)
+        expected = list(Story.objects.order_by('-trending_score', '-pk'))
+        self.assertEqual(expected[:3], [stories[2], stories[1], stories[0]])
+
+        first = self.client.get(reverse('home-page'), {'sort': 'trending'}).context['stories']
+        self.assertEqual(list(first), expected[:5])
+        second = self.client.get(reverse('home-page'), {'sort': 'trending', 'cursor': first.next_cursor})
+        self.assertEqual(list(second.context['stories']), expected[5:])
+        back = self.client.get(reverse('home-page'), {'sort': 'trending',
+                                                      'cursor': second.context['stories'].previous_cursor})
+        self.assertEqual(list(back.context['stories']), expected[:5])
+
+        # a newest-first cursor doesn't apply to the trending list, so it starts over
+        newest = self.client.get(reverse('home-page')).context['stories']
+        restarted = self.client.get(reverse('home-page'), {'sort': 'trending', 'cursor': newest.next_cursor})
+        self.assertEqual(list(restarted.context['stories']), expected[:5])
+
+
+@override_settings(BACKGROUND_TASKS_INLINE=True)
+class ChapterPublishFanoutTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.story = Story.objects.create(author=self.author, title='Serial', synopsis='...', public=True)
+        self.chapter = Chapter.objects.create(story=self.story, title='One', content='...')
+        self.readers = [User.objects.create_user(username=f'reader{i}', password='pass') for i in range(5)]
+        for reader in self.readers:
+            self.story.bookmarked_by.add(reader.profile)
+        self.url = reverse('publish-chapter', kwargs={'story_pk': self.story.pk, 'chapter_pk': self.chapter.pk})
+
+    def test_publish_notifies_every_bookmarker_after_commit(self):
+        self.client.login(username='author', password='pass')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url)
+        self.assertEqual(Notification.objects.filter(message__icontains='new chapter').count(), 5)
+
+    def test_republishing_is_idempotent(self):
+        self.client.login(username='author', password='pass')
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(self.url)
+        self.assertEqual(Notification.objects.filter(message__icontains='new chapter').count(), 5)
+
+    def test_republishing_pushes_nothing_twice(self):
+        self.chapter.public = True
+        self.chapter.save()
+        connected = {reader.pk for reader in self.readers[:3]}
+        with mock.patch.object(broker, 'connected_users', side_effect=lambda ids: connected & set(ids)), \
+                mock.patch.object(broker, 'publish') as publish:
+            notify_bookmarkers_of_chapter(self.chapter.pk, chunk_size=2)
+            self.assertEqual({call.args[0] for call in publish.call_args_list}, connected)
+            self.assertEqual(publish.call_count, 3)
+            publish.reset_mock()
+            notify_bookmarkers_of_chapter(self.chapter.pk, chunk_size=2)
+            publish.assert_not_called()
+
+    def test_fanout_in_chunks(self):
+        self.chapter.public = True
+        self.chapter.save()
+        self.assertEqual(notify_bookmarkers_of_chapter(self.chapter.pk, chunk_size=2), 5)
+        recipients = set(Notification.objects.values_list('recipient_id', flat=True))
+        self.assertEqual(recipients, {reader.pk for reader in self.readers})
+
+
+@override_settings(BACKGROUND_TASKS_INLINE=True)
+class FollowingTimelineTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.reader = User.objects.create_user(username='reader', password='pass')
+        self.old = Story.objects.create(author=self.author, title='Old', synopsis='...', public=True)
+
+    def timeline(self):
+        return list(TimelineEntry.objects.filter(owner=self.reader.profile)
+                    .order_by('-created_at', '-pk').values_list('story__title', flat=True))
+
+    def test_migration_fills_timelines_for_existing_follows(self):
+        new = Story.objects.create(author=self.author, title='New', synopsis='...', public=True)
+        Story.objects.create(author=self.author, title='Draft', synopsis='...')
+        # a follow from before timelines existed: the relation without its entries
+        self.author.profile.followers.add(self.reader.profile)
+        TimelineEntry.objects.all().delete()
+
+        import_module('my_app.migrations.0011_following_timelines').fill_timelines(apps, None)
+        self.assertEqual(self.timeline(), ['New', 'Old'])
+        self.assertEqual(TimelineEntry.objects.get(story=new).created_at, new.created_at)
+
+    def test_follow_backfills_and_unfollow_trims(self):
+        self.author.profile.followers.add(self.reader.profile)
+        self.assertEqual(self.timeline(), ['Old'])
+        self.author.profile.refresh_from_db()
+        self.assertEqual(self.author.profile.follower_count, 1)
+
+        self.reader.profile.following.remove(self.author.profile)
+        self.assertEqual(self.timeline(), [])
+        self.author.profile.refresh_from_db()
+        self.assertEqual(self.author.profile.follower_count, 0)
+
+    def test_publishing_fans_out_and_going_private_removes(self):
+        self.author.profile.followers.add(self.reader.profile)
+        with self.captureOnCommitCallbacks(execute=True):
+            new = Story.objects.create(author=self.author, title='New', synopsis='...', public=True)
+        self.assertEqual(self.timeline(), ['New', 'Old'])
+
+        new.public = False
+        new.save()
+        self.assertEqual(self.timeline(), ['Old'])
+
+    def test_new_chapter_bumps_the_story(self):
+        self.author.profile.followers.add(self.reader.profile)
+        with self.captureOnCommitCallbacks(execute=True):
+            Story.objects.create(author=self.author, title='New', synopsis='...', public=True)
+        chapter = Chapter.objects.create(story=self.old, title='Two', content='...')
+        self.client.login(username='author', password='pass')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('publish-chapter', kwargs={'story_pk': self.old.pk, 'chapter_pk': chapter.pk}))
+        self.assertEqual(self.timeline(), ['Old', 'New'])
+
+    def test_popular_authors_are_pulled_on_read(self):
+        with mock.patch.object(timelines, 'FANOUT_FOLLOWER_LIMIT', 0):
+            self.author.profile.followers.add(self.reader.profile)
+            TimelineEntry.objects.all().delete()
+            with self.captureOnCommitCallbacks(execute=True):
+                Story.objects.create(author=self.author, title='New', synopsis='...', public=True)
+            self.assertEqual(self.timeline(), [])
+
+            self.client.login(username='reader', password='pass')
+            response = self.client.get(reverse('following-feed'))
+        self.assertEqual([story.title for story in response.context['stories']], ['New', 'Old'])
+
+    def test_feed_reads_one_range_of_the_timeline(self):
+        self.author.profile.followers.add(self.reader.profile)
+        entries = TimelineEntry.objects.filter(owner=self.reader.profile).order_by('-created_at', '-pk')[:6]
+        sql, params = entries.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = [row[3] for row in cursor.fetchall()]
+        self.assertEqual(plan, ['SEARCH my_app_timelineentry USING INDEX timeline_cursor_idx (owner_id=?)'])
+
+        self.client.login(username='reader', password='pass')
+        response = self.client.get(reverse('following-feed'))
+        self.assertContains(response, 'Old')
+
+    def test_rebuild_timelines(self):
+        Profile.followers.through.objects.create(from_profile=self.author.profile, to_profile=self.reader.profile)
+        self.assertEqual(timelines.rebuild_timelines(), 1)
+        self.assertEqual(self.timeline(), ['Old'])
+
+
+@override_settings(BACKGROUND_TASKS_INLINE=True)
+class SimilarStoryTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.fandom = Fandom.objects.create(name='Twin Peaks')
+        self.tags = [Tag.objects.create(name=name) for name in ('owls', 'coffee', 'pie', 'lodge')]
+        self.first = self.make_story('First', self.tags[:2], [self.fandom])
+        self.second = self.make_story('Second', self.tags[:2], [self.fandom])
+        self.third = self.make_story('Third', self.tags[2:3], [])
+        self.unrelated = self.make_story('Unrelated', self.tags[3:], [])
+
+    def make_story(self, title, tags, fandoms):
+        story = Story.objects.create(author=self.author, title=title, synopsis='...', public=True)
+        story.tags.set(tags)
+        story.fandoms.set(fandoms)
+        return story
+
+    def stored(self):
+        return {(row.story.title, row.similar.title): round(row.score, 6)
+                for row in SimilarStory.objects.select_related('story', 'similar')}
+
+    def test_rebuild_finds_stories_sharing_taxonomy(self):
+        recommendations.rebuild_similar_stories(batch_size=2)
+        self.assertEqual(recommendations.similar_stories(self.first), [self.second])
+        self.assertEqual(recommendations.similar_stories(self.unrelated), [])
+        self.assertAlmostEqual(SimilarStory.objects.get(story=self.first).score, 1.0)
+
+    def test_taxonomy_change_refreshes_incrementally(self):
+        recommendations.rebuild_similar_stories()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.third.tags.add(self.tags[0])
+        self.assertIn(self.third, recommendations.similar_stories(self.first))
+
+        # the incremental refresh leaves the table as a full rebuild would
+        incremental = self.stored()
+        recommendations.rebuild_similar_stories()
+        self.assertEqual(incremental, self.stored())
+
+    def test_incremental_refresh_follows_idf_changes(self):
+        # enough stories sharing few tags that most top-K lists are full and a changed tag's
+        # idf moves scores of stories that neither list nor get listed by the changed story
+        fandoms = [self.fandom, Fandom.objects.create(name='Dune')]
+        for i in range(24):
+            self.make_story(f'Story {i}', [self.tags[i % 4], self.tags[(i * 3 + 1) % 4]], [fandoms[i % 3 % 2]])
+        recommendations.rebuild_similar_stories()
+        self.assertEqual(recommendations.story_features([self.first.pk]),
+                         {('tags', self.tags[0].pk), ('tags', self.tags[1].pk), ('fandoms', self.fandom.pk)})
+        target = Story.objects.get(title='Story 5')
+        changes = [
+            lambda: target.tags.add(self.tags[0]),
+            lambda: target.fandoms.add(self.fandom),
+            lambda: self.tags[1].story_set.remove(self.first),
+            lambda: target.tags.clear(),
+        ]
+        for change in changes:
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            incremental = self.stored()
+            recommendations.rebuild_similar_stories()
+            self.assertEqual(incremental, self.stored())
+
+    def test_refresh_only_reads_stories_sharing_taxonomy(self):
+        recommendations.rebuild_similar_stories()
+        self.third.tags.add(self.tags[0])
+        with mock.patch.object(recommendations, 'StoryVectors', wraps=recommendations.StoryVectors) as vectors:
+            recommendations.refresh_similar_stories([self.third.pk])
+        read = set().union(*(call.args[0] for call in vectors.call_args_list))
+        self.assertEqual(read, {self.first.pk, self.second.pk, self.third.pk})
+        self.assertIn(self.third, recommendations.similar_stories(self.first))
+
+    def test_private_stories_drop_out(self):
+        recommendations.rebuild_similar_stories()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.second.public = False
+            self.second.save()
+        self.assertEqual(recommendations.similar_stories(self.first), [])
+        self.assertFalse(SimilarStory.objects.filter(story=self.second).exists())
+
+    def test_story_page_reads_them_in_one_query(self):
+        recommendations.rebuild_similar_stories()
+        with self.assertNumQueries(1):
+            similar = recommendations.similar_stories(self.first)
+            self.assertEqual(similar[0].author, self.author)
+        response = self.client.get(reverse('story-detail', kwargs={'pk': self.first.pk}))
+        self.assertContains(response, 'Similar stories')
+        self.assertEqual(response.context['similar_stories'], [self.second])
+
+
+class PrefixIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = autocomplete.PrefixIndex([('Dragons', 5), ('dragon riders', 9), ('Drama', 1), ('Dune', 2),
+                                               ('angst', 7), ('dra', 0)])
+
+    def names(self, prefix, limit=autocomplete.DEFAULT_LIMIT):
+        return [row['name'] for row in self.index.suggest(prefix, limit)]
+
+    def test_ranks_prefix_matches_by_use_ignoring_case(self):
+        self.assertEqual(self.names('DRA'), ['dragon riders', 'Dragons', 'Drama', 'dra'])
+        self.assertEqual(self.names('drag', limit=1), ['dragon riders'])
+        self.assertEqual(self.names('dragons'), ['Dragons'])
+        self.assertEqual(self.index.suggest('du'), [{'name': 'Dune', 'uses': 2}])
+
+    def test_short_and_long_prefixes_agree(self):
+        # one and two letter prefixes are precomputed, longer ones are searched
+        self.assertEqual(self.names('d'), ['dragon riders', 'Dragons', 'Dune', 'Drama', 'dra'])
+        self.assertEqual(self.names('dr'), ['dragon riders', 'Dragons', 'Drama', 'dra'])
+
+    def test_no_matches(self):
+        self.assertEqual(self.names(''), [])
+        self.assertEqual(self.names('x'), [])
+        self.assertEqual(self.names('dz'), [])
+        self.assertEqual(self.names('dragonz'), [])
+        self.assertEqual(self.names('d', limit=0), [])
+
+
+@override_settings(BACKGROUND_TASKS_INLINE=True)
+class AutocompleteAPITests(TestCase):
+    def setUp(self):
+        autocomplete.clear()
+        self.addCleanup(autocomplete.clear)
+        self.author = User.objects.create_user(username='author', password='pass')
+        popular = Tag.objects.create(name='fluff')
+        Tag.objects.create(name='flashbacks')
+        for i in range(2):
+            story = Story.objects.create(author=self.author, title=f'Story {i}', synopsis='...', public=True)
+            story.tags.add(popular)
+        story.fandoms.add(Fandom.objects.create(name='Final Fantasy'))
+        self.story = story
+
+    def suggest(self, kind, q, **params):
+        response = self.client.get(reverse('autocomplete', kwargs={'kind': kind}), {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_suggests_most_used_names_without_the_database(self):
+        # the first lookup of each kind builds its index
+        self.assertEqual(self.suggest('tags', 'f'), [{'name': 'fluff', 'uses': 2}, {'name': 'flashbacks', 'uses': 0}])
+        self.assertEqual(self.suggest('fandoms', 'final f'), [{'name': 'Final Fantasy', 'uses': 1}])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('tags', '#FL', limit=1), [{'name': 'fluff', 'uses': 2}])
+            self.assertEqual(self.suggest('fandoms', 'FIN'), [{'name': 'Final Fantasy', 'uses': 1}])
+
+    def test_unknown_kind_is_404(self):
+        response = self.client.get(reverse('autocomplete', kwargs={'kind': 'genres'}), {'q': 'f'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_index_follows_tag_changes(self):
+        self.suggest('tags', 'f')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.story.tags.add(Tag.objects.get(name='flashbacks'))
+            other = Story.objects.create(author=self.author, title='Other', synopsis='...', public=True)
+            sync_names(other, 'tags', ['flashbacks', 'found family'])
+        self.assertEqual([row['name'] for row in self.suggest('tags', 'f')], ['flashbacks', 'fluff', 'found family'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.filter(name='found family').delete()
+        self.assertEqual([row['name'] for row in self.suggest('tags', 'fo')], [])
+
+    def test_old_index_is_rebuilt(self):
+        self.suggest('tags', 'f')
+        Tag.objects.bulk_create([Tag(name='fix-it')])  # no signals
+        self.assertEqual(len(self.suggest('tags', 'f')), 2)
+        with mock.patch.object(autocomplete, 'MAX_AGE', -1), self.captureOnCommitCallbacks(execute=True):
+            self.suggest('tags', 'f')
+        self.assertEqual(len(self.suggest('tags', 'f')), 3)
+
+
+class ChapterNavigationTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.reader = User.objects.create_user(username='reader', password='pass')
+        self.story = Story.objects.create(author=self.author, title='Long', synopsis='...', public=True)
+        self.chapters = [Chapter.objects.create(story=self.story, title=f'Chapter {i}', content='x' * 1000,
+                                                public=i != 2) for i in range(1, 5)]
+
+    def read(self, **params):
+        return self.client.get(reverse('story-detail', kwargs={'pk': self.story.pk}), params)
+
+    def test_new_chapters_go_last(self):
+        self.assertEqual([c.position for c in self.chapters], [1, 2, 3, 4])
+        other = Story.objects.create(author=self.author, title='Other', synopsis='...', public=True)
+        self.assertEqual(Chapter.objects.create(story=other, title='One', content='...').position, 1)
+
+    def test_position_decides_the_order(self):
+        Chapter.objects.filter(pk=self.chapters[3].pk).update(position=0)
+        response = self.read()
+        self.assertEqual(response.context['chapter'], self.chapters[3])
+        self.assertEqual([c.title for c in response.context['chapters']], ['Chapter 4', 'Chapter 1', 'Chapter 3'])
+
+    def test_readers_skip_private_chapters(self):
+        response = self.read(chapter=self.chapters[0].pk)
+        self.assertIsNone(response.context['previous_chapter'])
+        self.assertEqual(response.context['next_chapter'].id, self.chapters[2].pk)
+
+        response = self.read(chapter=self.chapters[3].pk)
+        self.assertEqual(response.context['previous_chapter'].id, self.chapters[2].pk)
+        self.assertIsNone(response.context['next_chapter'])
+
+        self.assertEqual(self.read(chapter=self.chapters[1].pk).status_code, 404)
+        self.assertEqual(self.read(chapter='nope').status_code, 404)
+        other = Story.objects.create(author=self.author, title='Other', synopsis='...', public=True)
+        elsewhere = Chapter.objects.create(story=other, title='One', content='...', public=True)
+        self.assertEqual(self.read(chapter=elsewhere.pk).status_code, 404)
+
+    def test_author_sees_private_chapters(self):
+        self.client.login(username='author', password='pass')
+        response = self.read(chapter=self.chapters[1].pk)
+        self.assertEqual(response.context['chapter'], self.chapters[1])
+        self.assertEqual(response.context['next_chapter'].id, self.chapters[2].pk)
+        self.assertContains(response, 'Chapter 2 - private')
+
+    @override_settings(PAGE_CACHE_TIMEOUT=0)
+    def test_picker_is_one_query_without_content(self):
+        for i in range(5, 40):
+            Chapter.objects.create(story=self.story, title=f'Chapter {i}', content='x' * 1000, public=True)
+
+        self.read(chapter=self.chapters[2].pk)  # renders the chapter's html into the cache
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.read(chapter=self.chapters[2].pk)
+        chapter_queries = [q['sql'] for q in ctx if 'my_app_chapter' in q['sql']]
+        self.assertEqual(len(chapter_queries), 2, chapter_queries)  # the list, then the chapter being read
+        self.assertNotIn('content', chapter_queries[0])
+        self.assertNotIn('"content"', chapter_queries[1])
+        self.assertEqual(len(response.context['chapters']), 38)
+
+
+class ChapterPagingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.story = Story.objects.create(author=self.author, title='Novel', synopsis='...', public=True)
+        self.paragraphs = [f'Paragraph {i} ' + 'la ' * 300 for i in range(60)]
+        self.chapter = Chapter.objects.create(story=self.story, title='Long', content='\n\n'.join(self.paragraphs),
+                                              public=True)
+        self.next = Chapter.objects.create(story=self.story, title='Next', content='Short.', public=True)
+
+    def read(self, **params):
+        return self.client.get(reverse('story-detail', kwargs={'pk': self.story.pk}),
+                               {'chapter': self.chapter.pk, **params})
+
+    def test_pages_break_at_paragraphs(self):
+        content = self.chapter.content
+        starts = [0, *self.chapter.page_offsets, len(content)]
+        self.assertGreater(len(starts), 2)
+        for start, end in zip(starts, starts[1:]):
+            self.assertLessEqual(end - start, READING_PAGE_CHARS)
+            self.assertTrue(content[start:].startswith('Paragraph'))
+        self.assertEqual(''.join(self.chapter.page_text(page) for page in range(1, self.chapter.page_count + 1)),
+                         content)
+
+    def test_unbreakable_text_stays_whole(self):
+        self.assertEqual(page_offsets('x' * 100, page_chars=10), [])
+        self.assertEqual(page_offsets('x' * 15 + ' y', page_chars=10), [16])
+
+    def test_serves_one_page_reading_only_its_slice(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.read(page=2)
+        self.assertEqual(response.context['page'], 2)
+        second_page = self.chapter.page_text(2)
+        self.assertContains(response, second_page.split('\n\n')[0])
+        self.assertNotContains(response, 'Paragraph 0 ')
+        whole_content_reads = [q['sql'] for q in ctx
+                               if '"my_app_chapter"."content"' in q['sql'] and 'SUBSTR' not in q['sql'].upper()]
+        self.assertEqual(whole_content_reads, [])
+
+    def test_next_chapter_link_on_the_last_page_only(self):
+        next_link = f'?chapter={self.next.pk}"'
+        self.assertNotContains(self.read(), next_link)
+        self.assertContains(self.read(page=self.chapter.page_count), next_link)
+
+    def test_whole_chapter_and_bad_pages(self):
+        response = self.read(page='all')
+        self.assertIsNone(response.context['page'])
+        self.assertContains(response, 'Paragraph 0 ')
+        self.assertContains(response, 'Paragraph 59 ')
+        self.assertEqual(self.read(page=self.chapter.page_count + 1).status_code, 404)
+        self.assertEqual(self.read(page='x').status_code, 404)
+
+    def test_short_chapters_are_not_paged(self):
+        response = self.client.get(reverse('story-detail', kwargs={'pk': self.story.pk}),
+                                   {'chapter': self.next.pk, 'page': 2})
+        self.assertIsNone(response.context['page'])
+
+    def test_edit_drops_cached_pages(self):
+        self.read(page=2)
+        old_key = chapter_cache.chapter_html_key(self.chapter, 2)
+        self.assertIsNotNone(cache.get(old_key))
+        self.client.login(username='author', password='pass')
+        self.client.post(reverse('chapter-edit', kwargs={'story_pk': self.story.pk, 'pk': self.chapter.pk}),
+                         {'title': 'Long', 'content': 'Rewritten'})
+        self.assertIsNone(cache.get(old_key))
+        self.chapter.refresh_from_db()
+        self.assertEqual(self.chapter.page_offsets, [])
+
+
+class StoryExportTests(TestCase):
+    def setUp(self):
+        self.exports = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.exports, ignore_errors=True)
+        overrides = override_settings(EXPORT_ROOT=Path(self.exports))
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.story = Story.objects.create(author=self.author, title='The Long Way', synopsis='A trip & more.',
+                                          public=True)
+        Chapter.objects.create(story=self.story, title='Setting off', content='First <line>\n\nSecond', public=True)
+        Chapter.objects.create(story=self.story, title='Draft', content='Not yet', public=False)
+        Chapter.objects.create(story=self.story, title='Arriving', content='The end.', public=True)
+
+    def download(self, fmt, **kwargs):
+        response = self.client.get(reverse('export-story', kwargs={'pk': self.story.pk, 'fmt': fmt}), **kwargs)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment; filename="the-long-way.', response['Content-Disposition'])
+        return response, b''.join(response.streaming_content)
+
+    def test_plain_text_streams_public_chapters_in_order(self):
+        response, body = self.download('txt')
+        self.assertIsInstance(response, StreamingHttpResponse)
+        text = body.decode()
+        self.assertTrue(text.startswith('The Long Way\nby author'))
+        self.assertLess(text.index('Setting off'), text.index('Arriving'))
+        self.assertNotIn('Not yet', text)
+
+    def test_epub_is_a_valid_package(self):
+        _, body = self.download('epub')
+        with zipfile.ZipFile(BytesIO(body)) as epub:
+            first = epub.infolist()[0]
+            self.assertEqual((first.filename, first.compress_type), ('mimetype', zipfile.ZIP_STORED))
+            self.assertIsNone(epub.testzip())
+            self.assertEqual(epub.read('mimetype'), b'application/epub+zip')
+            opf = epub.read('OEBPS/content.opf').decode()
+            self.assertIn('<dc:title>The Long Way</dc:title>', opf)
+            self.assertIn('chapter-2.xhtml', opf)
+            self.assertNotIn('chapter-3.xhtml', opf)
+            chapter = epub.read('OEBPS/chapter-1.xhtml').decode()
+            self.assertIn('<p>First &lt;line&gt;</p>\n<p>Second</p>', chapter)
+
+    def test_repeat_downloads_are_served_from_disk_until_a_chapter_changes(self):
+        _, generated = self.download('epub')
+        response, cached = self.download('epub')
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(cached, generated)
+
+        chapter = self.story.chapters.get(title='Draft')
+        chapter.public = True
+        chapter.save()
+        response, _ = self.download('epub')
+        self.assertNotIsInstance(response, FileResponse)
+        self.assertEqual(len(list(Path(self.exports).glob(f'{self.story.pk}-*.epub'))), 1)
+
+    def test_abandoned_download_leaves_no_file(self):
+        response = self.client.get(reverse('export-story', kwargs={'pk': self.story.pk, 'fmt': 'epub'}))
+        next(iter(response.streaming_content))
+        response.close()
+        self.assertEqual(list(Path(self.exports).iterdir()), [])
+
+    def test_private_stories_and_unknown_formats(self):
+        Story.objects.filter(pk=self.story.pk).update(public=False)
+        url = reverse('export-story', kwargs={'pk': self.story.pk, 'fmt': 'txt'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.login(username='author', password='pass')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        pdf = reverse('export-story', kwargs={'pk': self.story.pk, 'fmt': 'pdf'})
+        self.assertEqual(self.client.get(pdf).status_code, 404)
+
+    def test_command(self):
+        output = Path(self.exports) / 'out.txt'
+        call_command('export_story', self.story.pk, '--format', 'txt', '--output', str(output), stdout=StringIO())
+        self.assertIn('Arriving', output.read_text())
+
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'page-cache-tests'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE, PAGE_CACHE_TIMEOUT=300)
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.reader = User.objects.create_user(username='reader', password='pass')
+        self.story = Story.objects.create(author=self.author, title='Cached Tale', synopsis='...', public=True)
+        self.chapter = Chapter.objects.create(story=self.story, title='One', content='Once upon a time', public=True)
+        self.comment = Comment.objects.create(post=self.story, author=self.reader, content='Lovely')
+        self.story_url = reverse('story-detail', kwargs={'pk': self.story.pk})
+        self.comments_url = reverse('comment-page', kwargs={'pk': self.story.pk})
+
+    def served_from(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.get('X-Page-Cache')
+
+    def test_second_anonymous_request_is_served_from_cache(self):
+        for url in (reverse('home-page'), self.story_url, self.comments_url):
+            self.assertEqual(self.served_from(url), 'miss')
+            with self.assertNumQueries(0):
+                self.assertEqual(self.served_from(url), 'hit')
+
+    def test_varies_by_query_string(self):
+        self.assertEqual(self.served_from(reverse('home-page')), 'miss')
+        self.assertEqual(self.served_from(reverse('home-page') + '?sort=trending'), 'miss')
+        self.assertEqual(self.served_from(reverse('home-page') + '?sort=trending'), 'hit')
+
+    def test_sessions_bypass_the_cache(self):
+        self.served_from(self.story_url)
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = 'whatever'
+        self.assertIsNone(self.served_from(self.story_url))
+        self.client.login(username='reader', password='pass')
+        response = self.client.get(self.story_url)
+        self.assertIsNone(response.get('X-Page-Cache'))
+        self.assertEqual(response.context['user'], self.reader)
+
+    def test_changes_expire_the_pages_showing_them(self):
+        profile = self.reader.profile
+        changes = [
+            lambda: Comment.objects.create(post=self.story, author=self.reader, content='Again'),
+            lambda: self.comment.liked_by.add(profile),
+            lambda: self.story.liked_by.add(profile),
+            lambda: profile.bookmarked_stories.add(self.story),
+            lambda: profile.bookmarked_stories.clear(),
+            lambda: Chapter.objects.filter(pk=self.chapter.pk).first().save(),
+            lambda: Story.objects.get(pk=self.story.pk).save(),
+        ]
+        urls = (reverse('home-page'), self.story_url, self.comments_url)
+        for change in changes:
+            for url in urls:
+                self.served_from(url)
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            for url in urls:
+                self.assertEqual(self.served_from(url), 'miss')
+
+    def test_edited_tags_are_shown(self):
+        home = reverse('home-page')
+        fluff, angst = Tag.objects.create(name='fluff'), Tag.objects.create(name='angst')
+        self.story.tags.add(fluff)
+        self.assertContains(self.client.get(home), '#fluff')
+        self.assertEqual(self.served_from(home), 'hit')
+
+        # StoryForm.save sets the tags after saving the story, so the m2m change has to expire the pages itself
+        self.served_from(self.story_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.story.tags.set([angst])
+        self.assertEqual(self.served_from(self.story_url), 'miss')
+        response = self.client.get(home)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, '#angst')
+        self.assertNotContains(response, '#fluff')
+
+        # from the tag's side too
+        with self.captureOnCommitCallbacks(execute=True):
+            fluff.story_set.add(self.story)
+        self.assertContains(self.client.get(home), '#fluff')
+
+    def test_other_stories_stay_cached(self):
+        other = Story.objects.create(author=self.author, title='Other', synopsis='...', public=True)
+        other_url = reverse('story-detail', kwargs={'pk': other.pk})
+        self.served_from(other_url)
+        Comment.objects.create(post=self.story, author=self.reader, content='Again')
+        self.assertEqual(self.served_from(other_url), 'hit')
+
+    def test_edited_chapter_is_shown(self):
+        self.served_from(self.story_url)
+        self.chapter.content = 'A brand new beginning'
+        self.chapter.save()
+        self.assertContains(self.client.get(self.story_url), 'A brand new beginning')
+
+    def test_csrf_tokens_are_per_visitor(self):
+        self.served_from(self.comments_url)
+        response = self.client.get(self.comments_url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertNotIn(b'__page_cache_csrf_token__', response.content)
+        self.assertIn('csrftoken', response.cookies)
+        # the token in the page goes with this visitor's cookie, so the like form can be posted
+        token = re.search(rb'name="csrfmiddlewaretoken" value="([^"]+)"', response.content).group(1).decode()
+        client = self.client_class(enforce_csrf_checks=True)
+        client.cookies['csrftoken'] = response.cookies['csrftoken'].value
+        client.login(username='reader', password='pass')
+        like = client.post(reverse('likes-comments', args=[self.story.pk, self.comment.pk]),
+                           {'csrfmiddlewaretoken': token})
+        self.assertEqual(like.status_code, 302)
+
+    def test_off_when_timeout_is_zero(self):
+        with override_settings(PAGE_CACHE_TIMEOUT=0):
+            self.assertIsNone(self.served_from(self.story_url))
+            self.assertIsNone(self.served_from(self.story_url))
+
+
+class FileBasedPageCacheTests(PageCacheTests):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        caches = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}})
+        caches.enable()
+        self.addCleanup(caches.disable)
+        super().setUp()
+
+
+@override_settings(PAGE_CACHE_TIMEOUT=0)  # these count renders, not whole pages served from the page cache
+class ChapterHtmlCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        chapter_cache.stats.reset()
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.story = Story.objects.create(author=self.author, title='Epic', synopsis='...', public=True)
+        self.chapter = Chapter.objects.create(story=self.story, title='One', content='First line\n\n<b>Second</b>', public=True)
+        self.url = reverse('story-detail', kwargs={'pk': self.story.pk})
+
+    def test_rendered_once_then_served_from_cache(self):
+        first = self.client.get(self.url)
+        second = self.client.get(self.url)
+        for response in (first, second):
+            self.assertContains(response, '<p>First line</p>')
+            self.assertContains(response, '&lt;b&gt;Second&lt;/b&gt;')
+        self.assertEqual(chapter_cache.stats.as_dict()['misses'], 1)
+        self.assertEqual(chapter_cache.stats.as_dict()['hits'], 1)
+
+    def test_edit_drops_cached_html(self):
+        self.client.get(self.url)
+        old_key = chapter_cache.chapter_html_key(self.chapter)
+        self.client.login(username='author', password='pass')
+        self.client.post(reverse('chapter-edit', kwargs={'story_pk': self.story.pk, 'pk': self.chapter.pk}),
+                         {'title': 'One', 'content': 'Rewritten'})
+
+        self.assertIsNone(cache.get(old_key))
+        self.assertContains(self.client.get(self.url), '<p>Rewritten</p>')
+
+    def test_stats_endpoint_is_staff_only(self):
+        url = reverse('chapter-cache-stats')
+        self.client.login(username='author', password='pass')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        User.objects.create_superuser(username='admin', password='pass')
+        self.client.login(username='admin', password='pass')
+        self.assertIn('hit_rate', self.client.get(url).json())
+
+
+class CommentTreeTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.reader = User.objects.create_user(username='reader', password='pass')
+        self.story = Story.objects.create(author=self.author, title='Talked About', synopsis='...', public=True)
+
+    def add_thread(self, replies):
+        comment = Comment.objects.create(author=self.author, post=self.story, content='Top')
+        for i in range(replies):
+            Comment.objects.create(author=self.reader, post=self.story, parent=comment, content=f'Reply {i}')
+        return comment
+
+    def test_constant_queries(self):
+        self.add_thread(1)
+        with CaptureQueriesContext(connection) as small:
+            list(load_comment_tree(self.story, self.reader))
+        for _ in range(5):
+            self.add_thread(4)
+        with self.assertNumQueries(len(small)):
+            page = load_comment_tree(self.story, self.reader)
+            for comment in page:
+                for reply in comment.reply_list:
+                    reply.author.username, reply.is_liked
+
+    def test_replies_capped_per_thread(self):
+        first = self.add_thread(6)
+        second = self.add_thread(2)
+        page = load_comment_tree(self.story, self.reader, replies_per_thread=3)
+        threads = {comment.pk: comment for comment in page}
+        self.assertEqual([r.content for r in threads[first.pk].reply_list], ['Reply 0', 'Reply 1', 'Reply 2'])
+        self.assertEqual(threads[first.pk].hidden_reply_count, 3)
+        self.assertEqual(len(threads[second.pk].reply_list), 2)
+        self.assertEqual(threads[second.pk].hidden_reply_count, 0)
+
+    def test_viewer_like_flag_and_paging(self):
+        comments = [self.add_thread(0) for _ in range(4)]
+        comments[3].toggle_like(self.reader.profile)
+        page = load_comment_tree(self.story, self.reader, page=2, per_page=3)
+        self.assertEqual([c.pk for c in page], [comments[3].pk])
+        self.assertTrue(page[0].is_liked)
+        self.assertFalse(page.has_next())
+
+    def test_story_page_shows_three_comments(self):
+        for _ in range(4):
+            self.add_thread(0)
+        response = self.client.get(reverse('story-detail', kwargs={'pk': self.story.pk}))
+        self.assertEqual(len(response.context['comments']), 3)
+        self.assertContains(response, 'View More')
+
+
+class SQLInstrumentationTests(TestCase):
+    def setUp(self):
+        author = User.objects.create_user(username='author', password='pass')
+        Story.objects.create(author=author, title='Instrumented', synopsis='...', public=True)
+
+    @override_settings(SQL_INSTRUMENTATION={'ENABLED': True})
+    def test_server_timing_and_log(self):
+        with self.assertLogs('my_app.sql', level='INFO') as logs:
+            response = self.client.get(reverse('home-page'))
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('"view": "home-page"', logs.output[0])
+
+    def test_disabled_by_default(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('home-page')))
+
+    @override_settings(SQL_INSTRUMENTATION={'ENABLED': True, 'QUERY_BUDGETS': {'home-page': 1}, 'RAISE_ON_BUDGET': True})
+    def test_budget_raises(self):
+        with self.assertLogs('my_app.sql', level='WARNING'):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('home-page'))
+
+    def test_repeated_shapes_detected(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for pk in range(6):
+                list(User.objects.filter(pk=pk))
+            list(User.objects.filter(pk__in=[1, 2, 3]))
+            list(User.objects.filter(pk__in=[1, 2]))
+        shapes = dict(recorder.repeated_shapes(5))
+        self.assertEqual(list(shapes.values()), [6])
+        self.assertEqual(query_shape('SELECT 1 WHERE id IN (%s, %s, %s)'), 'SELECT 1 WHERE id IN (...)')
+
+
+class SeedAndBenchmarkTests(TestCase):
+    def test_seed_data_builds_a_consistent_archive(self):
+        out = StringIO()
+        call_command('seed_data', users=8, stories=12, chapters_per_story=2, chapter_chars=500,
+                     tags=10, fandoms=4, notifications_per_user=3, stdout=out)
+        self.assertIn('Seeded 8 users and 12 stories', out.getvalue())
+        self.assertEqual(Story.objects.count(), 12)
+        self.assertEqual(Profile.objects.count(), User.objects.count())
+        self.assertTrue(Chapter.objects.exclude(content_hash='').exists())
+        # signals don't run for bulk inserts, the seeder has to leave the counters right itself
+        self.assertEqual(set(reconcile_counters().values()), {0})
+
+    def test_benchmark_reports_latency_and_queries(self):
+        call_command('seed_data', users=5, stories=5, chapter_chars=300, notifications_per_user=2, stdout=StringIO())
+        report = run_benchmarks(iterations=2, warmup=0, host='testserver')
+        self.assertIn('story_detail', report['results'])
+        for result in report['results'].values():
+            self.assertEqual(result['status'], 200)
+            self.assertGreater(result['queries'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+
+        slower = {'results': {name: {**r, 'queries': r['queries'] + 1} for name, r in report['results'].items()}}
+        self.assertEqual(compare(report, report), [])
+        self.assertEqual(len(compare(slower, report)), len(report['results']))
+
+    def test_percentile(self):
+        self.assertEqual(percentile(range(1, 101), 95), 95)
+        self.assertEqual(percentile([3, 1, 2], 50), 2)
+
+
+class DatabaseProfileTests(TestCase):
+    def test_production_pragmas_applied_on_connect(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        production = ConnectionHandler({'default': sqlite_database(Path(directory) / 'x.sqlite3', 'production')})['default']
+        self.addCleanup(production.close)
+        with production.cursor() as cursor:
+            pragmas = {name: cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                       for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'temp_store')}
+        self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 20000,
+                                   'cache_size': -20000, 'temp_store': 2})
+
+    def test_default_profile_keeps_the_journal_mode(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        name = Path(directory) / 'x.sqlite3'
+        for profile in ('production', 'default'):
+            database = ConnectionHandler({'default': sqlite_database(name, profile)})['default']
+            with database.cursor() as cursor:
+                journal_mode = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+            database.close()
+        self.assertEqual(journal_mode, 'wal')
+
+    def test_profiles(self):
+        production = sqlite_database('x.sqlite3')
+        self.assertEqual(production['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertGreater(production['CONN_MAX_AGE'], 0)
+        self.assertEqual(sqlite_database('x.sqlite3', 'default')['CONN_MAX_AGE'], 0)
+        self.assertNotIn('init_command', sqlite_database('x.sqlite3', 'default')['OPTIONS'])
+        self.assertEqual(sqlite_replica('x.sqlite3', 'default')['OPTIONS']['init_command'], 'PRAGMA query_only=1;')
+        with self.assertRaises(ValueError):
+            sqlite_database('x.sqlite3', 'fast')
+
+
+class QueryPlanTests(TestCase):
+    """The hot queries have to keep using their indexes, never a full table scan."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='pass')
+        self.story = Story.objects.create(author=self.user, title='Planned', synopsis='...', public=True)
+        self.chapter = Chapter.objects.create(story=self.story, title='One', content='...')
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[3] for row in cursor.fetchall()]
+
+    def assertUsesIndex(self, queryset, index):
+        plan = self.query_plan(queryset)
+        self.assertTrue(any(index in step for step in plan), plan)
+        # "SCAN table" on its own (no USING ... INDEX) reads every row
+        self.assertFalse([step for step in plan if re.fullmatch(r'SCAN \S+', step)], plan)
+
+    def test_home_feed(self):
+        stories = feed_queryset(None, Story.objects.filter(public=True))
+        self.assertUsesIndex(stories.order_by('-created_at', '-pk')[:6], 'story_public_idx')
+        next_page = stories.filter(created_at__lt=self.story.created_at).order_by('-created_at', '-pk')[:6]
+        self.assertUsesIndex(next_page, 'post_cursor_idx')
+
+    def test_trending_feed(self):
+        stories = feed_queryset(None, Story.objects.filter(public=True))
+        self.assertUsesIndex(stories.order_by('-trending_score', '-pk')[:6], 'story_trending_idx')
+        next_page = stories.filter(trending_score__lt=self.story.trending_score).order_by('-trending_score', '-pk')[:6]
+        self.assertUsesIndex(next_page, 'story_trending_idx')
+
+    def test_unread_notifications(self):
+        unread = Notification.objects.filter(recipient=self.user, read=False)
+        self.assertUsesIndex(unread.order_by('-created_at', '-pk'), 'notif_unread_idx')
+        self.assertUsesIndex(unread.values('pk'), 'notif_unread_idx')
+
+    def test_top_level_comments(self):
+        top_level = Comment.objects.filter(post=self.story, parent=None).order_by('created_at', 'pk')
+        self.assertUsesIndex(top_level, 'comment_top_level_idx')
+
+    def test_chapter_list(self):
+        chapters = self.story.chapters.order_by('position', 'pk').values_list(*CHAPTER_LIST_FIELDS)
+        self.assertUsesIndex(chapters, 'chapter_position_idx')
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', self.query_plan(chapters))
+
+    def test_moderation_queue(self):
+        pending = Report.objects.filter(status='Pending').order_by('created_at')
+        self.assertUsesIndex(pending, 'report_status_created_idx')
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', self.query_plan(pending))
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter()
+
+    def test_reads_outside_a_request_use_the_primary(self):
+        self.assertEqual(self.router.db_for_read(Story), 'default')
+
+    def test_request_reads_one_replica_until_it_writes(self):
+        token = routers.start_request()
+        try:
+            replica = self.router.db_for_read(Story)
+            self.assertIn(replica, ['replica1', 'replica2'])
+            self.assertEqual({self.router.db_for_read(model) for model in (Story, Comment, User)}, {replica})
+            self.assertEqual(self.router.db_for_write(Comment), 'default')
+            self.assertEqual(self.router.db_for_read(Story), 'default')
+        finally:
+            self.assertTrue(routers.end_request(token))
+
+    def test_middleware_pins_the_next_request_after_a_write(self):
+        def view(request):
+            request.read_from = self.router.db_for_read(Story)
+            if request.method == 'POST':
+                self.router.db_for_write(Story)
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(view)
+        factory = RequestFactory()
+        request = factory.get('/')
+        self.assertNotIn('pin_primary', middleware(request).cookies)
+        self.assertNotEqual(request.read_from, 'default')
+
+        self.assertIn('pin_primary', middleware(factory.post('/')).cookies)
+        request = factory.get('/')
+        request.COOKIES['pin_primary'] = '1'
+        middleware(request)
+        self.assertEqual(request.read_from, 'default')
+
+    def test_unsafe_requests_read_from_the_primary(self):
+        def view(request):
+            # e.g. a form post that fails validation: it reads, but never writes
+            request.read_from = self.router.db_for_read(Story)
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(view)
+        for method in ('post', 'put', 'delete'):
+            request = getattr(RequestFactory(), method)('/')
+            self.assertIn('pin_primary', middleware(request).cookies)
+            self.assertEqual(request.read_from, 'default')
+
+    def test_replicas_are_read_only_and_never_migrated(self):
+        replica = sqlite_replica('x-replica.sqlite3')
+        self.assertIn('query_only=1', replica['OPTIONS']['init_command'])
+        self.assertNotIn('transaction_mode', replica['OPTIONS'])
+        self.assertEqual(replica['TEST'], {'MIRROR': 'default'})
+        self.assertIs(self.router.allow_migrate('replica1', 'my_app'), False)
+        self.assertIsNone(self.router.allow_migrate('default', 'my_app'))
+
+
 class StorySearchTests(TestCase):
     def setUp(self):
         author = User.objects.create_user(username='author', password='pass')
@@ -256,6 +1592,45 @@ class StorySearchTests(TestCase):
         self.assertNotContains(response, self.story2.title)
 
 
+class FullTextSearchTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='wordsmith', password='pass')
+        self.dragon = Story.objects.create(author=self.author, title='Dragon Riders', synopsis='Wings.', public=True)
+        self.other = Story.objects.create(author=self.author, title='Sea Tales', synopsis='A dragon appears once.', public=True)
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('story-search'), {'query': query, **params})
+        return list(response.context['stories'])
+
+    def test_prefix_match_ranks_title_first(self):
+        self.assertEqual(self.search('drag'), [self.dragon, self.other])
+
+    def test_index_follows_tags_and_renames(self):
+        self.other.tags.add(Tag.objects.create(name='kraken'))
+        self.assertEqual(self.search('kraken'), [self.other])
+
+        self.other.title = 'Ocean Tales'
+        self.other.save()
+        self.assertEqual(self.search('ocean'), [self.other])
+        self.assertEqual(self.search('sea'), [])
+
+    def test_exclusions_apply_to_matches(self):
+        gore = Warning.objects.create(name='Gore')
+        self.dragon.warnings.add(gore)
+        self.assertEqual(self.search('dragon', warnings=[gore.pk]), [self.other])
+
+    def test_deleted_story_leaves_index(self):
+        Post.objects.get(pk=self.dragon.pk).delete()
+        self.assertEqual(self.search('riders'), [])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.INDEX_TABLE}')
+        self.assertEqual(self.search('dragon'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search('dragon'), [self.dragon, self.other])
+
+
 #API tests
 
 class NotificationAPITestCase(APITestCase):
@@ -282,10 +1657,35 @@ class NotificationAPITestCase(APITestCase):
         response = self.client.get(self.list_url)
 
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), 2)
-        for note in response.data:
+        self.assertEqual(len(response.data['results']), 2)
+        for note in response.data['results']:
             self.assertIn(note['message'], ['Test Notification 1', 'Test Notification 2'])
 
+    def test_list_notifications_cursor_pages(self):
+        for i in range(5):
+            Notification.objects.create(recipient=self.user, message=f'Extra {i}')
+        self.client.login(username='testuser', password='testpass')
+
+        seen = []
+        url = self.list_url + '?page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(note['id'] for note in response.data['results'])
+            url = response.data['next']
+
+        expected = list(Notification.objects.filter(recipient=self.user)
+                        .order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor_is_404(self):
+        self.client.login(username='testuser', password='testpass')
+        response = self.client.get(self.list_url, {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+        for raw in ('n|created_at|1.5|3', 'n|created_at|nope|3'):
+            cursor = base64.urlsafe_b64encode(raw.encode()).decode()
+            self.assertEqual(self.client.get(self.list_url, {'cursor': cursor}).status_code, 404, raw)
+
     def test_mark_notification_as_read(self):
         self.client.login(username='testuser', password='testpass')
 
@@ -296,6 +1696,37 @@ class NotificationAPITestCase(APITestCase):
         self.n1.refresh_from_db()
         self.assertTrue(self.n1.read)
 
+    def test_unread_count(self):
+        self.client.login(username='testuser', password='testpass')
+        response = self.client.get(reverse('notification-unread-count'))
+        self.assertEqual(response.data, {'unread': 1})
+
+    def test_mark_all_read_in_one_update(self):
+        Notification.objects.create(recipient=self.user, message='Another')
+        self.client.login(username='testuser', password='testpass')
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('notification-mark-all-read'), {}, format='json')
+        self.assertEqual(response.data, {'updated': 2})
+        self.assertEqual(len([q for q in ctx if q['sql'].startswith('UPDATE')]), 1)
+        self.assertFalse(Notification.objects.filter(recipient=self.user, read=False).exists())
+        self.n3.refresh_from_db()
+        self.assertFalse(self.n3.read)
+
+    def test_mark_read_by_ids_and_up_to(self):
+        newer = Notification.objects.create(recipient=self.user, message='Newer')
+        newest = Notification.objects.create(recipient=self.user, message='Newest')
+        self.client.login(username='testuser', password='testpass')
+        url = reverse('notification-mark-all-read')
+
+        response = self.client.post(url, {'ids': [newest.pk, self.n3.pk]}, format='json')
+        self.assertEqual(response.data, {'updated': 1})
+
+        response = self.client.post(url, {'up_to': self.n1.pk}, format='json')
+        self.assertEqual(response.data, {'updated': 1})
+        newer.refresh_from_db()
+        self.assertFalse(newer.read)
+
     def test_cannot_mark_other_users_notification(self):
         self.client.login(username='testuser', password='testpass')
 
@@ -303,3 +1734,53 @@ class NotificationAPITestCase(APITestCase):
         response = self.client.patch(url)
 
         self.assertEqual(response.status_code, 404)
+
+
+class NotificationStreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='listener', password='pass')
+
+    async def test_thousands_of_idle_streams(self):
+        streams = [notification_events(user_id) for user_id in range(1, 5001)]
+        try:
+            for stream in streams:
+                self.assertTrue((await stream.__anext__()).startswith('retry'))
+            self.assertEqual(broker.connection_count(), 5000)
+
+            started = time.perf_counter()
+            self.assertEqual(broker.publish(4242, {'message': 'hello'}), 1)
+            event = await asyncio.wait_for(streams[4241].__anext__(), timeout=1)
+            self.assertLess(time.perf_counter() - started, 1)
+            self.assertIn('"hello"', event)
+
+            # everyone else stays idle
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(streams[0].__anext__(), timeout=0.05)
+        finally:
+            for stream in streams:
+                await stream.aclose()
+        self.assertEqual(broker.connection_count(), 0)
+
+    async def test_new_notification_is_pushed(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('notification-stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = aiter(response.streaming_content)
+        self.assertIn(b'retry', await anext(content))
+
+        def notify():
+            with self.captureOnCommitCallbacks(execute=True):
+                Notification.objects.create(recipient=self.user, message='Pushed to you')
+        await sync_to_async(notify)()
+
+        event = await asyncio.wait_for(anext(content), timeout=1)
+        self.assertIn(b'Pushed to you', event)
+        await content.aclose()
+
+    async def test_stream_requires_login(self):
+        response = await self.async_client.get(reverse('notification-stream'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_wsgi_gets_no_content(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('notification-stream')).status_code, 204)
@@ -0,0 +1,113 @@
+"""
+Following feeds, fanned out on write: every profile has a timeline of
+TimelineEntry rows, one per story from someone they follow, so reading the
+feed is one range scan of timeline_cursor_idx.
+
+Entries are written when a story goes public or gets a new chapter,
+backfilled when you follow someone and removed when you unfollow them or
+the story goes private. Authors with more than FANOUT_FOLLOWER_LIMIT
+followers aren't fanned out; their followers pull the latest stories into
+their own timeline when they open the first page of the feed.
+"""
+from itertools import groupby
+
+from django.utils import timezone
+
+from my_app.feeds import feed_queryset
+from my_app.models import Profile, Story, TimelineEntry
+from my_app.pagination import decode_cursor, keyset_page
+
+#how many followers we load and write timeline entries for at a time
+FANOUT_CHUNK_SIZE = 1000
+
+#authors with more followers than this are read on demand instead of fanned out
+FANOUT_FOLLOWER_LIMIT = 5000
+
+#how many of the latest stories land on a timeline on follow (and on pull)
+BACKFILL_STORIES = 50
+
+Follow = Profile.followers.through
+
+
+def fan_out_story(story_id, chunk_size=FANOUT_CHUNK_SIZE):
+    """
+    Puts the story at the top of every follower's timeline, creating the
+    entries or bumping existing ones. Returns the number of followers
+    processed (0 for private stories and authors over the limit).
+    """
+    story = Story.objects.filter(pk=story_id, public=True).select_related('author__profile').first()
+    if story is None:
+        return 0
+    author = story.author.profile
+    if author.follower_count > FANOUT_FOLLOWER_LIMIT:
+        return 0
+
+    now = timezone.now()
+    followers = (Follow.objects.filter(from_profile_id=author.pk)
+                 .order_by('to_profile_id').values_list('to_profile_id', flat=True))
+    processed = 0
+    last_follower_id = 0
+    while True:
+        follower_ids = list(followers.filter(to_profile_id__gt=last_follower_id)[:chunk_size])
+        if not follower_ids:
+            break
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(owner_id=follower_id, story_id=story.pk, created_at=now) for follower_id in follower_ids],
+            update_conflicts=True, unique_fields=['owner', 'story'], update_fields=['created_at'],
+        )
+        processed += len(follower_ids)
+        last_follower_id = follower_ids[-1]
+    return processed
+
+
+def remove_story(story_id):
+    """Takes the story off every timeline, e.g. when it goes private."""
+    TimelineEntry.objects.filter(story_id=story_id).delete()
+
+
+def backfill(owner_id, author_profile_ids, limit=BACKFILL_STORIES):
+    """Adds the authors' latest public stories to owner's timeline, keeping entries already there."""
+    stories = (Story.objects.filter(public=True, author__profile__in=author_profile_ids)
+               .order_by('-created_at').values_list('pk', 'created_at')[:limit])
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner_id=owner_id, story_id=story_id, created_at=created_at) for story_id, created_at in stories],
+        ignore_conflicts=True,
+    )
+
+
+def unfollow(owner_id, author_profile_ids):
+    """Trims the authors' stories off owner's timeline."""
+    TimelineEntry.objects.filter(owner_id=owner_id, story__author__profile__in=author_profile_ids).delete()
+
+
+def pull_popular_authors(owner_id):
+    """Fan-out on read for the followed authors that fan_out_story skips."""
+    authors = list(Profile.objects.filter(followers=owner_id, follower_count__gt=FANOUT_FOLLOWER_LIMIT)
+                   .values_list('pk', flat=True))
+    if authors:
+        backfill(owner_id, authors)
+
+
+def following_page(viewer, cursor, page_size):
+    """
+    The KeysetPage of viewer's Following feed that cursor points to, as
+    story cards (see feed_queryset). Opening the first page pulls in stories
+    from followed authors who are too popular to fan out.
+    """
+    profile = viewer.profile
+    if decode_cursor(cursor, TimelineEntry) is None:
+        pull_popular_authors(profile.pk)
+
+    page = keyset_page(TimelineEntry.objects.filter(owner=profile), cursor, page_size)
+    stories = feed_queryset(viewer, Story.objects.filter(public=True)).in_bulk([entry.story_id for entry in page])
+    page.object_list = [stories[entry.story_id] for entry in page if entry.story_id in stories]
+    return page
+
+
+def rebuild_timelines():
+    """Rebuilds every timeline from the follows, as if everyone had just followed. Returns the entry count."""
+    TimelineEntry.objects.all().delete()
+    follows = Follow.objects.order_by('to_profile_id').values_list('to_profile_id', 'from_profile_id')
+    for owner_id, rows in groupby(follows.iterator(), key=lambda row: row[0]):
+        backfill(owner_id, [author_id for _, author_id in rows])
+    return TimelineEntry.objects.count()
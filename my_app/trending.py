@@ -0,0 +1,110 @@
+"""
+Trending ranking. Every like, bookmark and comment (and the story being
+posted) adds its weight to the story, and each of those weights halves
+every HALF_LIFE, so right now a story is worth
+
+    sum(weight * 2 ** -((now - when) / HALF_LIFE))
+
+Everything decays at the same rate, so the order only changes when
+something happens. Instead of the decayed sum we store
+
+    log2(sum(weight * 2 ** ((when - EPOCH) / HALF_LIFE)))
+
+which sorts exactly the same at any moment, never has to be decayed and
+only grows by 1 per half-life. Each engagement adds its term with a single
+UPDATE; taking a like or bookmark back removes it again. EngagementEvent
+keeps the recent events so recompute_trending() can rebuild every score
+from scratch, e.g. from cron.
+"""
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Abs, Greatest, Log, Power
+from django.utils import timezone
+
+from my_app.models import EngagementEvent, Story
+
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+HALF_LIFE = timedelta(hours=36)
+
+WEIGHTS = {'story': 3.0, 'like': 1.0, 'bookmark': 2.0, 'comment': 1.5}
+
+#older events count for less than 1% of their weight; the recompute forgets them
+EVENT_WINDOW = HALF_LIFE * 7
+
+#lowest a taken-back engagement can push a score, relative to what it removed
+_FLOOR = 2.0 ** -30
+
+
+def exponent(kind, when):
+    """log2 of one engagement's term in the stored score."""
+    return math.log2(WEIGHTS[kind]) + (when - EPOCH) / HALF_LIFE
+
+
+def initial_score(created_at):
+    return exponent('story', created_at)
+
+
+def _float(value):
+    return Value(float(value), output_field=FloatField())
+
+
+def _plus(x):
+    # log2(2**score + 2**x), without ever raising 2 to a big power
+    score = F('trending_score')
+    return Greatest(score, _float(x)) + Log(_float(2), _float(1) + Power(_float(2), -Abs(score - _float(x))))
+
+
+def _minus(x):
+    # log2(2**score - 2**x), kept above x + log2(_FLOOR) in case of rounding
+    score = F('trending_score')
+    return _float(x) + Log(_float(2), Greatest(Power(_float(2), score - _float(x)) - _float(1), _float(_FLOOR)))
+
+
+def record(story_id, kind, profile_id=None, when=None):
+    """Adds an engagement to the story's score. Does nothing if story_id isn't a story (e.g. a comment)."""
+    when = when or timezone.now()
+    if Story.objects.filter(pk=story_id).update(trending_score=_plus(exponent(kind, when))):
+        EngagementEvent.objects.create(story_id=story_id, profile_id=profile_id, kind=kind, created_at=when)
+
+
+def withdraw(story_id, kind, profile_id):
+    """Takes back profile's latest like/bookmark of the story, unless the recompute already forgot it."""
+    event = (EngagementEvent.objects.filter(story_id=story_id, profile_id=profile_id, kind=kind)
+             .order_by('-created_at').first())
+    if event is None:
+        return
+    event.delete()
+    Story.objects.filter(pk=story_id).update(trending_score=_minus(exponent(kind, event.created_at)))
+
+
+def _log_sum(exponents):
+    top = max(exponents)
+    return top + math.log2(sum(2.0 ** (x - top) for x in exponents))
+
+
+def recompute_trending(batch_size=500):
+    """
+    Recomputes every story's score from its creation time and the events of
+    the last EVENT_WINDOW, dropping older events. Returns the number of stories.
+    """
+    EngagementEvent.objects.filter(created_at__lt=timezone.now() - EVENT_WINDOW).delete()
+    events = defaultdict(list)
+    for story_id, kind, when in EngagementEvent.objects.values_list('story_id', 'kind', 'created_at').iterator():
+        events[story_id].append(exponent(kind, when))
+
+    total = 0
+    batch = []
+    for story in Story.objects.only('pk', 'created_at', 'trending_score').order_by('pk').iterator(chunk_size=batch_size):
+        story.trending_score = _log_sum([initial_score(story.created_at), *events.get(story.pk, [])])
+        batch.append(story)
+        if len(batch) >= batch_size:
+            Story.objects.bulk_update(batch, ['trending_score'])
+            total += len(batch)
+            batch = []
+    if batch:
+        Story.objects.bulk_update(batch, ['trending_score'])
+        total += len(batch)
+    return total
@@ -1,29 +1,57 @@
+import json
+
 from django.contrib.auth.forms import UserCreationForm
+from django.core.handlers.asgi import ASGIRequest
 from django.contrib.auth.models import User
-from django.core.paginator import Paginator
-from django.db.models import Q
-from django.http import HttpResponse
+from django.db.models import Q, Case, When, Subquery
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.views.generic import CreateView, UpdateView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.urls import reverse_lazy, reverse
+from django.utils.http import content_disposition_header
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from rest_framework.exceptions import NotFound
+from rest_framework.views import APIView
 
-from my_app.models import Story, Chapter, Comment, Post, Notification, Profile
+from my_app.models import Story, Chapter, Comment, Post, Notification, Profile, Tag, Fandom
 from my_app.forms import StoryForm, ChapterForm, CommentForm, ProfileForm, StorySearchForm, ReportForm
 from rest_framework import generics, permissions
-from my_app.serializers import NotificationSerializer
-
+from my_app.serializers import NotificationSerializer, NotificationMarkReadSerializer
+from my_app.feeds import feed_queryset
+from my_app import search
+from my_app.pagination import keyset_page, KeysetCursorPagination
+from my_app.notifications import notify_bookmarkers_of_chapter
+from my_app.tasks import run_in_background
+from my_app.pubsub import broker
+from my_app import chapter_cache
+from my_app.chapters import ChapterIndex, reading_page
+from my_app.comments import load_comment_tree
+from my_app import autocomplete, exports, recommendations, timelines
+from my_app.page_cache import HOME, cache_anonymous_page, story_scope
+
+#seconds between keepalive comments on an idle notification stream
+STREAM_KEEPALIVE_SECONDS = 15
+
+#home/search sort options -> the Story field they're ordered by, highest first
+STORY_SORTS = {'newest': 'created_at', 'trending': 'trending_score'}
+
+@cache_anonymous_page(HOME)
 def home(request):
-    stories = Story.objects.filter(public=True)
-    story_list = Story.objects.filter(public=True).order_by('-created_at')
-    paginator = Paginator(story_list, 5)  # Show 5 stories per page
-    page_number = request.GET.get('page')
-    stories = paginator.get_page(page_number)
+    sort = request.GET.get('sort') if request.GET.get('sort') in STORY_SORTS else 'newest'
+    story_list = feed_queryset(request.user, Story.objects.filter(public=True))
+    stories = keyset_page(story_list, request.GET.get('cursor'), 5, STORY_SORTS[sort])  # Show 5 stories per page
 
-    return render(request, "index.html", {"stories": stories})
+    return render(request, "index.html", {"stories": stories, "sort": sort})
+
+@login_required
+def following(request):
+    # stories from people you follow, read from your timeline (my_app/timelines.py)
+    stories = timelines.following_page(request.user, request.GET.get('cursor'), 5)
+
+    return render(request, "index.html", {"stories": stories, "following_feed": True})
 
 def signup(request):
     form = UserCreationForm(request.POST)
@@ -34,20 +62,21 @@ def signup(request):
         form = UserCreationForm()
         return render(request, 'register.html', {'form': form})
 
+@cache_anonymous_page(lambda kwargs: story_scope(kwargs['pk']))
 def story_detail(request, pk):
-    story = get_object_or_404(Story, id=pk)
+    # taxonomy prefetched and the viewer's is_liked/is_bookmarked as EXISTS, never the whole like/bookmark lists
+    story = get_object_or_404(feed_queryset(request.user), id=pk)
+    is_own_story = story.author_id == request.user.pk
+    # one query for the picker and the navigation, one more for the chapter being read
+    chapters = ChapterIndex(story, include_private=is_own_story)
     chapter_id = request.GET.get('chapter')
-    chapter = None
-    next_chapter = None
-
-    if chapter_id:
-        chapter = get_object_or_404(Chapter, pk=chapter_id)
-        # Get the next chapter by ordering (e.g., by pk or a chapter number)
-        next_chapter = story.chapters.filter(pk__gt=chapter.pk).order_by('pk').first()
-    else:
-        chapter = story.chapters.order_by('pk').first()
-        if chapter:
-            next_chapter = story.chapters.filter(pk__gt=chapter.pk).order_by('pk').first()
+    entry = chapters.get(chapter_id) if chapter_id else chapters.first()
+    chapter = previous_chapter = next_chapter = page = None
+    if entry:
+        # the text is only read (a page of it at a time) when its html isn't cached
+        chapter = Chapter.objects.defer('content').get(pk=entry.id)
+        previous_chapter, next_chapter = chapters.neighbours(entry.id)
+        page = reading_page(request.GET.get('page'), chapter)
 
     form = CommentForm()
 
@@ -71,14 +100,35 @@ def story_detail(request, pk):
         'genres': story.genres.all(),
         'fandoms': story.fandoms.all(),
         'warnings': story.warnings.all(),
+        'chapters': chapters,
         'chapter': chapter,
+        'chapter_html': chapter_cache.render_chapter_html(chapter, page) if chapter else '',
+        'page': page,
+        'previous_chapter': previous_chapter,
         'next_chapter': next_chapter,
-        'comments': story.comments.all().filter(parent=None),
-        'is_own_story': (story.author == request.user),
+        'comments': load_comment_tree(story, request.user, per_page=3, replies_per_thread=5),
+        'similar_stories': recommendations.similar_stories(story),
+        'is_own_story': is_own_story,
         'form' : form,
     }
     return render(request, "post.html", context)
 
+def export_story(request, pk, fmt):
+    """Downloads the story's public chapters as EPUB or text: the cached file if there is one, else streamed."""
+    story = get_object_or_404(Story.objects.select_related('author'), pk=pk)
+    if fmt not in exports.FORMATS or not (story.public or story.author_id == request.user.pk):
+        raise Http404()
+    filename = exports.export_filename(story, fmt)
+    version = exports.export_version(story)
+    path = exports.export_path(story, fmt, version)
+    if path.exists():
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=filename,
+                            content_type=exports.FORMATS[fmt])
+    response = StreamingHttpResponse(exports.stream_export(story, fmt, version), content_type=exports.FORMATS[fmt])
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
+
+@cache_anonymous_page(lambda kwargs: story_scope(kwargs['pk']))
 def comment_view(request, pk):
     story = get_object_or_404(Story, id=pk)
 
@@ -102,7 +152,8 @@ def comment_view(request, pk):
         'genres': story.genres.all(),
         'fandoms': story.fandoms.all(),
         'warnings': story.warnings.all(),
-        'comments': story.comments.all().filter(parent=None),
+        'comments': load_comment_tree(story, request.user, page=request.GET.get('page'),
+                                      per_page=20, replies_per_thread=50),
         'is_own_story': (story.author == request.user),
         'form': form,
     }
@@ -163,8 +214,8 @@ def profile_view(request, username = None):
     context = {
         'profile_user': user,
         'profile': user.profile,
-        'stories': Story.objects.filter(author=user),
-        'bookmarks': user.profile.bookmarked_stories.all(),
+        'stories': feed_queryset(request.user, Story.objects.filter(author=user)),
+        'bookmarks': feed_queryset(request.user, user.profile.bookmarked_stories.all()),
         'is_own_profile': (user == request.user)
     }
     return render(request, 'profile.html', context)
@@ -191,6 +242,7 @@ class story_edit(LoginRequiredMixin, UpdateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['story'] = self.object
+        context['chapters'] = ChapterIndex(self.object, include_private=True)
         return context
 
     def get_queryset(self):
@@ -220,8 +272,8 @@ def publish_chapter(request, story_pk, chapter_pk):
     if story.public:
         chapter.public = True
         chapter.save()
-        for user in story.bookmarked_by.all():
-            Notification.objects.create(recipient=user.user, message=f"{story.author} just posted a new chapter to {story.title}!")
+        run_in_background(notify_bookmarkers_of_chapter, chapter.pk)
+        run_in_background(timelines.fan_out_story, story.pk)
 
     return redirect(request.META.get('HTTP_REFERER', '/'))
 
@@ -280,10 +332,7 @@ def follow(request, username):
 @login_required
 def likes(request, pk, story_pk = None):
     post = get_object_or_404(Post, pk=pk)
-    if request.user.profile in post.liked_by.all():
-        post.liked_by.remove(request.user.profile)
-    else:
-        post.liked_by.add(request.user.profile)
+    if post.toggle_like(request.user.profile):
         if story_pk:
             comment = get_object_or_404(Comment, pk=pk)
             Notification.objects.create(recipient=post.author, message=f"{request.user} just liked your comment {comment.content}!")
@@ -299,10 +348,7 @@ def likes(request, pk, story_pk = None):
 @login_required
 def bookmarks(request, pk):
     story = get_object_or_404(Story, pk=pk)
-    if request.user.profile in story.bookmarked_by.all():
-        story.bookmarked_by.remove(request.user.profile)
-    else:
-        story.bookmarked_by.add(request.user.profile)
+    if story.toggle_bookmark(request.user.profile):
         Notification.objects.create(recipient=story.author, message=f"{request.user} just bookmarked your story {story.title}!")
     return redirect(request.META.get('HTTP_REFERER', '/'))
 
@@ -351,13 +397,19 @@ def story_search(request):
         exclude_genres = form.cleaned_data.get('genres')
 
         if q:
-            # Search title, author username, tags, fandoms
-            stories = stories.filter(
-                Q(title__icontains=q) |
-                Q(author__username__icontains=q) |
-                Q(tags__name__icontains=q) |
-                Q(fandoms__name__icontains=q)
-            ).distinct()
+            matching_ids = search.search_story_ids(q)
+            if matching_ids is not None:
+                # Full-text index, best matches first
+                ranking = Case(*[When(pk=pk, then=position) for position, pk in enumerate(matching_ids)])
+                stories = stories.filter(pk__in=matching_ids).order_by(ranking)
+            else:
+                # Search title, author username, tags, fandoms
+                stories = stories.filter(
+                    Q(title__icontains=q) |
+                    Q(author__username__icontains=q) |
+                    Q(tags__name__icontains=q) |
+                    Q(fandoms__name__icontains=q)
+                ).distinct()
 
         if exclude_warnings:
             stories = stories.exclude(warnings__in=exclude_warnings)
@@ -365,15 +417,20 @@ def story_search(request):
         if exclude_genres:
             stories = stories.exclude(genres__in=exclude_genres)
 
+        sort = form.cleaned_data.get('sort')
+        if sort in STORY_SORTS:
+            stories = stories.order_by(f'-{STORY_SORTS[sort]}', '-pk')
+
     context = {
         'form': form,
-        'stories': stories,
+        'stories': feed_queryset(request.user, stories),
     }
     return render(request, 'search_form.html', context)
 
 class notification_list_api(generics.ListAPIView):
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetCursorPagination
 
     def get_queryset(self):
         return Notification.objects.filter(recipient=self.request.user).order_by('-created_at')
@@ -389,8 +446,98 @@ class notification_mark_read_api(generics.UpdateAPIView):
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
         instance.read = True
-        instance.save()
+        instance.save(update_fields=['read'])
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
 
+class chapter_cache_stats_api(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(chapter_cache.stats.as_dict())
+
+
+#autocomplete kinds -> the model whose names are suggested
+AUTOCOMPLETE_MODELS = {'tags': Tag, 'fandoms': Fandom}
+
+
+class autocomplete_api(APIView):
+    """?q=<prefix>&limit=<n> -> the most used tag/fandom names starting with q, from memory."""
+    # anyone may ask, and skipping authentication keeps the session (and the database) out of it
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, kind):
+        if kind not in AUTOCOMPLETE_MODELS:
+            raise NotFound()
+        prefix = request.query_params.get('q', '').strip().lstrip('#').strip()
+        try:
+            limit = int(request.query_params.get('limit', autocomplete.DEFAULT_LIMIT))
+        except ValueError:
+            limit = autocomplete.DEFAULT_LIMIT
+        return Response({'results': autocomplete.suggest(AUTOCOMPLETE_MODELS[kind], prefix, limit)})
+
+
+class notification_unread_count_api(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        unread = Notification.objects.filter(recipient=request.user, read=False).count()
+        return Response({'unread': unread})
+
+
+class notification_mark_all_read_api(APIView):
+    """
+    Marks the user's unread notifications as read with a single UPDATE.
+    Body (all optional): {"ids": [...]} for just those notifications, or
+    {"up_to": id} for that notification and everything older than it.
+    An empty body marks everything read.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = NotificationMarkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data.get('ids')
+        up_to = serializer.validated_data.get('up_to')
+
+        notifications = Notification.objects.filter(recipient=request.user, read=False)
+        if ids is not None:
+            notifications = notifications.filter(pk__in=ids)
+        if up_to is not None:
+            newest = Notification.objects.filter(recipient=request.user, pk=up_to).values('created_at')
+            notifications = notifications.filter(
+                Q(created_at__lt=Subquery(newest)) | Q(created_at=Subquery(newest), pk__lte=up_to)
+            )
+        updated = notifications.update(read=True)
+        return Response({'updated': updated})
+
+
+async def notification_events(user_id, keepalive=STREAM_KEEPALIVE_SECONDS):
+    """Server-Sent Events for user_id: one "notification" event per new notification."""
+    subscription = broker.subscribe(user_id)
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            payload = await subscription.get(timeout=keepalive)
+            if payload is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: notification\ndata: {json.dumps(payload)}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def notification_stream(request):
+    # needs an ASGI server (djangoProject/asgi.py), e.g. uvicorn djangoProject.asgi:application
+    if not isinstance(request, ASGIRequest):
+        # a WSGI worker would be stuck on the stream forever, 204 tells EventSource to stop reconnecting
+        return HttpResponse(status=204)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=403)
+    response = StreamingHttpResponse(notification_events(user.pk), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response